@@ -0,0 +1,56 @@
+"""
+Memory and parse-time report for the sales data: default pd.read_csv versus the schema-based
+ingestion (categorical entities, downcast numerics, integer-coded interaction keys) and its Parquet cache.
+
+Run from the project root:
+    python -m benchmarks.bench_ingestion_memory commodity_sales_data.csv
+"""
+import argparse
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from ingestion import DATE_COLS, load_sales_data, memory_report, read_sales_csv
+
+
+def measure(func, *args):
+    """
+    Run func and return (result, seconds, peak traced MB).
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('csv_path')
+    args = parser.parse_args()
+
+    print(memory_report(args.csv_path).round(2).to_string())
+    cache_dir = tempfile.mkdtemp(prefix='ingest_cache_')
+    try:
+        rows = [
+            ('pd.read_csv (default dtypes)', lambda: pd.read_csv(args.csv_path, parse_dates=DATE_COLS)),
+            ('read_sales_csv (schema)', lambda: read_sales_csv(args.csv_path)),
+            ('load_sales_data (cold cache)', lambda: load_sales_data(args.csv_path, cache_dir)),
+            ('load_sales_data (warm cache)', lambda: load_sales_data(args.csv_path, cache_dir)),
+        ]
+        print(f"\n{'loader':<32} {'seconds':>8} {'peak MB':>9} {'frame MB':>9}")
+        for name, loader in rows:
+            df, seconds, peak = measure(loader)
+            frame_mb = df.memory_usage(index=False, deep=True).sum() / 2**20
+            print(f"{name:<32} {seconds:>8.3f} {peak:>9.1f} {frame_mb:>9.1f}")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
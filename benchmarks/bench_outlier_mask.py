@@ -0,0 +1,88 @@
+"""
+Benchmark the rolling IQR outlier filter against the original row-by-row implementation.
+
+Run from the project root:
+    python -m benchmarks.bench_outlier_mask --rows 10000 100000 1000000
+
+The row-by-row version is quadratic, so it is only timed up to --legacy-max-rows; larger sizes
+report an estimate scaled quadratically from the largest measured run.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from feature_engineering import rolling_iqr_outlier_mask
+
+
+def legacy_rolling_iqr_outlier_mask(df, date_col, target_col, window_months=12):
+    """
+    Original row-by-row implementation, kept as the reference for timings and mask equality.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for idx, row in df.iterrows():
+        end_date = row[date_col] - pd.Timedelta(days=1)
+        start_date = end_date - pd.DateOffset(months=window_months)
+        window = df[(df[date_col] >= start_date) & (df[date_col] <= end_date)][target_col]
+        if len(window) < 10:
+            continue
+        Q1 = window.quantile(0.25)
+        Q3 = window.quantile(0.75)
+        IQR = Q3 - Q1
+        lower = Q1 - 1.5 * IQR
+        upper = Q3 + 1.5 * IQR
+        if not (lower <= row[target_col] <= upper):
+            mask[idx] = False
+    return mask
+
+
+def make_margins(n_rows, months=36, outlier_rate=0.02, seed=42):
+    """
+    Build a date-sorted frame of daily transactions with a share of extreme margins.
+    """
+    rng = np.random.default_rng(seed)
+    days = np.sort(rng.integers(0, months * 30, n_rows))
+    margins = rng.normal(200, 40, n_rows)
+    outliers = rng.random(n_rows) < outlier_rate
+    margins[outliers] *= rng.choice([0.1, 5.0], outliers.sum())
+    return pd.DataFrame({
+        'Transaction_Date': pd.Timestamp('2021-01-01') + pd.to_timedelta(days, unit='D'),
+        'Margin_Per_Unit': margins,
+    })
+
+
+def time_call(func, df):
+    start = time.perf_counter()
+    mask = func(df, 'Transaction_Date', 'Margin_Per_Unit', window_months=12)
+    return mask, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--legacy-max-rows', type=int, default=10_000)
+    args = parser.parse_args()
+
+    reference = None  # (rows, seconds) of the largest measured legacy run
+    print(f"{'rows':>10} {'fast (s)':>10} {'legacy (s)':>12} {'speedup':>9}  note")
+    for n_rows in args.rows:
+        df = make_margins(n_rows)
+        fast_mask, fast_time = time_call(rolling_iqr_outlier_mask, df)
+        if n_rows <= args.legacy_max_rows:
+            legacy_mask, legacy_time = time_call(legacy_rolling_iqr_outlier_mask, df)
+            if not np.array_equal(fast_mask, legacy_mask):
+                raise AssertionError(f"Masks differ at {n_rows} rows")
+            reference = (n_rows, legacy_time)
+            note = 'measured, masks identical'
+        elif reference is not None:
+            legacy_time = reference[1] * (n_rows / reference[0]) ** 2
+            note = f'legacy estimated (quadratic from {reference[0]} rows)'
+        else:
+            legacy_time = np.nan
+            note = 'legacy skipped'
+        print(f"{n_rows:>10} {fast_time:>10.3f} {legacy_time:>12.1f} {legacy_time / fast_time:>8.0f}x  {note}")
+
+
+if __name__ == '__main__':
+    main()
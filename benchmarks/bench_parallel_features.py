@@ -0,0 +1,68 @@
+"""
+Timing of engineer_features with the window features computed in a process pool (n_workers) against
+the serial mode, checking that every run returns bitwise identical features. Workers beyond the number of
+CPUs only add pool overhead, so run it on a multi-core machine to measure a speedup.
+
+Run from the project root:
+    python -m benchmarks.bench_parallel_features --rows 100000 1000000 --workers 1 2 4 8
+
+Only the window features run in parallel (each group family split into one partition per worker by a
+hash of the group key); sorting, outlier removal and the NA fill stay serial.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from benchmarks.synthetic_data import generate_sales_data
+from feature_engineering import engineer_features
+
+
+def bitwise_equal(a, b):
+    """
+    True when both frames have the same columns, dtypes and bit patterns (NaN payloads and -0.0 included).
+    """
+    if list(a.columns) != list(b.columns) or not a.index.equals(b.index):
+        return False
+    for col in a.columns:
+        x, y = a[col], b[col]
+        if x.dtype != y.dtype:
+            return False
+        if x.dtype.kind == 'f':
+            if not np.array_equal(x.to_numpy().view(np.int64), y.to_numpy().view(np.int64)):
+                return False
+        elif not x.equals(y):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000])
+    parser.add_argument('--workers', type=int, nargs='+', default=list(range(1, (os.cpu_count() or 1) + 1)))
+    parser.add_argument('--customers', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs available")
+    print(f"{'rows':>9} {'workers':>8} {'seconds':>9} {'speedup':>8} {'identical':>10}")
+    for n_rows in args.rows:
+        df = generate_sales_data(n_rows, n_customers=args.customers, months=36, seed=0)
+        serial = None
+        baseline = None
+        for n_workers in args.workers:
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result, _ = engineer_features(df.copy(), n_workers=n_workers)
+                times.append(time.perf_counter() - start)
+            seconds = min(times)
+            if serial is None:
+                serial, baseline = result, seconds
+            identical = bitwise_equal(serial, result)
+            print(f"{n_rows:>9} {n_workers:>8} {seconds:>9.3f} {baseline / seconds:>8.2f} {str(identical):>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Measure end-to-end quote latency of the local pricing service through a real HTTP client.
+
+Run from a directory with a model bundle and feature store (after run_pipeline.py):
+    python -m benchmarks.bench_pricing_service --requests 2000 --batch-sizes 1 10 100
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+
+import numpy as np
+
+from pricing_service import COMBO_COLS, load_quote_service, make_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--bundle-root', default='model_bundle')
+    parser.add_argument('--store-dir', default='feature_store')
+    args = parser.parse_args()
+
+    service = load_quote_service(args.bundle_root, args.store_dir)
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    combos = [dict(zip(COMBO_COLS, key)) for key in service.index]
+    rng = np.random.default_rng(0)
+    conn = http.client.HTTPConnection('127.0.0.1', server.server_port)
+    print(f"{len(combos)} indexed combinations")
+    print(f"{'batch':>6} {'p50 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9} {'quotes/s':>10}")
+    try:
+        for batch_size in args.batch_sizes:
+            latencies = []
+            for _ in range(args.requests):
+                quotes = [combos[i] for i in rng.integers(0, len(combos), batch_size)]
+                body = json.dumps({'quotes': quotes})
+                start = time.perf_counter()
+                conn.request('POST', '/quote', body=body, headers={'Content-Type': 'application/json'})
+                response = json.loads(conn.getresponse().read())
+                latencies.append(time.perf_counter() - start)
+                if len(response['results']) != batch_size:
+                    raise AssertionError('Missing quote results')
+            latencies = np.array(latencies) * 1000
+            print(f"{batch_size:>6} {np.percentile(latencies, 50):>9.2f} {np.percentile(latencies, 99):>9.2f} "
+                  f"{latencies.max():>9.2f} {batch_size * 1000 / latencies.mean():>10.0f}")
+    finally:
+        conn.close()
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
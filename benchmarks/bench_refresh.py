@@ -0,0 +1,65 @@
+"""
+Incremental refresh against a full retrain when one new month arrives: time of refresh.refresh_model
+(warm start on the new month) against training.train_final_model (grid search and fit on the whole
+history), and the R2/MAPE/MAE of both on the month after, with the un-updated previous model as reference.
+
+Run from the project root:
+    python -m benchmarks.bench_refresh --rows 100000 --months 24 --trees 25 50 100
+    python -m benchmarks.bench_refresh --param-grid '{"iterations": [200], "depth": [6], "learning_rate": [0.1]}'
+
+The previous model is trained on all months but the last two, the update uses the second-to-last
+month and every model is scored on the last one (the month train_final_model holds out).
+"""
+import argparse
+import json
+import time
+
+from catboost import CatBoostRegressor
+
+from benchmarks.synthetic_data import generate_sales_data
+from feature_engineering import engineer_features
+from refresh import month_metrics, refresh_model
+from training import train_final_model
+from tuning import PARAM_GRID, fit_tuned
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--customers', type=int, default=2000)
+    parser.add_argument('--trees', type=int, nargs='+', default=[25, 50, 100])
+    parser.add_argument('--param-grid', type=json.loads, default=None, help='JSON grid (default: tuning.PARAM_GRID)')
+    args = parser.parse_args()
+    param_grid = args.param_grid or PARAM_GRID
+
+    df = generate_sales_data(args.rows, n_customers=args.customers, months=args.months, seed=0)
+    df_eng, feature_cols = engineer_features(df)
+    target = 'Margin_Per_Unit'
+    last_month = df_eng['YearMonth'].max()
+    previous = df_eng[df_eng['YearMonth'] < last_month - 1]
+    new_month = df_eng[df_eng['YearMonth'] == last_month - 1]
+    test = df_eng[df_eng['YearMonth'] == last_month]
+
+    # The model a previous run would have saved in its bundle
+    previous_model, _ = fit_tuned(CatBoostRegressor, previous[feature_cols], previous[target],
+                                  scoring='neg_mean_absolute_error', param_grid=param_grid, cache_dir=None)
+    rows = [('previous model', 0.0, previous_model)]
+    start = time.perf_counter()
+    full_model, _ = train_final_model(df_eng, feature_cols, 'CatBoost', {'CatBoost': param_grid}, target_col=target,
+                                      cache_dir=None)
+    rows.append(('full retrain', time.perf_counter() - start, full_model))
+    for n_trees in args.trees:
+        start = time.perf_counter()
+        model = refresh_model(previous_model, new_month[feature_cols], new_month[target], n_trees)
+        rows.append((f'refresh +{n_trees} trees', time.perf_counter() - start, model))
+
+    print(f"{len(previous)} history rows, {len(new_month)} new rows, scored on {last_month} ({len(test)} rows)")
+    print(f"{'model':<22} {'seconds':>9} {'r2':>8} {'mape':>8} {'mae':>8}")
+    for name, seconds, model in rows:
+        metrics = month_metrics(test[target], model.predict(test[feature_cols]))
+        print(f"{name:<22} {seconds:>9.2f} {metrics['r2']:>8.4f} {metrics['mape']:>8.4f} {metrics['mae']:>8.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Training time and accuracy of one global CatBoost regressor against per-product sharded regressors
+(sharding.train_sharded) for several process counts, plus the time to retrain a single shard.
+
+Run from the project root:
+    python -m benchmarks.bench_sharding --rows 100000 --products 20 --workers 1 2 4
+    python -m benchmarks.bench_sharding --param-grid '{"iterations": [200], "depth": [6], "learning_rate": [0.1]}'
+
+Every model is trained on all months but the last and scored on the last one. The shards are
+independent tasks, so the sharded time should fall with the workers up to the core count. When every
+product gets a shard, train_sharded's own fallback is trained on all rows (it only prices unseen
+products), so the last run reuses the global model as the fallback instead.
+"""
+import argparse
+import json
+import os
+import time
+
+from catboost import CatBoostRegressor
+
+from benchmarks.synthetic_data import generate_sales_data
+from feature_engineering import engineer_features
+from refresh import month_metrics
+from sharding import MIN_SHARD_ROWS, retrain_shard, train_sharded
+from tuning import PARAM_GRID, fit_tuned
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--products', type=int, default=20)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    parser.add_argument('--min-rows', type=int, default=MIN_SHARD_ROWS)
+    parser.add_argument('--param-grid', type=json.loads, default=None, help='JSON grid (default: tuning.PARAM_GRID)')
+    args = parser.parse_args()
+    param_grid = args.param_grid or PARAM_GRID
+
+    df = generate_sales_data(args.rows, n_products=args.products, months=args.months, seed=0)
+    df_eng, feature_cols = engineer_features(df)
+    target = 'Margin_Per_Unit'
+    last_month = df_eng['YearMonth'].max()
+    train = df_eng[df_eng['YearMonth'] < last_month]
+    test = df_eng[df_eng['YearMonth'] == last_month]
+    tuning_kwargs = {'param_grid': param_grid, 'cache_dir': None}
+
+    rows = []
+    start = time.perf_counter()
+    model, _ = fit_tuned(CatBoostRegressor, train[feature_cols], train[target], 'neg_mean_absolute_error', **tuning_kwargs)
+    rows.append(('global', time.perf_counter() - start, model))
+    for n_workers in args.workers:
+        start = time.perf_counter()
+        model = train_sharded(CatBoostRegressor, train, feature_cols, target, 'neg_mean_absolute_error',
+                              min_rows=args.min_rows, max_workers=n_workers, **tuning_kwargs)
+        rows.append((f'sharded, {n_workers} workers', time.perf_counter() - start, model))
+    start = time.perf_counter()
+    model = train_sharded(CatBoostRegressor, train, feature_cols, target, 'neg_mean_absolute_error',
+                          min_rows=args.min_rows, max_workers=args.workers[-1], fallback=rows[0][2], **tuning_kwargs)
+    rows.append((f'sharded, {args.workers[-1]} workers, global fallback', time.perf_counter() - start, model))
+    shard = max(model.models, key=lambda s: (train['Product_Level_2'] == s).sum())
+    start = time.perf_counter()
+    retrain_shard(model, train, shard, target, args.min_rows, **tuning_kwargs)
+    retrain_seconds = time.perf_counter() - start
+
+    print(f"{len(train)} training rows, {len(model.models)} shards (+ fallback), scored on {last_month} ({len(test)} rows)")
+    print(f"{'model':<36} {'seconds':>9} {'r2':>8} {'mape':>8}")
+    for name, seconds, fitted in rows:
+        metrics = month_metrics(test[target], fitted.predict(test[feature_cols]))
+        print(f"{name:<36} {seconds:>9.2f} {metrics['r2']:>8.4f} {metrics['mape']:>8.4f}")
+    print(f"{'retrain ' + str(shard):<36} {retrain_seconds:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Peak memory and time of building the feature store in memory (update_feature_store on the loaded CSV)
+against the streaming mode (stream_feature_store), for growing histories. Each run happens in its own
+process so its peak RSS is not shared with the others.
+
+Run from the project root:
+    python -m benchmarks.bench_streaming --rows 200000 600000 --months 12 36 --months-per-chunk 1 3
+
+The streaming peak should stay roughly flat as the history grows (it holds the 13-month window plus
+the new months), while the in-memory peak grows with the number of rows. Training is not measured: its
+quantized pool grows with the history in both modes.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic_data import generate_sales_data
+
+_RUN = """
+import json, sys, time
+from instrumentation import peak_rss_mb
+csv_path, store_dir, months_per_chunk = sys.argv[1], sys.argv[2], int(sys.argv[3])
+start = time.perf_counter()
+if months_per_chunk == 0:
+    from ingestion import load_sales_data
+    from feature_store import update_feature_store
+    update_feature_store(load_sales_data(csv_path, cache_dir=None), store_dir)
+else:
+    from streaming import stream_feature_store
+    stream_feature_store(csv_path, store_dir, months_per_chunk=months_per_chunk)
+print(json.dumps({'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()}))
+"""
+
+
+def run_mode(csv_path, store_dir, months_per_chunk):
+    """
+    Build a feature store in a fresh process (months_per_chunk=0 for the in-memory path).
+    Returns {'seconds', 'peak_rss_mb'}.
+    """
+    shutil.rmtree(store_dir, ignore_errors=True)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, '-c', _RUN, csv_path, store_dir, str(months_per_chunk)],
+                         cwd=root, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[200000])
+    parser.add_argument('--months', type=int, nargs='+', default=[36])
+    parser.add_argument('--customers', type=int, default=3000)
+    parser.add_argument('--months-per-chunk', type=int, nargs='+', default=[1, 3])
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'months':>7} {'mode':>12} {'seconds':>9} {'peak_rss_mb':>12}")
+    with tempfile.TemporaryDirectory(prefix='bench_streaming_') as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'sales.csv')
+        store_dir = os.path.join(tmp_dir, 'feature_store')
+        for n_rows in args.rows:
+            for months in args.months:
+                generate_sales_data(n_rows, n_customers=args.customers, months=months, seed=0).to_csv(csv_path, index=False)
+                for months_per_chunk in [0] + args.months_per_chunk:
+                    mode = 'in-memory' if months_per_chunk == 0 else f'stream k={months_per_chunk}'
+                    result = run_mode(csv_path, store_dir, months_per_chunk)
+                    print(f"{n_rows:>9} {months:>7} {mode:>12} {result['seconds']:>9.1f} {result['peak_rss_mb']:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
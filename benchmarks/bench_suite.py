@@ -0,0 +1,340 @@
+"""
+Benchmark suite: times every public function of feature_engineering, binning, pricing_rules and prediction,
+plus the whole staged pipeline, on synthetic data at several scales, and stores the results as JSON.
+
+Run from the project root:
+    python -m benchmarks.bench_suite --rows 10000 100000 --pipeline-rows 5000
+    python -m benchmarks.bench_suite --compare benchmarks/results/<older>.json
+
+Each case is timed --repeat times on fresh inputs (input preparation is not timed); the JSON file
+(benchmarks/results/<timestamp>-<commit>.json) records every timing plus the commit, library versions
+and machine, so two runs can be compared with --compare.
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+import binning
+import feature_engineering
+import prediction
+import pricing_rules
+from benchmarks.synthetic_data import generate_sales_data
+
+RESULTS_DIR = os.path.join('benchmarks', 'results')
+BENCHMARKED_MODULES = [feature_engineering, binning, pricing_rules, prediction]
+
+
+class BenchContext:
+    """
+    Inputs shared by the cases at one scale, built on first use (engineered features, bins, a small model).
+    """
+
+    def __init__(self, n_rows, seed, tmp_dir):
+        self.n_rows = n_rows
+        self.tmp_dir = tmp_dir
+        self.raw = generate_sales_data(n_rows, months=24, seed=seed)
+        self.sorted = self.raw.sort_values('Transaction_Date', kind='mergesort').reset_index(drop=True)
+        self._cache = {}
+
+    def _get(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    @property
+    def engineered(self):
+        return self._get('engineered', lambda: feature_engineering.engineer_features(self.raw.copy()))
+
+    @property
+    def unfilled(self):
+        # Fresh frame with missing rolling features (first transactions of each group) and a categorical key
+        df = feature_engineering.add_rolling_features_12m(self.sorted.copy(), 'Customer_Name', 'Margin_Per_Unit')
+        df['Customer_Product'] = feature_engineering.interaction_key(df, 'Customer_Name', 'Product_Level_2')
+        feature_cols = [c for c in df.columns if c not in ('Transaction_Date', 'Margin_Per_Unit')]
+        return df, feature_cols
+
+    @property
+    def bin_edges(self):
+        return self._get('bin_edges', lambda: binning.fit_product_bins(self.engineered[0]))
+
+    @property
+    def latest(self):
+        def build():
+            df_eng, _ = self.engineered
+            df_binned = binning.assign_product_bins(df_eng.copy(), self.bin_edges)
+            latest = df_binned[df_binned['YearMonth'] == df_binned['YearMonth'].max()].copy()
+            rng = np.random.default_rng(0)
+            latest['Predicted_Bin'] = latest['Margin_Bin']
+            latest['Predicted_Margin_Per_Unit'] = latest['Margin_Per_Unit'] + rng.normal(0, 30, len(latest))
+            return latest
+        return self._get('latest', build)
+
+    @property
+    def min_margin_table(self):
+        return self._get('min_margin_table', lambda: pricing_rules.compute_min_margin_table(self.engineered[0]))
+
+    @property
+    def rule_frame(self):
+        def build():
+            frame = pd.merge(self.latest, self.min_margin_table, on=['Customer_Name', 'Product_Level_2', 'Plant'], how='left')
+            last = pricing_rules.compute_last_margin_table(self.engineered[0])
+            return pd.merge(frame, last, on=['Customer_Name', 'Product_Level_2', 'Plant'], how='left')
+        return self._get('rule_frame', build)
+
+    @property
+    def model(self):
+        def build():
+            from catboost import CatBoostRegressor
+            from tuning import categorical_features
+            df_eng, feature_cols = self.engineered
+            features = feature_cols + ['Predicted_Bin']
+            train = binning.assign_product_bins(df_eng.copy(), self.bin_edges)
+            train['Predicted_Bin'] = train['Margin_Bin']
+            model = CatBoostRegressor(iterations=50, verbose=0, random_state=0,
+                                      cat_features=categorical_features(train[features]) or None)
+            model.fit(train[features], train['Margin_Per_Unit'])
+            return model, features
+        return self._get('model', build)
+
+
+def _rule_case(make_rule):
+    return lambda ctx: partial(make_rule(ctx), ctx.rule_frame, ctx.rule_frame['Predicted_Margin_Per_Unit'].to_numpy())
+
+
+# Each case maps a function name to a setup(ctx) that returns a zero-argument callable with fresh inputs
+CASES = {
+    'feature_engineering': {
+        'rolling_iqr_outlier_mask': lambda ctx: partial(
+            feature_engineering.rolling_iqr_outlier_mask, ctx.sorted, 'Transaction_Date', 'Margin_Per_Unit'),
+        'rolling_window_stats': lambda ctx: partial(
+            feature_engineering.rolling_window_stats, ctx.sorted, 'Customer_Name', 'Margin_Per_Unit'),
+        'add_rolling_features_12m': lambda ctx: partial(
+            feature_engineering.add_rolling_features_12m, ctx.sorted.copy(), 'Customer_Name', 'Margin_Per_Unit'),
+        'add_count_features_12m': lambda ctx: partial(
+            feature_engineering.add_count_features_12m, ctx.sorted.copy(), 'Customer_Name'),
+        'add_target_encoding_12m': lambda ctx: partial(
+            feature_engineering.add_target_encoding_12m, ctx.sorted.copy(), 'Customer_Name'),
+        'add_segment_mean_6m': lambda ctx: partial(
+            feature_engineering.add_segment_mean_6m, ctx.sorted.copy(), 'Product_Level_2', 'Margin_Per_Unit'),
+        'add_recency_weight': lambda ctx: partial(feature_engineering.add_recency_weight, ctx.sorted.copy()),
+        'fill_missing_features': lambda ctx: partial(
+            feature_engineering.fill_missing_features, *ctx.unfilled),
+        'engineer_features': lambda ctx: partial(feature_engineering.engineer_features, ctx.raw.copy()),
+        'window_feature_specs': lambda ctx: partial(feature_engineering.window_feature_specs),
+        'compute_window_features': lambda ctx: partial(
+            feature_engineering.compute_window_features, ctx.sorted,
+            [spec for kind in feature_engineering.window_feature_specs().values() for spec in kind if spec[0] in ctx.sorted],
+            2),
+    },
+    'binning': {
+        'fit_product_bins': lambda ctx: partial(binning.fit_product_bins, ctx.engineered[0]),
+        'pack_bin_edges': lambda ctx: partial(binning.pack_bin_edges, ctx.bin_edges),
+        'save_bin_edges': lambda ctx: partial(binning.save_bin_edges, ctx.bin_edges, os.path.join(ctx.tmp_dir, 'edges.npz')),
+        'load_bin_edges': lambda ctx: (
+            binning.save_bin_edges(ctx.bin_edges, os.path.join(ctx.tmp_dir, 'edges.npz')),
+            partial(binning.load_bin_edges, os.path.join(ctx.tmp_dir, 'edges.npz')))[1],
+        'assign_product_bins': lambda ctx: partial(binning.assign_product_bins, ctx.engineered[0].copy(), ctx.bin_edges),
+        # Scalar lookup: one call per row of the latest month
+        'get_bin_range': lambda ctx: lambda: [
+            binning.get_bin_range(p, int(b), ctx.bin_edges)
+            for p, b in zip(ctx.latest['Product_Level_2'], ctx.latest['Predicted_Bin'])],
+        'get_bin_ranges': lambda ctx: partial(
+            binning.get_bin_ranges, ctx.latest['Product_Level_2'], ctx.latest['Predicted_Bin'].astype(int), ctx.bin_edges),
+    },
+    'pricing_rules': {
+        'compute_min_margin_table': lambda ctx: partial(pricing_rules.compute_min_margin_table, ctx.engineered[0]),
+        'compute_last_margin_table': lambda ctx: partial(pricing_rules.compute_last_margin_table, ctx.engineered[0]),
+        'save_min_margin_table': lambda ctx: partial(
+            pricing_rules.save_min_margin_table, ctx.min_margin_table, os.path.join(ctx.tmp_dir, 'min.parquet')),
+        'load_min_margin_table': lambda ctx: (
+            pricing_rules.save_min_margin_table(ctx.min_margin_table, os.path.join(ctx.tmp_dir, 'min.parquet')),
+            partial(pricing_rules.load_min_margin_table, os.path.join(ctx.tmp_dir, 'min.parquet')))[1],
+        'min_margin_floor': _rule_case(lambda ctx: pricing_rules.min_margin_floor()),
+        'max_change_cap': _rule_case(lambda ctx: pricing_rules.max_change_cap()),
+        'product_ceiling': _rule_case(lambda ctx: pricing_rules.product_ceiling(
+            {p: edges[-1] for p, edges in ctx.bin_edges.items()})),
+        'apply_pricing_rules': lambda ctx: partial(
+            pricing_rules.apply_pricing_rules, ctx.latest.copy(), min_margin_table=ctx.min_margin_table),
+    },
+    'prediction': {
+        'generate_pricelist': lambda ctx: partial(
+            prediction.generate_pricelist, ctx.latest.copy(), ctx.model[0], ctx.model[1], ctx.bin_edges,
+            output_csv=os.path.join(ctx.tmp_dir, 'pricelist.csv'),
+            all_combos_df=ctx.raw[['Customer_Name', 'Product_Level_1', 'Product_Level_2', 'Application', 'Plant']].drop_duplicates()),
+    },
+}
+
+
+def missing_cases():
+    """
+    Public functions of the benchmarked modules that have no case (new functions must be added to CASES).
+    """
+    missing = []
+    for module in BENCHMARKED_MODULES:
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if func.__module__ == module.__name__ and not name.startswith('_') and name not in CASES[module.__name__]:
+                missing.append(f'{module.__name__}.{name}')
+    return missing
+
+
+def _quiet_call(func):
+    # Several functions print progress; keep the benchmark output readable
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            return func()
+        finally:
+            sys.stdout = stdout
+
+
+def time_case(setup, ctx, repeat):
+    """
+    Time setup(ctx)() repeat times on fresh inputs. Returns a result dict (status 'ok' or 'error').
+    """
+    times = []
+    try:
+        for _ in range(repeat):
+            func = setup(ctx)
+            start = time.perf_counter()
+            _quiet_call(func)
+            times.append(time.perf_counter() - start)
+    except Exception as exc:
+        return {'status': 'error', 'error': f'{type(exc).__name__}: {exc}', 'times': times}
+    return {'status': 'ok', 'times': times, 'min': min(times), 'median': float(np.median(times))}
+
+
+def time_pipeline(df, repeat, jobs):
+    """
+    Time the full staged pipeline (run_pipeline.build_stages) without its cache, in a scratch directory
+    so the feature store, tuning cache and model bundle start empty on every repeat.
+    """
+    from pipeline import run_stages
+    from run_pipeline import build_stages
+    times, stages = [], []
+    cwd = os.getcwd()
+    try:
+        for _ in range(repeat):
+            work_dir = tempfile.mkdtemp(prefix='bench_pipeline_')
+            os.chdir(work_dir)
+            try:
+                start = time.perf_counter()
+                run = _quiet_call(lambda: run_stages(build_stages(), {'df': df.copy()}, max_workers=jobs, use_cache=False))
+                times.append(time.perf_counter() - start)
+                stages.append(run.stats)
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(work_dir, ignore_errors=True)
+    except Exception as exc:
+        return {'status': 'error', 'error': f'{type(exc).__name__}: {exc}', 'times': times}
+    return {'status': 'ok', 'times': times, 'min': min(times), 'median': float(np.median(times)), 'stages': stages[-1]}
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _environment():
+    import catboost
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'catboost': catboost.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def compare(base_path, new_path):
+    """
+    Print median times of new_path against base_path (ratio > 1 means new is slower).
+    """
+    with open(base_path) as f:
+        base = {(r['case'], r['rows']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    print(f"{'case':<45} {'rows':>9} {'base (s)':>10} {'new (s)':>10} {'ratio':>7}")
+    for result in new:
+        old = base.get((result['case'], result['rows']))
+        if old is None or 'median' not in old or 'median' not in result:
+            continue
+        ratio = result['median'] / old['median'] if old['median'] > 0 else float('nan')
+        flag = '  <-- slower' if ratio > 1.2 else ''
+        print(f"{result['case']:<45} {result['rows']:>9} {old['median']:>10.4f} {result['median']:>10.4f} {ratio:>7.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--pipeline-rows', type=int, nargs='*', default=[5000],
+                        help='Scales for the whole pipeline (it trains models, so keep these smaller)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=2, help='Concurrent stages in the pipeline run')
+    parser.add_argument('--filter', default=None, help='Only run cases whose name contains this string')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Results file (default: benchmarks/results/<timestamp>-<commit>.json)')
+    parser.add_argument('--compare', default=None, help='Compare against an earlier results file')
+    args = parser.parse_args()
+
+    missing = missing_cases()
+    if missing:
+        print(f"Warning: no benchmark case for {', '.join(missing)}")
+
+    commit = _git_commit()
+    results = []
+    with tempfile.TemporaryDirectory(prefix='bench_suite_') as tmp_dir:
+        for n_rows in args.rows:
+            ctx = BenchContext(n_rows, args.seed, tmp_dir)
+            for module_name, cases in CASES.items():
+                for name, setup in cases.items():
+                    case = f'{module_name}.{name}'
+                    if args.filter and args.filter not in case:
+                        continue
+                    result = {'case': case, 'rows': n_rows, **time_case(setup, ctx, args.repeat)}
+                    results.append(result)
+                    shown = f"{result['median']:.4f} s" if result['status'] == 'ok' else result['error'][:80]
+                    print(f"{case:<45} {n_rows:>9}  {shown}")
+        for n_rows in args.pipeline_rows:
+            if args.filter and args.filter not in 'pipeline':
+                continue
+            df = generate_sales_data(n_rows, months=24, seed=args.seed)
+            result = {'case': 'pipeline.run_stages', 'rows': n_rows, **time_pipeline(df, args.repeat, args.jobs)}
+            results.append(result)
+            shown = f"{result['median']:.4f} s" if result['status'] == 'ok' else result['error'][:80]
+            print(f"{'pipeline.run_stages':<45} {n_rows:>9}  {shown}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'environment': _environment(),
+            'settings': {'rows': args.rows, 'pipeline_rows': args.pipeline_rows, 'repeat': args.repeat,
+                         'jobs': args.jobs, 'seed': args.seed},
+            'results': results
+        }, f, indent=2, default=str)
+    print(f"Results saved to {output}")
+    if args.compare:
+        compare(args.compare, output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Synthetic sales data with the schema of commodity_sales_data.csv, for load tests and benchmarks.
+
+    python -m benchmarks.synthetic_data --rows 1000000 --customers 5000 --months 36 --out synthetic_sales.csv
+
+Margins combine a product base level, customer and plant offsets, a seasonal term and noise; a share of
+rows (outlier_rate) gets an extreme margin. The same arguments and seed always give the same data.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+
+def generate_sales_data(
+    n_rows=10000,
+    n_customers=200,
+    n_products=50,
+    n_families=8,
+    n_applications=10,
+    n_plants=5,
+    months=24,
+    outlier_rate=0.02,
+    start='2022-01-01',
+    seed=0
+):
+    """
+    Generate n_rows transactions spread over `months` months from start, in random (not date) order.
+    Customers and products are drawn with a Zipf-like skew so a few of them dominate, as in real sales.
+    Returns a DataFrame with Customer_Name, Product_Level_1, Product_Level_2, Application, Plant,
+    Transaction_Date, Quantity, Total_Value and Margin_Per_Unit.
+    """
+    rng = np.random.default_rng(seed)
+
+    def skewed_choice(n_values, size):
+        weights = 1.0 / np.arange(1, n_values + 1) ** 0.8
+        return rng.choice(n_values, size, p=weights / weights.sum())
+
+    customer = skewed_choice(n_customers, n_rows)
+    product = skewed_choice(n_products, n_rows)
+    family = rng.integers(0, n_families, n_products)[product]
+    application = rng.integers(0, n_applications, n_rows)
+    plant = rng.integers(0, n_plants, n_rows)
+    start = pd.Timestamp(start)
+    n_days = (start + pd.DateOffset(months=months) - start).days
+    days = rng.integers(0, n_days, n_rows)
+    dates = start + pd.to_timedelta(days, unit='D')
+
+    # Margin = product level + customer and plant offsets + yearly seasonality + noise
+    margin = (
+        rng.uniform(50, 400, n_products)[product]
+        + rng.normal(0, 20, n_customers)[customer]
+        + rng.normal(0, 10, n_plants)[plant]
+        + 15 * np.sin(2 * np.pi * days / 365.25)
+        + rng.normal(0, 25, n_rows)
+    )
+    outliers = rng.random(n_rows) < outlier_rate
+    margin[outliers] *= rng.choice([0.1, 5.0], outliers.sum())
+    margin = np.round(margin, 2)
+    quantity = np.maximum(1, np.round(rng.lognormal(3, 1, n_rows)))
+    unit_cost = rng.uniform(500, 2000, n_products)[product]
+
+    return pd.DataFrame({
+        'Customer_Name': pd.Categorical.from_codes(customer, [f'Customer_{i}' for i in range(n_customers)]).astype(str),
+        'Product_Level_1': pd.Categorical.from_codes(family, [f'Family_{i}' for i in range(n_families)]).astype(str),
+        'Product_Level_2': pd.Categorical.from_codes(product, [f'Product_{i}' for i in range(n_products)]).astype(str),
+        'Application': pd.Categorical.from_codes(application, [f'Application_{i}' for i in range(n_applications)]).astype(str),
+        'Plant': pd.Categorical.from_codes(plant, [f'Plant_{i}' for i in range(n_plants)]).astype(str),
+        'Transaction_Date': dates,
+        'Quantity': quantity,
+        'Total_Value': np.round(quantity * (unit_cost + margin), 2),
+        'Margin_Per_Unit': margin
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--products', type=int, default=50)
+    parser.add_argument('--families', type=int, default=8)
+    parser.add_argument('--applications', type=int, default=10)
+    parser.add_argument('--plants', type=int, default=5)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--outlier-rate', type=float, default=0.02)
+    parser.add_argument('--start', default='2022-01-01')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='synthetic_sales.csv')
+    args = parser.parse_args()
+    df = generate_sales_data(args.rows, args.customers, args.products, args.families, args.applications,
+                             args.plants, args.months, args.outlier_rate, args.start, args.seed)
+    df.to_csv(args.out, index=False, date_format='%Y-%m-%d')
+    print(f"Wrote {len(df)} rows to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
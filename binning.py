@@ -1,40 +1,91 @@
 import pandas as pd
 import numpy as np
+from instrumentation import instrumented
 
+@instrumented
 def fit_product_bins(df, n_bins=5, margin_col='Margin_Per_Unit', product_col='Product_Level_2'):
     """
     Compute bin edges for each product using historical margin data.
+    Quantile-based (equal-sized) bins are computed for all products in one grouped pass;
+    duplicate edges are dropped, as pd.qcut(..., duplicates='drop') does.
     Returns a dict: {product: bin_edges}
     """
+    quantiles = np.linspace(0, 1, n_bins + 1)
+    product_quantiles = df.groupby(product_col, observed=True)[margin_col].quantile(quantiles).unstack()
     bin_edges = {}
-    for product, group in df.groupby(product_col):
-        # Use quantile-based binning (qcut) for equal-sized bins
-        try:
-            edges = pd.qcut(group[margin_col], q=n_bins, retbins=True, duplicates='drop')[1]
-        except ValueError:
-            # If not enough unique values, use min/max
-            edges = np.linspace(group[margin_col].min(), group[margin_col].max(), n_bins+1)
-        bin_edges[product] = edges
+    for product, edges in zip(product_quantiles.index, product_quantiles.to_numpy()):
+        bin_edges[product] = np.unique(edges)
     return bin_edges
 
+def pack_bin_edges(bin_edges):
+    """
+    Pack {product: bin_edges} into one NaN-padded 2-D array indexed by product code.
+    Returns a dict with 'products' (code -> product), 'edges' (n_products x max_edges) and 'n_edges'.
+    """
+    products = list(bin_edges.keys())
+    n_edges = np.array([len(bin_edges[p]) for p in products], dtype=np.int64)
+    edges = np.full((len(products), n_edges.max(initial=0)), np.nan)
+    for code, product in enumerate(products):
+        edges[code, :n_edges[code]] = bin_edges[product]
+    return {'products': np.array(products), 'edges': edges, 'n_edges': n_edges}
+
+def _restore_keys(names, dtype):
+    return pd.Index(names).astype(dtype)
+
+def save_bin_edges(bin_edges, path):
+    """
+    Save bin edges to a compressed .npz file in packed form, so scoring does not need to refit bins.
+    Products are stored as strings plus their dtype, so load_bin_edges returns keys of the same type.
+    """
+    packed = pack_bin_edges(bin_edges)
+    products = pd.Index(list(bin_edges))
+    names = products.astype(str).to_numpy(dtype=str)
+    if not _restore_keys(names, products.dtype).equals(products):
+        raise ValueError(f"Bin edge keys of dtype {products.dtype} do not survive a string round trip.")
+    packed.update(products=names, product_dtype=np.array(str(products.dtype)))
+    np.savez_compressed(path, **packed)
+
+def load_bin_edges(path):
+    """
+    Load bin edges saved with save_bin_edges. Returns a dict: {product: bin_edges}
+    Files saved without the product dtype get string keys.
+    """
+    with np.load(path) as packed:
+        products, edges, n_edges = packed['products'], packed['edges'], packed['n_edges']
+        dtype = str(packed['product_dtype']) if 'product_dtype' in packed else str
+    products = _restore_keys(products, dtype).tolist()
+    return {product: edges[code, :n_edges[code]] for code, product in enumerate(products)}
+
+def _product_codes(products, packed):
+    """
+    Map product values to row codes of the packed edges (-1 if the product has no bins).
+    """
+    return pd.Index(packed['products']).get_indexer(pd.Index(products))
+
+@instrumented
 def assign_product_bins(df, bin_edges, margin_col='Margin_Per_Unit', product_col='Product_Level_2', label_col='Margin_Bin'):
     """
     Assign a bin label (1-n_bins) to each row based on product and margin.
     Adds a new column with bin label.
     """
-    labels = []
-    for idx, row in df.iterrows():
-        product = row[product_col]
-        margin = row[margin_col]
-        edges = bin_edges.get(product)
-        if edges is not None:
-            # Bin label is 1-based (1 to n_bins)
-            bin_label = np.digitize(margin, edges, right=True)
-            # Clamp to 1-n_bins
-            bin_label = max(1, min(len(edges)-1, bin_label))
-        else:
-            bin_label = np.nan
-        labels.append(bin_label)
+    packed = pack_bin_edges(bin_edges)
+    codes = _product_codes(df[product_col], packed)
+    margins = df[margin_col].to_numpy(dtype=float)
+    found = codes >= 0
+    edges = packed['edges'][codes[found]]
+    n_edges = packed['n_edges'][codes[found]]
+    margin = margins[found]
+    # Same as np.digitize(margin, edges, right=True): count the edges strictly below the margin
+    # (NaN padding never counts; a NaN margin falls past the last edge)
+    bin_label = (edges < margin[:, None]).sum(axis=1)
+    bin_label = np.where(np.isnan(margin), n_edges, bin_label)
+    # Bin label is 1-based; clamp to 1-n_bins
+    bin_label = np.maximum(1, np.minimum(n_edges - 1, bin_label))
+    if found.all():
+        labels = bin_label
+    else:
+        labels = np.full(len(df), np.nan)
+        labels[found] = bin_label
     df[label_col] = labels
     return df
 
@@ -45,4 +96,20 @@ def get_bin_range(product, bin_label, bin_edges):
     edges = bin_edges.get(product)
     if edges is None or bin_label < 1 or bin_label > len(edges)-1:
         return (np.nan, np.nan)
-    return (edges[bin_label-1], edges[bin_label]) 
\ No newline at end of file
+    return (edges[bin_label-1], edges[bin_label])
+
+def get_bin_ranges(products, bin_labels, bin_edges):
+    """
+    Vectorized get_bin_range: price ranges for arrays of products and integer bin labels.
+    Returns two numpy arrays (min, max); NaN where the product or bin label is unknown.
+    """
+    packed = pack_bin_edges(bin_edges)
+    codes = _product_codes(products, packed)
+    bin_labels = np.asarray(bin_labels, dtype=np.int64)
+    valid = codes >= 0
+    valid[valid] = (bin_labels[valid] >= 1) & (bin_labels[valid] <= packed['n_edges'][codes[valid]] - 1)
+    min_range = np.full(len(codes), np.nan)
+    max_range = np.full(len(codes), np.nan)
+    min_range[valid] = packed['edges'][codes[valid], bin_labels[valid] - 1]
+    max_range[valid] = packed['edges'][codes[valid], bin_labels[valid]]
+    return min_range, max_range
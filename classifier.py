@@ -1,31 +1,34 @@
 import pandas as pd
 from catboost import CatBoostClassifier
-from sklearn.model_selection import GridSearchCV
+from instrumentation import instrumented
 
 
-def train_bin_classifier(df, feature_cols, label_col='Margin_Bin'):
+def train_bin_classifier(df, feature_cols, label_col='Margin_Bin', shard_col=None, **tuning_kwargs):
     """
-    Train a CatBoostClassifier to predict margin bins, using GridSearchCV for hyperparameter tuning.
+    Train a CatBoostClassifier to predict margin bins, tuning hyperparameters with tuning.fit_tuned
+    (cross-validated search with balanced parallelism and cached best params).
+    Extra keyword arguments (e.g. search='halving', early_stopping_rounds=50) are passed to the tuner.
+    With shard_col (e.g. 'Product_Level_2') one model per value is trained in parallel by
+    sharding.train_sharded (min_rows and max_workers are passed to it) and a ShardedModel is returned.
     Returns the best trained model.
     """
+    if shard_col is not None:
+        from sharding import train_sharded
+        return train_sharded(CatBoostClassifier, df, feature_cols, label_col, 'accuracy', shard_col, **tuning_kwargs)
+    # Imported here so scoring (predict_*) does not pull in scikit-learn
+    from tuning import fit_tuned
     X = df[feature_cols]
     y = df[label_col]
-    model = CatBoostClassifier(verbose=0, random_state=42)
-    param_grid = {
-        'iterations': [100, 200],
-        'depth': [6, 8],
-        'learning_rate': [0.05, 0.1]
-    }
-    grid = GridSearchCV(model, param_grid, cv=3, scoring='accuracy', n_jobs=-1)
-    grid.fit(X, y)
-    print(f"Best CatBoostClassifier params: {grid.best_params_}")
-    return grid.best_estimator_
+    model, best_params = fit_tuned(CatBoostClassifier, X, y, scoring='accuracy', **tuning_kwargs)
+    print(f"Best CatBoostClassifier params: {best_params}")
+    return model
 
 
+@instrumented
 def predict_bin(model, df, feature_cols):
     """
     Predict margin bins for new data using the trained classifier.
     Returns predicted bin labels (as a numpy array).
     """
     X = df[feature_cols]
-    return model.predict(X) 
\ No newline at end of file
+    return model.predict(X)
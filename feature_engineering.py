@@ -1,94 +1,283 @@
+import os
+import tempfile
+
 import pandas as pd
 import numpy as np
+from pandas.api.indexers import BaseIndexer
+from ingestion import interaction_key
+from instrumentation import instrumented
+from parallel import process_pool
 
+@instrumented
 def rolling_iqr_outlier_mask(df, date_col, target_col, window_months=12):
     """
     Remove outliers using a rolling 12-month IQR window, strictly using only past data for each row.
-    Returns a boolean mask for rows to keep.
+    Rows are processed date by date on a date-sorted copy, so the quartiles of each window are computed
+    once per distinct date and shared by every row on that date.
+    Returns a boolean mask (aligned with the rows of df) for rows to keep.
     """
-    mask = np.ones(len(df), dtype=bool)
-    for idx, row in df.iterrows():
-        end_date = row[date_col] - pd.Timedelta(days=1)
-        start_date = end_date - pd.DateOffset(months=window_months)
-        window = df[(df[date_col] >= start_date) & (df[date_col] <= end_date)][target_col]
-        if len(window) < 10:
+    dates = df[date_col].to_numpy(dtype='datetime64[ns]')
+    values = df[target_col].to_numpy(dtype=float)
+    order = np.argsort(dates, kind='mergesort')
+    dates = dates[order]
+    values = values[order]
+    # NaT sorts last; such rows have no window and are always kept
+    n_valid = int(np.count_nonzero(~np.isnat(dates)))
+    dates = dates[:n_valid]
+    values = values[:n_valid]
+    # Quartiles skip missing targets, but the 10-observation minimum counts every row in the window
+    not_nan = ~np.isnan(values)
+    observed_dates = dates[not_nan]
+    observed_values = values[not_nan]
+    unique_dates, first_pos = np.unique(dates, return_index=True)
+    ends = pd.DatetimeIndex(unique_dates) - pd.Timedelta(days=1)
+    starts = (ends - pd.DateOffset(months=window_months)).to_numpy()
+    ends = ends.to_numpy()
+    window_lo = np.searchsorted(dates, starts, side='left')
+    window_hi = np.searchsorted(dates, ends, side='right')
+    observed_lo = np.searchsorted(observed_dates, starts, side='left')
+    observed_hi = np.searchsorted(observed_dates, ends, side='right')
+    row_bounds = np.r_[first_pos, n_valid]
+    keep_sorted = np.ones(n_valid, dtype=bool)
+    for i in range(len(unique_dates)):
+        if window_hi[i] - window_lo[i] < 10:
             continue
-        Q1 = window.quantile(0.25)
-        Q3 = window.quantile(0.75)
+        window = observed_values[observed_lo[i]:observed_hi[i]]
+        if len(window) == 0:
+            Q1 = Q3 = np.nan
+        else:
+            Q1, Q3 = np.quantile(window, [0.25, 0.75])
         IQR = Q3 - Q1
         lower = Q1 - 1.5 * IQR
         upper = Q3 + 1.5 * IQR
-        if not (lower <= row[target_col] <= upper):
-            mask[idx] = False
+        rows = values[row_bounds[i]:row_bounds[i + 1]]
+        keep_sorted[row_bounds[i]:row_bounds[i + 1]] = (lower <= rows) & (rows <= upper)
+    mask = np.ones(len(df), dtype=bool)
+    mask[order[:n_valid]] = keep_sorted
     return mask
 
+class _WindowBoundsIndexer(BaseIndexer):
+    """
+    Rolling indexer that hands precomputed [start, end) row bounds to pandas' rolling aggregations.
+    """
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        return self.start, self.end
+
+def _past_window_bounds(df, group_col, months, date_col='Transaction_Date'):
+    """
+    Locate the strictly-past window of every row: rows of the same group dated within
+    [date - 1 day - months, date - 1 day]. df must already be sorted by date_col.
+    Returns (order, start, end): order lays the rows out group by group (date order kept inside each
+    group), and start/end are half-open bounds into that layout, one pair per laid-out row.
+    """
+    codes = pd.factorize(df[group_col])[0]
+    dates = df[date_col].to_numpy(dtype='datetime64[ns]')
+    # Stable sort keeps the frame's date order (and tie order) inside each group
+    order = np.argsort(codes, kind='mergesort')
+    codes = codes[order]
+    dates = dates[order]
+    ends = pd.DatetimeIndex(dates) - pd.Timedelta(days=1)
+    starts = (ends - pd.DateOffset(months=months)).to_numpy()
+    ends = ends.to_numpy()
+    n = len(order)
+    # Empty windows point at the row itself so bounds stay monotonic for the rolling kernels
+    start = np.arange(n, dtype=np.int64)
+    end = np.arange(n, dtype=np.int64)
+    group_breaks = np.flatnonzero(np.diff(codes)) + 1
+    for lo, hi in zip(np.r_[0, group_breaks], np.r_[group_breaks, n]):
+        if lo == hi or codes[lo] < 0:
+            # Missing group keys never match any row
+            continue
+        group_dates = dates[lo:hi]
+        # Sorting by date puts NaT last, so valid dates form a prefix of the group
+        n_valid = int(np.count_nonzero(~np.isnat(group_dates)))
+        valid_dates = group_dates[:n_valid]
+        start[lo:lo + n_valid] = lo + np.searchsorted(valid_dates, starts[lo:lo + n_valid], side='left')
+        end[lo:lo + n_valid] = lo + np.searchsorted(valid_dates, ends[lo:lo + n_valid], side='right')
+    return order, start, end
+
+def rolling_window_stats(df, group_col, target=None, months=12, stats=('mean', 'std', 'lag1', 'count'), date_col='Transaction_Date'):
+    """
+    Compute rolling statistics over the last `months` months per group_col, using only past data
+    (the window of a row ends the day before its date). df must already be sorted by date_col.
+    Supported stats: 'mean', 'std', 'lag1' (last value in the window) and 'count' (rows in the window).
+    All statistics come from one sorted pass per group instead of re-filtering the frame per row.
+    Returns a dict {stat: numpy array aligned with the rows of df}.
+    """
+    order, start, end = _past_window_bounds(df, group_col, months, date_col)
+    values = None if target is None else df[target].to_numpy(dtype=float)[order]
+    indexer = _WindowBoundsIndexer(start=start, end=end)
+    result = {}
+    for stat in stats:
+        if stat == 'count':
+            laid_out = (end - start).astype(np.int64)
+        elif stat == 'lag1':
+            laid_out = np.where(end > start, values[np.maximum(end - 1, 0)], np.nan)
+        elif stat in ('mean', 'std'):
+            rolling = pd.Series(values).rolling(indexer, min_periods=1)
+            laid_out = getattr(rolling, stat)().to_numpy()
+        else:
+            raise ValueError(f"Unknown rolling statistic: {stat}")
+        out = np.empty_like(laid_out)
+        out[order] = laid_out
+        result[stat] = out
+    return result
+
+@instrumented
 def add_rolling_features_12m(df, group_col, target):
     """
     Add 12-month rolling mean, std, and lag1 for target at group_col level, using only past data.
     """
-    df = df.sort_values(['Transaction_Date'])
-    roll_mean = []
-    roll_std = []
-    lag1 = []
-    for idx, row in df.iterrows():
-        end_date = row['Transaction_Date'] - pd.Timedelta(days=1)
-        start_date = end_date - pd.DateOffset(months=12)
-        window = df[(df[group_col] == row[group_col]) & (df['Transaction_Date'] >= start_date) & (df['Transaction_Date'] <= end_date)][target]
-        roll_mean.append(window.mean() if len(window) > 0 else np.nan)
-        roll_std.append(window.std() if len(window) > 0 else np.nan)
-        lag1.append(window.iloc[-1] if len(window) > 0 else np.nan)
-    df[f'{group_col}_margin_rollmean_12m'] = roll_mean
-    df[f'{group_col}_margin_rollstd_12m'] = roll_std
-    df[f'{group_col}_margin_lag1_12m'] = lag1
+    df = df.sort_values(['Transaction_Date'], kind='mergesort')
+    stats = rolling_window_stats(df, group_col, target, months=12, stats=('mean', 'std', 'lag1'))
+    df[f'{group_col}_margin_rollmean_12m'] = stats['mean']
+    df[f'{group_col}_margin_rollstd_12m'] = stats['std']
+    df[f'{group_col}_margin_lag1_12m'] = stats['lag1']
     return df
 
+@instrumented
 def add_count_features_12m(df, group_col):
     """
     Add 12-month rolling transaction count for group_col, using only past data.
     """
-    df = df.sort_values(['Transaction_Date'])
-    txn_count = []
-    for idx, row in df.iterrows():
-        end_date = row['Transaction_Date'] - pd.Timedelta(days=1)
-        start_date = end_date - pd.DateOffset(months=12)
-        window = df[(df[group_col] == row[group_col]) & (df['Transaction_Date'] >= start_date) & (df['Transaction_Date'] <= end_date)]
-        txn_count.append(len(window))
-    df[f'{group_col}_txn_count_12m'] = txn_count
+    df = df.sort_values(['Transaction_Date'], kind='mergesort')
+    stats = rolling_window_stats(df, group_col, months=12, stats=('count',))
+    df[f'{group_col}_txn_count_12m'] = stats['count']
     return df
 
+@instrumented
 def add_target_encoding_12m(df, group_col):
     """
     Add 12-month rolling mean target encoding for group_col, using only past data.
     """
-    df = df.sort_values(['Transaction_Date'])
-    target_enc = []
-    for idx, row in df.iterrows():
-        end_date = row['Transaction_Date'] - pd.Timedelta(days=1)
-        start_date = end_date - pd.DateOffset(months=12)
-        window = df[(df[group_col] == row[group_col]) & (df['Transaction_Date'] >= start_date) & (df['Transaction_Date'] <= end_date)]['Margin_Per_Unit']
-        target_enc.append(window.mean() if len(window) > 0 else np.nan)
-    df[f'{group_col}_target_enc_12m'] = target_enc
+    df = df.sort_values(['Transaction_Date'], kind='mergesort')
+    stats = rolling_window_stats(df, group_col, 'Margin_Per_Unit', months=12, stats=('mean',))
+    df[f'{group_col}_target_enc_12m'] = stats['mean']
     return df
 
+@instrumented
 def add_segment_mean_6m(df, seg_col, target):
     """
     Add last 6 months mean margin per unit for segment column, using only past data.
     """
-    df = df.sort_values(['Transaction_Date'])
-    seg_mean_6m = []
-    for idx, row in df.iterrows():
-        end_date = row['Transaction_Date'] - pd.Timedelta(days=1)
-        start_date = end_date - pd.DateOffset(months=6)
-        window = df[(df[seg_col] == row[seg_col]) & (df['Transaction_Date'] >= start_date) & (df['Transaction_Date'] <= end_date)][target]
-        seg_mean_6m.append(window.mean() if len(window) > 0 else np.nan)
-    df[f'{seg_col}_mean_margin_6m'] = seg_mean_6m
+    df = df.sort_values(['Transaction_Date'], kind='mergesort')
+    stats = rolling_window_stats(df, seg_col, target, months=6, stats=('mean',))
+    df[f'{seg_col}_mean_margin_6m'] = stats['mean']
     return df
 
-def add_recency_weight(df, date_col='Transaction_Date'):
+def window_feature_specs(segment1='segment1_product_plant', segment2='segment2_product_application', target='Margin_Per_Unit'):
+    """
+    The window features engineer_features adds, by kind, as (group_col, target, months, {stat: column}) tuples
+    in the order the add_* helpers add them.
+    """
+    return {
+        'rolling': [(col, target, 12, {'mean': f'{col}_margin_rollmean_12m', 'std': f'{col}_margin_rollstd_12m',
+                                       'lag1': f'{col}_margin_lag1_12m'})
+                    for col in ['Product_Level_2', 'Customer_Name', 'Plant']],
+        'segment': [(col, target, 6, {'mean': f'{col}_mean_margin_6m'}) for col in [segment1, segment2]],
+        'count': [(col, None, 12, {'count': f'{col}_txn_count_12m'}) for col in ['Customer_Name', 'Product_Level_2', 'Plant']],
+        'target_enc': [(col, target, 12, {'mean': f'{col}_target_enc_12m'})
+                       for col in ['Customer_Name', 'Product_Level_2', 'Plant', 'Customer_Product', 'Product_Plant']]
+    }
+
+@instrumented
+def _window_family_task(work_dir, family, part, months, stats, has_target):
+    """
+    Worker: compute the window stats of one partition of a group family from the memory-mapped inputs in
+    work_dir (the rows listed in rows-{family}-{part}.npy) and write each stat to its own .npy file there.
+    Only file names cross the process boundary.
+    """
+    rows = np.load(os.path.join(work_dir, f'rows-{family}-{part}.npy'))
+    frame = pd.DataFrame({
+        'date': np.load(os.path.join(work_dir, 'dates.npy'), mmap_mode='r')[rows],
+        'group': np.load(os.path.join(work_dir, f'group-{family}.npy'), mmap_mode='r')[rows]
+    })
+    target = None
+    if has_target:
+        frame['target'] = np.load(os.path.join(work_dir, 'target.npy'), mmap_mode='r')[rows]
+        target = 'target'
+    result = rolling_window_stats(frame, 'group', target, months=months, stats=stats, date_col='date')
+    for stat, values in result.items():
+        np.save(os.path.join(work_dir, f'out-{family}-{part}-{stat}.npy'), values)
+    return family, part
+
+@instrumented
+def compute_window_features(df, specs, n_workers=None, group_values=None, date_col='Transaction_Date'):
+    """
+    Compute window features (specs as from window_feature_specs, flattened) in a process pool. Each group
+    family (group column and window length) is split into n_workers partitions by a hash of the group key,
+    so one large family spreads over every worker; a window never crosses groups, so the partitions are
+    independent. Dates, target and factorized group keys are written once to memory-mapped .npy files (in
+    /dev/shm when available) that the workers open read-only, and results come back the same way, so no
+    frame is pickled. Each partition keeps its groups' rows in date order and pandas' rolling kernels restart
+    their sums at every group boundary, so the values are bitwise identical to the serial add_* helpers.
+    df must be sorted by date_col; group_values maps extra group columns (not in df) to their values.
+    Returns a dict {column: numpy array aligned with the rows of df}.
+    """
+    group_values = group_values or {}
+    n_parts = n_workers or os.cpu_count() or 1
+    # Merge specs sharing group, target and window length (e.g. 12m mean and target encoding)
+    families = {}
+    for group_col, target, months, columns in specs:
+        family = families.setdefault((group_col, months), {'target': None, 'columns': {}})
+        if target is not None:
+            if family['target'] not in (None, target):
+                raise ValueError(f"Window specs for {group_col} use different targets")
+            family['target'] = target
+        for stat, column in columns.items():
+            family['columns'].setdefault(stat, []).append(column)
+    targets = {f['target'] for f in families.values() if f['target'] is not None}
+    if len(targets) > 1:
+        raise ValueError(f"Window specs use several targets: {sorted(targets)}")
+    shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    result = {}
+    with tempfile.TemporaryDirectory(prefix='window_features_', dir=shm_dir) as work_dir:
+        np.save(os.path.join(work_dir, 'dates.npy'), df[date_col].to_numpy(dtype='datetime64[ns]'))
+        if targets:
+            np.save(os.path.join(work_dir, 'target.npy'), df[targets.pop()].to_numpy(dtype=float))
+        tasks = []
+        partitions = {}
+        for i, ((group_col, months), family) in enumerate(families.items()):
+            values = group_values[group_col] if group_col in group_values else df[group_col]
+            # Factorized codes with NaN for missing keys: workers regroup them exactly like the original values
+            group_codes = pd.factorize(values)[0]
+            codes = group_codes.astype(float)
+            codes[group_codes < 0] = np.nan
+            np.save(os.path.join(work_dir, f'group-{i}.npy'), codes)
+            # Hashing the group code sends every row of a group to the same partition (missing keys share one)
+            part_of_row = pd.util.hash_array(group_codes.astype(np.int64)) % n_parts
+            partitions[i] = []
+            for part in range(n_parts):
+                rows = np.flatnonzero(part_of_row == part)
+                if len(rows) == 0:
+                    continue
+                np.save(os.path.join(work_dir, f'rows-{i}-{part}.npy'), rows)
+                partitions[i].append((part, rows))
+                tasks.append((i, part, months, tuple(family['columns']), family['target'] is not None))
+        with process_pool(n_workers) as pool:
+            futures = [pool.submit(_window_family_task, work_dir, *task) for task in tasks]
+            for future in futures:
+                future.result()
+        for i, family in enumerate(families.values()):
+            for stat, columns in family['columns'].items():
+                values = None
+                for part, rows in partitions[i]:
+                    part_values = np.load(os.path.join(work_dir, f'out-{i}-{part}-{stat}.npy'))
+                    if values is None:
+                        values = np.empty(len(df), dtype=part_values.dtype)
+                    values[rows] = part_values
+                for column in columns:
+                    result[column] = values
+    return result
+
+@instrumented
+def add_recency_weight(df, date_col='Transaction_Date', latest_month=None):
     """
     Add a recency weight feature: 1 for current month, 0.9 for previous, 0.8 for two months ago, etc.
+    The current month is the latest one in df unless latest_month (a monthly Period) is given.
     """
-    latest_month = df[date_col].max().to_period('M')
+    if latest_month is None:
+        latest_month = df[date_col].max().to_period('M')
     recency_weights = []
     for d in df[date_col]:
         months_ago = (latest_month.year - d.year) * 12 + (latest_month.month - d.month)
@@ -97,14 +286,42 @@ def add_recency_weight(df, date_col='Transaction_Date'):
     df['Recency_Weight'] = recency_weights
     return df
 
-def engineer_features(df):
+def fill_missing_features(df, feature_cols):
+    """
+    Fill NA in feature_cols: -1 for numeric features, '-1' for categorical/string ones so each column keeps a single type.
+    """
+    for col in feature_cols:
+        if pd.api.types.is_numeric_dtype(df[col]) or not df[col].isna().any():
+            continue
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and '-1' not in df[col].cat.categories:
+            df[col] = df[col].cat.add_categories(['-1'])
+        df[col] = df[col].fillna('-1')
+    df[feature_cols] = df[feature_cols].fillna(-1)
+    return df
+
+@instrumented
+def engineer_features(df, history=None, remove_outliers=True, n_workers=1):
     """
     Main feature engineering pipeline. Returns engineered DataFrame and feature list.
+    history: optional outlier-free raw transactions preceding df (at least the last 12 months). They are
+    only used as rolling-window context; the returned frame holds the rows of df alone.
+    remove_outliers: set to False when df has already been filtered with rolling_iqr_outlier_mask.
+    n_workers: above 1, the window features are computed by group family in that many processes
+    (compute_window_features); the result is identical to the serial one.
     """
-    df = df.sort_values('Transaction_Date').reset_index(drop=True)
+    # Stable sort so rows sharing a date keep a reproducible order (lag1 picks the last of them)
+    df = df.sort_values('Transaction_Date', kind='mergesort').reset_index(drop=True)
     # Outlier removal
-    outlier_mask = rolling_iqr_outlier_mask(df, 'Transaction_Date', 'Margin_Per_Unit', window_months=12)
-    df = df[outlier_mask].reset_index(drop=True)
+    if remove_outliers:
+        outlier_mask = rolling_iqr_outlier_mask(df, 'Transaction_Date', 'Margin_Per_Unit', window_months=12)
+        df = df[outlier_mask].reset_index(drop=True)
+    is_new = None
+    if history is not None:
+        n_history = len(history)
+        df = pd.concat([history, df], ignore_index=True).sort_values('Transaction_Date', kind='mergesort')
+        # Remember which rows came from df; the add_* helpers below preserve index labels
+        is_new = df.index.to_numpy() >= n_history
+        df = df.reset_index(drop=True)
     # Date features
     df['Year'] = df['Transaction_Date'].dt.year
     df['Month'] = df['Transaction_Date'].dt.month
@@ -113,33 +330,55 @@ def engineer_features(df):
     df['Is_End_of_Quarter'] = df['Transaction_Date'].dt.is_quarter_end.astype(int)
     df['Is_End_of_Year'] = df['Transaction_Date'].dt.is_year_end.astype(int)
     df['YearMonth'] = df['Transaction_Date'].dt.to_period('M')
+    # Interaction keys (categoricals built from integer codes, not per-row string concatenation)
+    segment1 = 'segment1_product_plant'
+    segment2 = 'segment2_product_application'
+    interactions = {
+        'Customer_Product': interaction_key(df, 'Customer_Name', 'Product_Level_2'),
+        'Product_Plant': interaction_key(df, 'Product_Level_2', 'Plant'),
+        segment2: interaction_key(df, 'Product_Level_2', 'Application')
+    }
+    interactions[segment1] = interactions['Product_Plant']
+    specs = window_feature_specs(segment1, segment2)
+    # Parallel mode computes every window feature up front; the columns are then added in serial order
+    window = None
+    if n_workers is not None and n_workers > 1:
+        window = compute_window_features(df, [spec for kind in specs.values() for spec in kind], n_workers, interactions)
+
+    def add_window(kind, add_func, *args):
+        if window is None:
+            return add_func(df, *args)
+        group_col = args[0]
+        columns = next(columns for col, _, _, columns in specs[kind] if col == group_col)
+        return df.assign(**{column: window[column] for column in columns.values()})
+
     # Rolling/lag features
     for col in ['Product_Level_2', 'Customer_Name', 'Plant']:
-        df = add_rolling_features_12m(df, col, 'Margin_Per_Unit')
+        df = add_window('rolling', add_rolling_features_12m, col, 'Margin_Per_Unit')
     # Interaction features
-    df['Customer_Product'] = df['Customer_Name'] + '_' + df['Product_Level_2']
-    df['Product_Plant'] = df['Product_Level_2'] + '_' + df['Plant']
+    df['Customer_Product'] = interactions['Customer_Product']
+    df['Product_Plant'] = interactions['Product_Plant']
     # Segment features
-    segment1 = 'segment1_product_plant'
-    segment2 = 'segment2_product_application'
-    df[segment1] = df['Product_Level_2'] + '_' + df['Plant']
-    df[segment2] = df['Product_Level_2'] + '_' + df['Application']
-    df = add_segment_mean_6m(df, segment1, 'Margin_Per_Unit')
-    df = add_segment_mean_6m(df, segment2, 'Margin_Per_Unit')
+    df[segment1] = interactions[segment1]
+    df[segment2] = interactions[segment2]
+    df = add_window('segment', add_segment_mean_6m, segment1, 'Margin_Per_Unit')
+    df = add_window('segment', add_segment_mean_6m, segment2, 'Margin_Per_Unit')
     # Frequency/count features
     for col in ['Customer_Name', 'Product_Level_2', 'Plant']:
-        df = add_count_features_12m(df, col)
+        df = add_window('count', add_count_features_12m, col)
     # Target encoding
     for col in ['Customer_Name', 'Product_Level_2', 'Plant', 'Customer_Product', 'Product_Plant']:
-        df = add_target_encoding_12m(df, col)
+        df = add_window('target_enc', add_target_encoding_12m, col)
     # Remove old rolling/count/target enc features (if any)
     old_features = [c for c in df.columns if ('rollmean_' in c and not c.endswith('12m')) or ('rollstd_' in c and not c.endswith('12m')) or ('lag1' in c and not c.endswith('12m')) or ('txn_count_' in c and not c.endswith('12m')) or ('target_enc' in c and not c.endswith('12m'))]
     df = df.drop(columns=old_features)
+    # Drop the history rows that were only needed as window context
+    if is_new is not None:
+        df = df[is_new[df.index.to_numpy()]].reset_index(drop=True)
     # Add recency weight
     df = add_recency_weight(df, 'Transaction_Date')
     # Prepare feature list
     drop_cols = ['Transaction_Date', 'Margin_Per_Unit', 'Total_Value', 'Quantity', 'YearMonth']
     feature_cols = [c for c in df.columns if c not in drop_cols]
-    # Fill NA
-    df[feature_cols] = df[feature_cols].fillna(-1)
+    df = fill_missing_features(df, feature_cols)
     return df, feature_cols 
\ No newline at end of file
@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from feature_engineering import engineer_features, rolling_iqr_outlier_mask, add_recency_weight
+from instrumentation import instrumented
+
+# Months of stored history needed to compute the features of a new month: the 12-month windows
+# end the day before each transaction, so they can reach back into a 13th calendar month.
+CONTEXT_MONTHS = 13
+OUTLIER_FLAG_COL = 'Is_Outlier'
+
+
+def _partition_path(store_dir, kind, month):
+    return os.path.join(store_dir, kind, f'YearMonth={month}', 'part-0.parquet')
+
+
+def _read_meta(store_dir):
+    meta_path = os.path.join(store_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def _write_meta(store_dir, meta):
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def month_hashes(df):
+    """
+    Content hash of the raw rows of each month of df: {month: hex digest}.
+    Rows are taken in stable date order and values are normalized (numerics as float64, other
+    columns as objects), so the same data hashes the same whatever its column order or dtypes.
+    """
+    df = df.sort_values('Transaction_Date', kind='mergesort')
+    canonical = pd.DataFrame(index=df.index)
+    for col in sorted(df.columns):
+        values = df[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            canonical[col] = values.astype('datetime64[ns]')
+        elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            canonical[col] = values.astype(np.float64)
+        else:
+            canonical[col] = values.astype(object).where(values.notna(), None)
+    row_hashes = pd.util.hash_pandas_object(canonical, index=False).to_numpy()
+    months = df['Transaction_Date'].dt.to_period('M').to_numpy()
+    hashes = {}
+    for month, rows in pd.Series(np.arange(len(df))).groupby(months, sort=True).indices.items():
+        digest = hashlib.sha256(','.join(sorted(canonical.columns)).encode())
+        digest.update(row_hashes[rows].tobytes())
+        hashes[str(month)] = digest.hexdigest()
+    return hashes
+
+
+def _first_stale_month(hashes, meta):
+    """
+    Oldest month from which the store must be recomputed to match input months with the given hashes:
+    the first month whose hash changed or that is missing on either side, and at most the last stored
+    month, which is always recomputed (it may have been stored before it was complete).
+    """
+    stored = meta['hashes']
+    changed = [m for m in set(hashes) | set(meta['months']) if hashes.get(m) != stored.get(m)]
+    return min(pd.Period(m, freq='M') for m in changed + [meta['months'][-1]])
+
+
+def truncate_store(store_dir, hashes):
+    """
+    Cut the store back to the months whose raw input is unchanged, given the input's month_hashes.
+    Partitions from the first stale month on (see _first_stale_month) are deleted. Returns that month,
+    from which the input must be appended again, or None when the store has to be built from scratch:
+    there is none, it has no hashes, or its first month changed.
+    """
+    meta = _read_meta(store_dir)
+    if meta is None or not meta.get('hashes') or not meta['months']:
+        return None
+    first = _first_stale_month(hashes, meta)
+    if first <= pd.Period(meta['months'][0], freq='M'):
+        return None
+    dropped = [m for m in meta['months'] if pd.Period(m, freq='M') >= first]
+    for month in dropped:
+        for kind in ('raw', 'features'):
+            shutil.rmtree(os.path.dirname(_partition_path(store_dir, kind, month)), ignore_errors=True)
+        meta['hashes'].pop(month, None)
+    meta['months'] = [m for m in meta['months'] if m not in dropped]
+    _write_meta(store_dir, meta)
+    print(f"Feature store: recomputing from {first} ({len(dropped)} stored months dropped).")
+    return first
+
+
+def _write_partitions(store_dir, kind, df):
+    """
+    Write one Parquet file per YearMonth of df under store_dir/kind/YearMonth=<month>/.
+    """
+    months = df['Transaction_Date'].dt.to_period('M')
+    for month, part in df.groupby(months, sort=True):
+        path = _partition_path(store_dir, kind, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part.to_parquet(path, index=False)
+
+
+def concat_partitions(parts):
+    """
+    Concatenate partition frames, keeping categorical columns categorical.
+    """
+    df = pd.concat(parts, ignore_index=True)
+    # Partitions carry their own categories; concat falls back to strings, so restore the categoricals
+    for col in parts[0].columns:
+        if isinstance(parts[0][col].dtype, pd.CategoricalDtype) and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def _read_partitions(store_dir, kind, months):
+    return concat_partitions([pd.read_parquet(_partition_path(store_dir, kind, month)) for month in months])
+
+
+@instrumented
+def build_feature_store(df, store_dir, n_workers=1):
+    """
+    Engineer features for the full history and persist them as a feature store.
+    The store keeps, per YearMonth, the engineered rows (features/) and the raw rows with their outlier
+    flag (raw/). The trailing raw partitions are the rolling-window state later months are computed from.
+    """
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    df = df.sort_values('Transaction_Date', kind='mergesort').reset_index(drop=True)
+    keep = rolling_iqr_outlier_mask(df, 'Transaction_Date', 'Margin_Per_Unit', window_months=12)
+    df_eng, feature_cols = engineer_features(df[keep], remove_outliers=False, n_workers=n_workers)
+    raw = df.copy()
+    raw[OUTLIER_FLAG_COL] = ~keep
+    _write_partitions(store_dir, 'raw', raw)
+    _write_partitions(store_dir, 'features', df_eng)
+    months = sorted(str(m) for m in raw['Transaction_Date'].dt.to_period('M').unique())
+    _write_meta(store_dir, {'feature_cols': feature_cols, 'months': months, 'hashes': month_hashes(df)})
+    print(f"Feature store built at {store_dir} with {len(df_eng)} rows over {len(months)} months.")
+
+
+@instrumented
+def append_months(new_df, store_dir, n_workers=1):
+    """
+    Engineer features for transactions newer than everything in the store and append them.
+    Only the new rows are computed: the last CONTEXT_MONTHS raw partitions supply the outlier and
+    rolling windows, so the result matches a full rebuild of the combined history.
+    """
+    meta = _read_meta(store_dir)
+    if meta is None:
+        raise FileNotFoundError(f"No feature store found at {store_dir}; build it first.")
+    new_df = new_df.sort_values('Transaction_Date', kind='mergesort').reset_index(drop=True)
+    new_months = new_df['Transaction_Date'].dt.to_period('M')
+    last_month = pd.Period(meta['months'][-1], freq='M')
+    if (new_months <= last_month).any():
+        raise ValueError(f"New data must start after the last stored month ({last_month}); rebuild the store instead.")
+    context_months = [m for m in meta['months'] if pd.Period(m, freq='M') > new_months.min() - CONTEXT_MONTHS - 1]
+    history = _read_partitions(store_dir, 'raw', context_months)
+    # Outlier flags for the new rows, with the stored raw rows as window context
+    combined = pd.concat([history.drop(columns=OUTLIER_FLAG_COL), new_df], ignore_index=True)
+    keep = rolling_iqr_outlier_mask(combined, 'Transaction_Date', 'Margin_Per_Unit', window_months=12)[len(history):]
+    clean_history = history[~history[OUTLIER_FLAG_COL]].drop(columns=OUTLIER_FLAG_COL)
+    df_eng, feature_cols = engineer_features(new_df[keep], history=clean_history, remove_outliers=False,
+                                             n_workers=n_workers)
+    if feature_cols != meta['feature_cols']:
+        raise ValueError("Feature columns differ from the stored ones; rebuild the store instead.")
+    raw = new_df.copy()
+    raw[OUTLIER_FLAG_COL] = ~keep
+    _write_partitions(store_dir, 'raw', raw)
+    _write_partitions(store_dir, 'features', df_eng)
+    added = sorted(str(m) for m in new_months.unique())
+    meta['months'] = meta['months'] + added
+    meta.setdefault('hashes', {}).update(month_hashes(new_df))
+    _write_meta(store_dir, meta)
+    print(f"Feature store: appended {len(df_eng)} rows for {', '.join(added)}.")
+
+
+def load_features(store_dir):
+    """
+    Load all engineered rows from the store. Returns engineered DataFrame and feature list.
+    Recency_Weight is relative to the latest month, so it is refreshed on load.
+    """
+    meta = _read_meta(store_dir)
+    months = [m for m in meta['months'] if os.path.exists(_partition_path(store_dir, 'features', m))]
+    df = _read_partitions(store_dir, 'features', months)
+    df = add_recency_weight(df, 'Transaction_Date')
+    return df, meta['feature_cols']
+
+
+def stored_months(store_dir):
+    """
+    Months in the store, oldest first (an empty list when there is no store yet).
+    """
+    meta = _read_meta(store_dir)
+    return [] if meta is None else list(meta['months'])
+
+
+def stored_month_hashes(store_dir):
+    """
+    Content hash of the raw input of each stored month ({month: hex digest}, see month_hashes).
+    """
+    return dict(_read_meta(store_dir)['hashes'])
+
+
+def store_fingerprint(store_dir):
+    """
+    Hash of the store's feature columns and per-month input hashes. It identifies the stored features
+    without reading them: recomputing the last month gives equal features up to the last float bits, which
+    would change a hash of the values.
+    """
+    meta = _read_meta(store_dir)
+    payload = {key: meta.get(key) for key in ('feature_cols', 'months', 'hashes')}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def stored_feature_cols(store_dir):
+    """
+    Feature columns of the store.
+    """
+    return _read_meta(store_dir)['feature_cols']
+
+
+def iter_partitions(store_dir, kind='features', columns=None, months=None):
+    """
+    Yield (month, DataFrame) for each stored month of kind ('features' or 'raw'), oldest first,
+    so the whole history can be scanned with one month in memory. columns limits the columns read
+    and months the months (default: all).
+    """
+    for month in stored_months(store_dir) if months is None else months:
+        path = _partition_path(store_dir, kind, month)
+        if os.path.exists(path):
+            yield month, pd.read_parquet(path, columns=columns)
+
+
+@instrumented
+def update_feature_store(df, store_dir, n_workers=1):
+    """
+    Bring the store up to date with df and return its engineered features.
+    Builds the store on first use. Afterwards the per-month content hashes of df are compared with the
+    stored ones: the store is cut back to the oldest month that changed (or the last stored month, see
+    truncate_store) and the months of df from there on are recomputed with append_months.
+    n_workers: processes for the window features (see engineer_features).
+    """
+    first = truncate_store(store_dir, month_hashes(df))
+    if first is None:
+        build_feature_store(df, store_dir, n_workers)
+    else:
+        new_rows = df[df['Transaction_Date'].dt.to_period('M') >= first]
+        if len(new_rows) > 0:
+            append_months(new_rows, store_dir, n_workers)
+    return load_features(store_dir)
+
+
+def check_incremental_consistency(df, n_incremental_months=2, rtol=1e-9):
+    """
+    Verify that appending months one at a time reproduces a full rebuild.
+    Builds a temporary store without the last n_incremental_months, appends them month by month and
+    compares the loaded features with engineer_features on the full history. Raises AssertionError on mismatch.
+    """
+    full, full_cols = engineer_features(df)
+    months = df['Transaction_Date'].dt.to_period('M')
+    cutoff = months.max() - n_incremental_months
+    store_dir = tempfile.mkdtemp(prefix='feature_store_check_')
+    try:
+        build_feature_store(df[months <= cutoff], store_dir)
+        for month in sorted(months[months > cutoff].unique()):
+            append_months(df[months == month], store_dir)
+        incremental, incremental_cols = load_features(store_dir)
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    assert incremental_cols == full_cols, "Feature lists differ"
+    # Category sets differ between partitions and the full frame; compare the values themselves
+    as_values = lambda frame: frame.apply(lambda s: s.astype(object) if isinstance(s.dtype, pd.CategoricalDtype) else s)
+    pd.testing.assert_frame_equal(as_values(incremental), as_values(full), check_dtype=False, rtol=rtol)
+    print(f"Incremental feature store matches full rebuild ({len(full)} rows, {n_incremental_months} appended months).")
+    return True
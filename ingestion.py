@@ -0,0 +1,126 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from instrumentation import instrumented
+
+# Explicit input schema: entity columns are categorical, measures are numeric
+ENTITY_COLS = ['Customer_Name', 'Product_Level_1', 'Product_Level_2', 'Application', 'Plant']
+SCHEMA = {
+    'Customer_Name': 'category',
+    'Product_Level_1': 'category',
+    'Product_Level_2': 'category',
+    'Application': 'category',
+    'Plant': 'category',
+    'Quantity': 'float64',
+    'Total_Value': 'float64',
+    'Margin_Per_Unit': 'float64'
+}
+DATE_COLS = ['Transaction_Date']
+# Target and price columns stay floating point even when every value is a whole number
+FLOAT_COLS = ['Total_Value', 'Margin_Per_Unit']
+# Bump when SCHEMA or the parsing logic changes, so cached Parquet files are not reused
+SCHEMA_VERSION = 2
+INGEST_CACHE_DIR = '.ingest_cache'
+
+
+def downcast_numerics(df, float_cols=FLOAT_COLS):
+    """
+    Downcast numeric columns without changing any value: integer-valued columns go to the smallest
+    integer type, floats go to float32 only when every value survives the round trip.
+    Columns in float_cols (target and prices) are never turned into integers, so a file of
+    whole-number margins keeps the same dtype as any other.
+    """
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_integer_dtype(values):
+            df[col] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values):
+            if col not in float_cols and values.notna().all() and np.array_equal(values, np.round(values)):
+                df[col] = pd.to_numeric(values.astype(np.int64), downcast='integer')
+                continue
+            as_float32 = values.astype(np.float32)
+            if np.array_equal(as_float32.astype(np.float64), values, equal_nan=True):
+                df[col] = as_float32
+    return df
+
+
+def read_sales_csv(csv_path):
+    """
+    Parse the sales CSV with the explicit schema (categorical entities, downcast numerics).
+    """
+    header = pd.read_csv(csv_path, nrows=0).columns
+    dtypes = {col: dtype for col, dtype in SCHEMA.items() if col in header}
+    df = pd.read_csv(csv_path, dtype=dtypes, parse_dates=[c for c in DATE_COLS if c in header])
+    return downcast_numerics(df)
+
+
+def _cache_path(csv_path, cache_dir):
+    stat = os.stat(csv_path)
+    key = f'{os.path.abspath(csv_path)}|{stat.st_size}|{stat.st_mtime_ns}|{SCHEMA_VERSION}'
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(cache_dir, f'{stem}-{digest}.parquet')
+
+
+@instrumented
+def load_sales_data(csv_path, cache_dir=INGEST_CACHE_DIR):
+    """
+    Load the sales data with the explicit schema, reusing a Parquet copy of the parsed CSV when the
+    file has not changed (same path, size and modification time). Set cache_dir=None to always parse.
+    """
+    if cache_dir is None:
+        return read_sales_csv(csv_path)
+    cache_path = _cache_path(csv_path, cache_dir)
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+    df = read_sales_csv(csv_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    df.to_parquet(cache_path, index=False)
+    return df
+
+
+def interaction_key(df, left, right, sep='_'):
+    """
+    Categorical equivalent of df[left] + sep + df[right], built from integer codes: rows are paired
+    by category code and only the distinct pairs are turned into labels. Missing parts give NaN.
+    """
+    left_cat = df[left].astype('category')
+    right_cat = df[right].astype('category')
+    left_codes = left_cat.cat.codes.to_numpy(dtype=np.int64)
+    right_codes = right_cat.cat.codes.to_numpy(dtype=np.int64)
+    missing = (left_codes < 0) | (right_codes < 0)
+    n_right = max(len(right_cat.cat.categories), 1)
+    pair_codes = np.where(missing, -1, left_codes * n_right + right_codes)
+    pairs, pair_index = np.unique(pair_codes[~missing], return_inverse=True)
+    labels = (
+        left_cat.cat.categories.take(pairs // n_right).astype(str)
+        + sep
+        + right_cat.cat.categories.take(pairs % n_right).astype(str)
+    )
+    # Distinct pairs can still concatenate to the same label (e.g. 'a_b' + 'c' and 'a' + 'b_c')
+    label_codes, categories = pd.factorize(labels)
+    codes = np.full(len(df), -1, dtype=np.int64)
+    codes[~missing] = label_codes[pair_index]
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def memory_report(csv_path):
+    """
+    Compare memory of the default pd.read_csv frame against the schema-based frame, plus the
+    interaction keys built by string concatenation against integer-coded categoricals.
+    Returns a DataFrame of MB per item.
+    """
+    default = pd.read_csv(csv_path, parse_dates=DATE_COLS)
+    compact = read_sales_csv(csv_path)
+    pairs = [('Customer_Name', 'Product_Level_2'), ('Product_Level_2', 'Plant'), ('Product_Level_2', 'Application')]
+    concat_keys = pd.DataFrame({f'{a}+{b}': default[a] + '_' + default[b] for a, b in pairs})
+    coded_keys = pd.DataFrame({f'{a}+{b}': interaction_key(compact, a, b) for a, b in pairs})
+    mb = lambda frame: frame.memory_usage(index=False, deep=True).sum() / 2**20
+    report = pd.DataFrame({
+        'default_mb': [mb(default), mb(concat_keys)],
+        'compact_mb': [mb(compact), mb(coded_keys)]
+    }, index=['input frame', 'interaction keys'])
+    report['reduction'] = report['default_mb'] / report['compact_mb']
+    return report
@@ -0,0 +1,322 @@
+"""
+Opt-in instrumentation for the pipeline's stages and heavy helpers.
+
+Functions decorated with @instrumented and blocks wrapped in `with span(name):` record wall time,
+CPU time, peak RSS, input row count and rows/sec. Nothing is recorded unless tracing is enabled,
+either with enable_tracing() or, in the entry points (which call configure_from_env()), through
+environment variables:
+
+    PRICING_TRACE=trace.jsonl      one JSON object per span, written as each span ends
+    PRICING_TRACE=trace.json       Chrome trace (open in chrome://tracing or https://ui.perfetto.dev)
+    PRICING_TRACE_FORMAT=jsonl|chrome   override the format picked from the file extension
+
+Any single span can also be profiled:
+
+    PRICING_PROFILE=stage.train_regressor      span names (comma-separated) or short names (add_rolling_features_12m)
+    PRICING_PROFILER=cprofile|py-spy            cprofile (default) writes <name>.prof for pstats/snakeviz;
+                                                py-spy records a flame graph <name>.svg (needs py-spy on PATH)
+    PRICING_PROFILE_DIR=profiles                where profiles are written (default: current directory)
+
+Workers of parallel.process_pool record their spans too (see configure_worker). They write JSON lines as
+each span ends, because pool workers exit without running atexit handlers; for a Chrome trace each worker
+writes its own <trace>.worker-<pid>.jsonl, which the tracing process merges into the trace when it flushes.
+"""
+import atexit
+import cProfile
+import functools
+import glob
+import json
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import threading
+import time
+
+import pandas as pd
+
+TRACE_ENV = 'PRICING_TRACE'
+TRACE_FORMAT_ENV = 'PRICING_TRACE_FORMAT'
+PROFILE_ENV = 'PRICING_PROFILE'
+PROFILER_ENV = 'PRICING_PROFILER'
+PROFILE_DIR_ENV = 'PRICING_PROFILE_DIR'
+
+
+class _Tracer:
+    """
+    Process-wide trace sink. Spans from several threads may end concurrently, so writes take a lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.path = None
+        self.format = None
+        self.events = []
+        self.origin = time.perf_counter()
+        self.profile_names = set()
+        self.profiler = 'cprofile'
+        self.profile_dir = '.'
+        self.profiling = False
+
+    @property
+    def active(self):
+        return self.path is not None or bool(self.profile_names)
+
+    def record(self, event):
+        with self.lock:
+            if self.format == 'jsonl':
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(event, default=str) + '\n')
+            elif self.format == 'chrome':
+                self.events.append(event)
+
+    def flush(self):
+        """
+        Write the Chrome trace collected so far, with the spans of the pool workers (JSON-lines spans are
+        written as they end).
+        """
+        with self.lock:
+            if self.format != 'chrome' or self.path is None:
+                return
+            events = list(self.events)
+            for worker_path in sorted(glob.glob(_worker_trace_pattern(self.path))):
+                with open(worker_path) as f:
+                    events.extend(json.loads(line) for line in f if line.strip())
+            trace_events = [{
+                'name': e['name'],
+                'ph': 'X',
+                'ts': e['start_s'] * 1e6,
+                'dur': e['wall_s'] * 1e6,
+                'pid': e['pid'],
+                'tid': e['thread'],
+                'args': {k: v for k, v in e.items() if k not in ('name', 'start_s', 'wall_s', 'pid', 'thread')}
+            } for e in events]
+            with open(self.path, 'w') as f:
+                json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+_TRACER = _Tracer()
+
+
+def _worker_trace_pattern(path):
+    return f'{glob.escape(path)}.worker-*.jsonl'
+
+
+def _remove_worker_traces(path):
+    for worker_path in glob.glob(_worker_trace_pattern(path)):
+        os.remove(worker_path)
+
+
+def enable_tracing(path, fmt=None):
+    """
+    Record spans to path as JSON-lines ('jsonl') or a Chrome trace ('chrome'); the format defaults to
+    'chrome' for a .json file and 'jsonl' otherwise. Pool workers started afterwards record to the same
+    trace. Call disable_tracing() (or exit) to finish the file.
+    """
+    fmt = fmt or ('chrome' if path.endswith('.json') else 'jsonl')
+    if fmt not in ('jsonl', 'chrome'):
+        raise ValueError(f"Unknown trace format: {fmt}")
+    with _TRACER.lock:
+        _TRACER.path, _TRACER.format, _TRACER.events = path, fmt, []
+    if fmt == 'jsonl':
+        open(path, 'w').close()
+    else:
+        _remove_worker_traces(path)
+
+
+def disable_tracing():
+    """
+    Write any pending trace output and stop recording.
+    """
+    _TRACER.flush()
+    with _TRACER.lock:
+        if _TRACER.format == 'chrome':
+            _remove_worker_traces(_TRACER.path)
+        _TRACER.path, _TRACER.format, _TRACER.events = None, None, []
+
+
+def enable_profiling(names, profiler='cprofile', profile_dir='.'):
+    """
+    Profile every span whose full or short name is in names, with cProfile or py-spy.
+    """
+    if profiler not in ('cprofile', 'py-spy'):
+        raise ValueError(f"Unknown profiler: {profiler}")
+    _TRACER.profile_names = {n.strip() for n in names if n.strip()}
+    _TRACER.profiler = profiler
+    _TRACER.profile_dir = profile_dir
+
+
+def configure_from_env():
+    """
+    Enable tracing and profiling as set by the PRICING_* environment variables (see the module docstring).
+    Entry points call it once at startup.
+    """
+    if os.environ.get(TRACE_ENV):
+        enable_tracing(os.environ[TRACE_ENV], os.environ.get(TRACE_FORMAT_ENV))
+    if os.environ.get(PROFILE_ENV):
+        enable_profiling(os.environ[PROFILE_ENV].split(','), os.environ.get(PROFILER_ENV, 'cprofile'),
+                         os.environ.get(PROFILE_DIR_ENV, '.'))
+
+
+def worker_settings():
+    """
+    The current tracing and profiling settings, for configure_worker in a pool worker (None when both are off).
+    """
+    if not _TRACER.active:
+        return None
+    return {'path': _TRACER.path, 'format': _TRACER.format, 'origin': _TRACER.origin,
+            'profile_names': sorted(_TRACER.profile_names), 'profiler': _TRACER.profiler,
+            'profile_dir': _TRACER.profile_dir}
+
+
+def configure_worker(settings):
+    """
+    Record the spans of a pool worker with the settings of the process that started it (from worker_settings).
+    Spans are written as JSON lines as they end: to the JSON-lines trace itself, or for a Chrome trace to
+    <trace>.worker-<pid>.jsonl. Times are relative to the parent's origin (perf_counter is system-wide on Linux),
+    so the spans of all processes line up.
+    """
+    if settings is None:
+        return
+    with _TRACER.lock:
+        if settings['path'] is not None:
+            _TRACER.path = settings['path']
+            if settings['format'] == 'chrome':
+                _TRACER.path = f"{settings['path']}.worker-{os.getpid()}.jsonl"
+            _TRACER.format = 'jsonl'
+        _TRACER.origin = settings['origin']
+    if settings['profile_names']:
+        enable_profiling(settings['profile_names'], settings['profiler'], settings['profile_dir'])
+
+
+def _row_count(args, kwargs):
+    # Rows of the first DataFrame/Series argument, which is the data every instrumented helper works on
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            return len(value)
+    return None
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far, in MB.
+    """
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _Profile:
+    """
+    cProfile or an attached py-spy process around one span; only one span is profiled at a time.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.profile = None
+        self.process = None
+
+    def __enter__(self):
+        os.makedirs(_TRACER.profile_dir, exist_ok=True)
+        base = os.path.join(_TRACER.profile_dir, self.name.replace('/', '_'))
+        if _TRACER.profiler == 'py-spy':
+            py_spy = shutil.which('py-spy')
+            if py_spy is None:
+                raise RuntimeError('PRICING_PROFILER=py-spy needs py-spy on PATH (pip install py-spy)')
+            self.process = subprocess.Popen([py_spy, 'record', '--pid', str(os.getpid()), '--output', f'{base}.svg',
+                                             '--threads', '--nonblocking'])
+            # Give py-spy time to attach before the span starts
+            time.sleep(0.5)
+        else:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.base = base
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(f'{self.base}.prof')
+            print(f"[instrumentation] cProfile stats for {self.name} saved to {self.base}.prof")
+        if self.process is not None:
+            self.process.send_signal(signal.SIGINT)
+            self.process.wait()
+            print(f"[instrumentation] py-spy flame graph for {self.name} saved to {self.base}.svg")
+        return False
+
+
+class span:
+    """
+    Context manager recording one timed span: `with span('tuning.grid_fit', rows=len(X)): ...`.
+    Does nothing (beyond one attribute check) when tracing and profiling are off.
+    """
+
+    def __init__(self, name, rows=None, **fields):
+        self.name = name
+        self.rows = rows
+        self.fields = fields
+        self.profile = None
+
+    def __enter__(self):
+        if not _TRACER.active:
+            self.start = None
+            return self
+        short_name = self.name.rsplit('.', 1)[-1]
+        if {self.name, short_name} & _TRACER.profile_names:
+            with _TRACER.lock:
+                claimed = not _TRACER.profiling
+                _TRACER.profiling = True
+            if claimed:
+                self.profile = _Profile(self.name).__enter__()
+        self.rss_before = peak_rss_mb()
+        self.cpu_start = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.start is None:
+            return False
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu_start
+        if self.profile is not None:
+            self.profile.__exit__(exc_type, exc, tb)
+            _TRACER.profiling = False
+        peak = peak_rss_mb()
+        event = {
+            'name': self.name,
+            'start_s': self.start - _TRACER.origin,
+            'wall_s': wall,
+            # Process CPU time: above wall_s when threads or native code run in parallel
+            'cpu_s': cpu,
+            'peak_rss_mb': peak,
+            'rss_growth_mb': peak - self.rss_before,
+            'rows': self.rows,
+            'rows_per_s': self.rows / wall if self.rows and wall > 0 else None,
+            'pid': os.getpid(),
+            'thread': threading.get_ident(),
+            'error': None if exc_type is None else exc_type.__name__,
+            **self.fields
+        }
+        _TRACER.record(event)
+        return False
+
+
+def instrumented(func=None, name=None):
+    """
+    Decorator recording a span per call, named <module>.<function> unless name is given; rows is the
+    length of the first DataFrame/Series argument.
+    """
+    if func is None:
+        return functools.partial(instrumented, name=name)
+    span_name = name or f'{func.__module__}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _TRACER.active:
+            return func(*args, **kwargs)
+        with span(span_name, rows=_row_count(args, kwargs)):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+atexit.register(disable_tracing)
@@ -0,0 +1,126 @@
+import json
+import os
+from datetime import datetime
+from functools import cached_property
+
+from binning import save_bin_edges, load_bin_edges
+from sharding import ShardedModel
+from pricing_rules import save_min_margin_table, load_min_margin_table
+
+BUNDLE_ROOT = 'model_bundle'
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+LATEST_FILE = 'LATEST'
+
+
+def save_bundle(
+    classifier,
+    regressor,
+    bin_edges,
+    classifier_features,
+    regressor_features,
+    min_margin_table,
+    bundle_root=BUNDLE_ROOT,
+    version=None,
+    metadata=None
+):
+    """
+    Save everything scoring needs into bundle_root/<version>/ and mark it as the latest bundle:
+    classifier.cbm and regressor.cbm (CatBoost native format; a directory of shard models for a
+    sharding.ShardedModel), bin_edges.npz, min_margin.parquet and manifest.json (feature lists, version,
+    creation time and any extra metadata).
+    Returns the bundle directory.
+    """
+    version = version or datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(bundle_root, version)
+    os.makedirs(path, exist_ok=True)
+    for name, model in (('classifier', classifier), ('regressor', regressor)):
+        if isinstance(model, ShardedModel):
+            model.save(os.path.join(path, name))
+        else:
+            model.save_model(os.path.join(path, f'{name}.cbm'))
+    save_bin_edges(bin_edges, os.path.join(path, 'bin_edges.npz'))
+    save_min_margin_table(min_margin_table, os.path.join(path, 'min_margin.parquet'))
+    manifest = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'version': version,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'classifier_features': list(classifier_features),
+        'regressor_features': list(regressor_features),
+        'metadata': metadata or {}
+    }
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+    with open(os.path.join(bundle_root, LATEST_FILE), 'w') as f:
+        f.write(version)
+    print(f"Model bundle saved to {path}")
+    return path
+
+
+class ModelBundle:
+    """
+    A saved model bundle. Only the manifest is read on construction; models, bin edges and the
+    min margin table are loaded from disk the first time they are accessed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format_version') != BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported bundle format in {path}: {self.manifest.get('format_version')}")
+
+    @property
+    def version(self):
+        return self.manifest['version']
+
+    @property
+    def metadata(self):
+        return self.manifest.get('metadata', {})
+
+    @property
+    def classifier_features(self):
+        return self.manifest['classifier_features']
+
+    @property
+    def regressor_features(self):
+        return self.manifest['regressor_features']
+
+    @cached_property
+    def classifier(self):
+        from catboost import CatBoostClassifier
+        if os.path.isdir(os.path.join(self.path, 'classifier')):
+            return ShardedModel.load(os.path.join(self.path, 'classifier'), CatBoostClassifier)
+        model = CatBoostClassifier()
+        model.load_model(os.path.join(self.path, 'classifier.cbm'))
+        return model
+
+    @cached_property
+    def regressor(self):
+        from catboost import CatBoostRegressor
+        if os.path.isdir(os.path.join(self.path, 'regressor')):
+            return ShardedModel.load(os.path.join(self.path, 'regressor'), CatBoostRegressor)
+        model = CatBoostRegressor()
+        model.load_model(os.path.join(self.path, 'regressor.cbm'))
+        return model
+
+    @cached_property
+    def bin_edges(self):
+        return load_bin_edges(os.path.join(self.path, 'bin_edges.npz'))
+
+    @cached_property
+    def min_margin_table(self):
+        return load_min_margin_table(os.path.join(self.path, 'min_margin.parquet'))
+
+
+def load_bundle(bundle_root=BUNDLE_ROOT, version=None):
+    """
+    Open a saved bundle (the latest one unless version is given). Artifacts load lazily.
+    """
+    if version is None:
+        latest_path = os.path.join(bundle_root, LATEST_FILE)
+        if not os.path.exists(latest_path):
+            raise FileNotFoundError(f"No model bundle found in {bundle_root}; run run_pipeline.py first.")
+        with open(latest_path) as f:
+            version = f.read().strip()
+    return ModelBundle(os.path.join(bundle_root, version))
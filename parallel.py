@@ -0,0 +1,34 @@
+"""
+Process pools for the parallel helpers (window features, sharded training, walk-forward backtest).
+
+Pipeline stages run in threads (pipeline.run_stages), and forking a process while other threads hold
+locks (logging, CatBoost, the allocator) can deadlock the child. Pools therefore start their workers
+from a fork server: a clean single-threaded process started once, which forks the workers.
+Workers record their spans with the tracing settings of the process that created the pool (see
+instrumentation.configure_worker).
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from instrumentation import configure_worker, worker_settings
+
+START_METHOD = 'forkserver'
+# Imported once by the fork server instead of by every worker
+PRELOAD_MODULES = ['numpy', 'pandas']
+
+
+def _init_worker(settings, initializer, initargs):
+    configure_worker(settings)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def process_pool(max_workers, initializer=None, initargs=()):
+    """
+    ProcessPoolExecutor with max_workers processes started by the fork server. Tasks, their arguments
+    and initargs are pickled, so task functions must be defined at module level.
+    """
+    context = multiprocessing.get_context(START_METHOD)
+    context.set_forkserver_preload(PRELOAD_MODULES)
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=_init_worker,
+                               initargs=(worker_settings(), initializer, initargs))
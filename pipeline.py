@@ -0,0 +1,303 @@
+"""
+Lightweight stage runner: each pipeline step is a Stage with named inputs and outputs. Stage outputs
+are pickled to disk under a key that hashes the stage's code, its parameters and the keys of its inputs,
+so a rerun only executes the stages whose key changed. Stages whose inputs are ready run concurrently
+in a thread pool, and a per-stage time, output size and process peak RSS summary is printed at the end.
+"""
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+from instrumentation import peak_rss_mb, span
+
+PIPELINE_CACHE_DIR = '.pipeline_cache'
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stage:
+    """
+    A pipeline step. func is called with the stage's inputs (by name) and params as keyword arguments
+    and returns one value per name in outputs (a tuple when there are several). Set cache=False for
+    stages with side effects (writing files) so they run every time.
+    The outputs of an uncached stage are keyed by their content hash, unless output_key is given: a function
+    called with the stage's params after it ran, returning a string that identifies the outputs. Use it
+    when equal inputs can give outputs that differ in the last float bits (e.g. an incremental update).
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), params=None, cache=True, output_key=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.cache = cache
+        self.output_key = output_key
+
+
+def _hash_value(value, digest):
+    """
+    Feed the content of value into digest (DataFrames and Series by their values, index, columns and dtypes,
+    CatBoost models by their model GUID, other plain objects by their attributes).
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        if isinstance(value, pd.DataFrame):
+            digest.update(repr(list(zip(value.columns, value.dtypes.astype(str)))).encode())
+        else:
+            digest.update(f'{value.name}|{value.dtype}'.encode())
+    elif isinstance(value, np.ndarray):
+        digest.update(f'{value.dtype}|{value.shape}'.encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=repr):
+            digest.update(repr(key).encode())
+            _hash_value(value[key], digest)
+    elif isinstance(value, (list, tuple)):
+        digest.update(f'{type(value).__name__}{len(value)}'.encode())
+        for item in value:
+            _hash_value(item, digest)
+    elif hasattr(value, 'get_metadata') and hasattr(value, 'save_model'):
+        # CatBoost models: repr is a memory address and the saved bytes change on every save (the parameter
+        # JSON is re-ordered), but the model GUID is set once by training and survives save_model/load_model
+        digest.update(f"{type(value).__name__}|{value.get_metadata().get('model_guid')}".encode())
+    elif type(value).__repr__ is object.__repr__ and hasattr(value, '__dict__'):
+        # Plain objects (e.g. sharding.ShardedModel) by their attributes rather than their address
+        digest.update(type(value).__qualname__.encode())
+        _hash_value(vars(value), digest)
+    else:
+        digest.update(repr(value).encode())
+
+
+def content_hash(value):
+    """
+    Hex digest of the content of value.
+    """
+    digest = hashlib.sha256()
+    _hash_value(value, digest)
+    return digest.hexdigest()
+
+
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _code_names(const)
+    return names
+
+
+def _project_modules(names):
+    return {name for name in names if os.path.isfile(os.path.join(PROJECT_DIR, f'{name}.py'))}
+
+
+def code_fingerprint(func):
+    """
+    Hash of func's source plus the source of every project module it depends on, followed through
+    imports (including imports inside functions). Editing any of them invalidates the stage.
+    """
+    names = _code_names(func.__code__)
+    modules = _project_modules(names)
+    for name in names:
+        referenced = func.__globals__.get(name)
+        # Names imported from a project module (from binning import fit_product_bins) or the module itself
+        module = getattr(referenced, '__module__', None) or getattr(referenced, '__name__', None)
+        if isinstance(module, str):
+            modules |= _project_modules([module])
+    todo, seen = list(modules), set()
+    while todo:
+        module = todo.pop()
+        if module in seen:
+            continue
+        seen.add(module)
+        with open(os.path.join(PROJECT_DIR, f'{module}.py')) as f:
+            source = f.read()
+        todo.extend(_project_modules(_code_names(compile(source, module, 'exec'))) - seen)
+    digest = hashlib.sha256(inspect.getsource(func).encode())
+    for module in sorted(seen):
+        with open(os.path.join(PROJECT_DIR, f'{module}.py'), 'rb') as f:
+            digest.update(module.encode() + f.read())
+    return digest.hexdigest()
+
+
+def stage_key(stage, input_keys):
+    """
+    Cache key of a stage: its name, code fingerprint, parameters and the keys of its inputs.
+    """
+    payload = {
+        'stage': stage.name,
+        'code': code_fingerprint(stage.func),
+        'params': content_hash(stage.params),
+        'inputs': {name: input_keys[name] for name in stage.inputs}
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:20]
+
+
+class _CachedOutputs:
+    """
+    Outputs of a cache hit, unpickled on first access (stages whose consumers are also cache hits are never loaded).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.values = None
+
+    def get(self, name):
+        with self.lock:
+            if self.values is None:
+                with open(self.path, 'rb') as f:
+                    self.values = pickle.load(f)
+        return self.values[name]
+
+
+def _nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class PipelineRun:
+    """
+    Result of run_stages: the outputs it kept, by name (cache hits are loaded on access), and per-stage stats.
+    """
+
+    def __init__(self, values, stats):
+        self._values = values
+        self.stats = stats
+
+    def __getitem__(self, name):
+        value = self._values[name]
+        return value.get(name) if isinstance(value, _CachedOutputs) else value
+
+    def summary(self):
+        """
+        Per-stage DataFrame: status (ran/cached), wall seconds, output MB and the peak RSS of the whole process
+        when the stage finished (stages share the process and run concurrently, so it is not a per-stage figure).
+        """
+        return pd.DataFrame(self.stats).set_index('stage')
+
+
+def _check_graph(stages, inputs):
+    available = set(inputs)
+    for stage in stages:
+        missing = [name for name in stage.inputs if name not in available]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' needs {missing}, which no earlier stage produces.")
+        duplicated = [name for name in stage.outputs if name in available]
+        if duplicated:
+            raise ValueError(f"Stage '{stage.name}' redefines {duplicated}.")
+        available.update(stage.outputs)
+
+
+def _run_stage(stage, values, key, cache_dir):
+    """
+    Run one stage in a worker thread. Returns (outputs dict, seconds, output bytes).
+    """
+    start = time.perf_counter()
+    kwargs = {name: values[name].get(name) if isinstance(values[name], _CachedOutputs) else values[name]
+              for name in stage.inputs}
+    rows = next((len(v) for v in kwargs.values() if isinstance(v, (pd.DataFrame, pd.Series))), None)
+    with span(f'stage.{stage.name}', rows=rows):
+        result = stage.func(**kwargs, **stage.params)
+    if len(stage.outputs) == 1:
+        result = (result,)
+    outputs = dict(zip(stage.outputs, result))
+    if stage.cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, f'{stage.name}-{key}.pkl')
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(outputs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        # Keep only the latest entry per stage
+        for name in os.listdir(cache_dir):
+            if name.startswith(f'{stage.name}-') and name.endswith('.pkl') and name != os.path.basename(path):
+                os.remove(os.path.join(cache_dir, name))
+    return outputs, time.perf_counter() - start, _nbytes(outputs)
+
+
+def _release_inputs(stage, values, consumers, keep):
+    """
+    Drop the values whose last consumer was stage, so e.g. the raw frame is freed once it has been engineered.
+    """
+    for name in stage.inputs:
+        consumers[name] -= 1
+        if consumers[name] == 0 and name not in keep:
+            values.pop(name, None)
+
+
+def run_stages(stages, inputs, cache_dir=PIPELINE_CACHE_DIR, max_workers=2, use_cache=True, keep=()):
+    """
+    Run stages (listed in dependency order) on the external inputs dict. Each stage's inputs must be
+    external inputs or outputs of earlier stages. A stage is skipped when its cache entry exists;
+    stages with all inputs ready run concurrently on max_workers threads.
+    A value is released as soon as the last stage that takes it has finished; the returned run keeps only
+    the outputs no stage takes and the names in keep (pass inputs without other references to free them too).
+    Returns a PipelineRun.
+    """
+    _check_graph(stages, inputs)
+    # Hash of each value: content hash for external inputs, stage key (or output content) for stage outputs
+    keys = {name: content_hash(value) for name, value in inputs.items()}
+    values = dict(inputs)
+    # From here on values holds the only reference run_stages has to the inputs, so they can be released
+    del inputs
+    consumers = {name: sum(name in stage.inputs for stage in stages) for name in values}
+    for stage in stages:
+        consumers.update({name: sum(name in other.inputs for other in stages) for name in stage.outputs})
+    pending = list(stages)
+    running = {}
+    stats = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for stage in [s for s in pending if all(name in keys for name in s.inputs)]:
+                pending.remove(stage)
+                key = stage_key(stage, keys)
+                path = os.path.join(cache_dir, f'{stage.name}-{key}.pkl')
+                if stage.cache and use_cache and os.path.exists(path):
+                    cached = _CachedOutputs(path)
+                    for name in stage.outputs:
+                        values[name] = cached
+                        keys[name] = f'{key}:{name}'
+                    stats.append({'stage': stage.name, 'status': 'cached', 'seconds': 0.0,
+                                  'output_mb': np.nan, 'process_peak_rss_mb': peak_rss_mb()})
+                    _release_inputs(stage, values, consumers, keep)
+                    continue
+                print(f"[pipeline] running {stage.name}")
+                running[pool.submit(_run_stage, stage, values, key, cache_dir)] = (stage, key)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, key = running.pop(future)
+                outputs, seconds, nbytes = future.result()
+                output_key = None if stage.output_key is None else stage.output_key(**stage.params)
+                for name, value in outputs.items():
+                    values[name] = value
+                    if stage.cache:
+                        keys[name] = f'{key}:{name}'
+                    elif output_key is not None:
+                        keys[name] = f'{key}:{output_key}:{name}'
+                    else:
+                        keys[name] = content_hash(value)
+                _release_inputs(stage, values, consumers, keep)
+                stats.append({'stage': stage.name, 'status': 'ran', 'seconds': seconds,
+                              'output_mb': nbytes / 2**20, 'process_peak_rss_mb': peak_rss_mb()})
+    run = PipelineRun(values, stats)
+    print('\nStage summary:')
+    print(run.summary().round(2).to_string())
+    print('(process_peak_rss_mb: peak RSS of the whole process when the stage finished, not the stage\'s own memory)')
+    return run
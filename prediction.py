@@ -1,8 +1,47 @@
 import pandas as pd
 import numpy as np
-from binning import get_bin_range
+from binning import get_bin_ranges
+from feature_engineering import fill_missing_features
+from instrumentation import instrumented
+from pricing_rules import apply_pricing_rules, compute_last_margin_table, compute_min_margin_table, rules_need
 
+COMBO_COLS = ['Customer_Name', 'Product_Level_1', 'Product_Level_2', 'Application', 'Plant']
+PRICELIST_BATCH_SIZE = 100_000
 
+
+def latest_combination_rows(test_df, all_combos_df=None):
+    """
+    The combinations to price and the row of test_df each one is priced from: its latest transaction
+    (by Transaction_Date when test_df has it; the last one for same-day rows).
+    Combinations come in order of first appearance in test_df, followed by those of all_combos_df that are
+    not in it (e.g. from outlier records).
+    Returns (combos, rows): a DataFrame of COMBO_COLS and an integer array of positions in test_df (-1 for
+    combinations without a row).
+    """
+    keys = test_df[COMBO_COLS].reset_index(drop=True)
+    order = np.arange(len(keys))
+    if 'Transaction_Date' in test_df.columns:
+        order = np.argsort(test_df['Transaction_Date'].to_numpy(), kind='stable')
+    latest = keys.iloc[order].assign(_row=order).drop_duplicates(COMBO_COLS, keep='last')
+    combos = keys.drop_duplicates()
+    if all_combos_df is not None:
+        combos = pd.concat([combos, all_combos_df[COMBO_COLS]], ignore_index=True).drop_duplicates()
+    combos = combos.reset_index(drop=True)
+    rows = pd.merge(combos, latest, on=COMBO_COLS, how='left', validate='one_to_one')['_row']
+    return combos, rows.fillna(-1).to_numpy(dtype=np.int64)
+
+
+def combination_features(test_df, rows, columns):
+    """
+    The columns of test_df at positions rows (from latest_combination_rows), with NaN where a row is -1.
+    """
+    present = np.flatnonzero(rows >= 0)
+    features = test_df[columns].iloc[rows[present]]
+    features.index = present
+    return features.reindex(np.arange(len(rows)))
+
+
+@instrumented
 def generate_pricelist(
     test_df,
     model,
@@ -10,39 +49,87 @@ def generate_pricelist(
     bin_edges,
     bin_col='Predicted_Bin',
     output_csv='latest_pricelist.csv',
-    all_combos_df=None
+    all_combos_df=None,
+    batch_size=PRICELIST_BATCH_SIZE,
+    output_parquet=None,
+    min_margin_table=None,
+    last_margin_table=None,
+    calibration_factor=0.5,
+    rules=None,
+    return_frame=False
 ):
     """
     Generate the latest pricelist using the trained model and test set for the latest month.
     Includes predicted margin, price range (from classifier/binning), and ensures all required combinations are present.
     If all_combos_df is provided, ensures all combinations are included in the output.
+    Each combination is priced from its latest transaction in test_df, and its predicted bin comes from the
+    same row (latest_combination_rows); combinations without one get -1 features and bin 1. Only the combination
+    keys and row positions are held for the whole pricelist: the feature rows are gathered batch_size combinations
+    at a time, priced and appended to output_csv (and to output_parquet, if given, as one row group).
+    The pricing rules (apply_pricing_rules with rules and calibration_factor) are applied to each batch of
+    predictions before it is written, so the pricelist carries the adjusted margin, Adjusted_Flag,
+    Original_Prediction and the reference columns. min_margin_table and last_margin_table should come from the
+    whole history (compute_min_margin_table, compute_last_margin_table); they are computed from test_df if not given
+    (the last margins only when a rule reads them).
+    The rule hits of all batches are summed and printed once.
+    Returns a summary dict (rows, output_csv, output_parquet, rule_hits), or the whole pricelist DataFrame with
+    return_frame=True (rule_hits in its attrs).
     """
-    # Get unique combinations for the pricelist
-    unique_combos = test_df[['Customer_Name', 'Product_Level_1', 'Product_Level_2', 'Application', 'Plant']].drop_duplicates().reset_index(drop=True)
-    if all_combos_df is not None:
-        # Union with all required combos (e.g., from outlier records)
-        unique_combos = pd.concat([unique_combos, all_combos_df], ignore_index=True).drop_duplicates().reset_index(drop=True)
-    # Merge engineered features for these combos
-    combo_features = pd.merge(unique_combos, test_df, on=['Customer_Name', 'Product_Level_1', 'Product_Level_2', 'Application', 'Plant'], how='left')
-    combo_features = combo_features[feature_cols].fillna(-1)
-    # Predict margin
-    pred_margin = model.predict(combo_features)
-    pricelist = unique_combos.copy()
-    pricelist['Predicted_Margin_Per_Unit'] = np.round(pred_margin, 2)
-    # Add predicted bin and price range if available
-    if bin_col in test_df.columns:
-        pricelist[bin_col] = test_df[bin_col].values[:len(pricelist)]
-        # Add price range columns
-        min_range = []
-        max_range = []
-        for idx, row in pricelist.iterrows():
-            product = row['Product_Level_2']
-            bin_label = row.get(bin_col, np.nan)
-            rng = get_bin_range(product, int(bin_label) if not pd.isna(bin_label) else 1, bin_edges)
-            min_range.append(rng[0])
-            max_range.append(rng[1])
-        pricelist['Predicted_Min_Range'] = min_range
-        pricelist['Predicted_Max_Range'] = max_range
-    pricelist.to_csv(output_csv, index=False)
-    print(f"Pricelist saved as {output_csv} with {len(pricelist)} rows.")
-    return pricelist 
\ No newline at end of file
+    combos, combo_rows = latest_combination_rows(test_df, all_combos_df)
+    has_bins = bin_col in test_df.columns
+    row_cols = list(dict.fromkeys(feature_cols + ([bin_col] if has_bins else [])))
+    if min_margin_table is None:
+        min_margin_table = compute_min_margin_table(test_df)
+    if last_margin_table is None and rules is not None and rules_need(rules, 'Last_Margin_Per_Unit'):
+        last_margin_table = compute_last_margin_table(test_df)
+
+    parquet_writer = None
+    n_rows = 0
+    rule_hits = {}
+    chunks = []
+    try:
+        for start in range(0, max(len(combos), 1), batch_size):
+            chunk = combos.iloc[start:start + batch_size].reset_index(drop=True)
+            batch = combination_features(test_df, combo_rows[start:start + batch_size], row_cols)
+            if len(batch) > 0:
+                features = fill_missing_features(batch[feature_cols].copy(), feature_cols)
+                chunk['Predicted_Margin_Per_Unit'] = np.asarray(model.predict(features), dtype=float).ravel()
+            else:
+                chunk['Predicted_Margin_Per_Unit'] = pd.Series(dtype=float)
+            # Add predicted bin and price range if available
+            if has_bins:
+                # Combinations without a row (or a bin) get bin 1
+                chunk[bin_col] = pd.Series(np.ravel(batch[bin_col].to_numpy(dtype=float))).fillna(1).astype(int)
+                min_range, max_range = get_bin_ranges(chunk['Product_Level_2'], chunk[bin_col], bin_edges)
+                chunk['Predicted_Min_Range'] = min_range
+                chunk['Predicted_Max_Range'] = max_range
+            # Pricing rules on this batch's predictions (rounded afterwards, as the pricelist always was)
+            chunk = apply_pricing_rules(chunk, calibration_factor=calibration_factor, min_margin_table=min_margin_table,
+                                        rules=rules, last_margin_table=last_margin_table)
+            for name, hits in chunk.attrs['rule_hits'].items():
+                rule_hits[name] = rule_hits.get(name, 0) + hits
+            chunk[['Predicted_Margin_Per_Unit', 'Original_Prediction']] = chunk[['Predicted_Margin_Per_Unit', 'Original_Prediction']].round(2)
+            chunk.to_csv(output_csv, index=False, mode='w' if start == 0 else 'a', header=start == 0)
+            if output_parquet is not None:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                if parquet_writer is None:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    parquet_writer = pq.ParquetWriter(output_parquet, table.schema)
+                else:
+                    table = pa.Table.from_pandas(chunk, schema=parquet_writer.schema, preserve_index=False)
+                parquet_writer.write_table(table)
+            n_rows += len(chunk)
+            if return_frame:
+                chunks.append(chunk)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+    saved = output_csv if output_parquet is None else f"{output_csv} and {output_parquet}"
+    print(f"Pricing rule hits: {rule_hits}")
+    print(f"Pricelist saved as {saved} with {n_rows} rows.")
+    if return_frame:
+        pricelist = pd.concat(chunks, ignore_index=True)
+        pricelist.attrs['rule_hits'] = rule_hits
+        return pricelist
+    return {'rows': n_rows, 'output_csv': output_csv, 'output_parquet': output_parquet, 'rule_hits': rule_hits}
@@ -1,6 +1,107 @@
 import numpy as np
 import pandas as pd
+from instrumentation import instrumented
 
+def compute_min_margin_table(
+    df,
+    customer_col='Customer_Name',
+    product_col='Product_Level_2',
+    plant_col='Plant',
+    margin_col='Margin_Per_Unit',
+    min_margin_col='Historical_Min_Margin'
+):
+    """
+    Compute the historical min margin for each customer-product-plant.
+    Compute it once and pass it to apply_pricing_rules (or save it with save_min_margin_table)
+    to avoid regrouping the data on every call.
+    """
+    return (
+        df.groupby([customer_col, product_col, plant_col], observed=True)[margin_col]
+        .min()
+        .reset_index()
+        .rename(columns={margin_col: min_margin_col})
+    )
+
+def compute_last_margin_table(
+    df,
+    customer_col='Customer_Name',
+    product_col='Product_Level_2',
+    plant_col='Plant',
+    margin_col='Margin_Per_Unit',
+    last_col='Last_Margin_Per_Unit'
+):
+    """
+    Compute the latest transaction margin for each customer-product-plant (input for max_change_cap).
+    """
+    return (
+        df.sort_values('Transaction_Date', kind='mergesort')
+        .groupby([customer_col, product_col, plant_col], observed=True)[margin_col]
+        .last()
+        .reset_index()
+        .rename(columns={margin_col: last_col})
+    )
+
+def save_min_margin_table(min_margin, path):
+    """
+    Save a min margin table (from compute_min_margin_table) as Parquet.
+    """
+    min_margin.to_parquet(path, index=False)
+
+def load_min_margin_table(path):
+    """
+    Load a min margin table saved with save_min_margin_table.
+    """
+    return pd.read_parquet(path)
+
+def min_margin_floor(calibration_factor=0.5, min_margin_col='Historical_Min_Margin'):
+    """
+    Rule: if predicted margin < historical min, adjust upward to min + calibration_factor * (min - pred).
+    Rows without a historical min are left unchanged.
+    """
+    def rule(df, pred):
+        min_hist = df[min_margin_col].to_numpy(dtype=float)
+        hit = pred < min_hist
+        return np.where(hit, min_hist + calibration_factor * (min_hist - pred), pred), hit
+    rule.__name__ = 'min_margin_floor'
+    rule.columns = [min_margin_col]
+    return rule
+
+def max_change_cap(max_change=0.2, last_col='Last_Margin_Per_Unit'):
+    """
+    Rule: keep the prediction within +/- max_change (a fraction) of the last margin in last_col.
+    Rows without a last margin or a prediction are left unchanged.
+    """
+    def rule(df, pred):
+        last = df[last_col].to_numpy(dtype=float)
+        lower = last - max_change * np.abs(last)
+        upper = last + max_change * np.abs(last)
+        capped = np.clip(pred, lower, upper)
+        hit = ~np.isnan(last) & ~np.isnan(pred) & (capped != pred)
+        return np.where(hit, capped, pred), hit
+    rule.__name__ = 'max_change_cap'
+    rule.columns = [last_col]
+    return rule
+
+def product_ceiling(ceilings, product_col='Product_Level_2'):
+    """
+    Rule: cap predictions at a per-product ceiling, given as a dict {product: max margin}.
+    Products without a ceiling are left unchanged.
+    """
+    def rule(df, pred):
+        ceiling = df[product_col].map(ceilings).to_numpy(dtype=float)
+        hit = pred > ceiling
+        return np.where(hit, ceiling, pred), hit
+    rule.__name__ = 'product_ceiling'
+    rule.columns = [product_col]
+    return rule
+
+def rules_need(rules, column):
+    """
+    True when one of rules reads column (rules list theirs in rule.columns; a rule without it is assumed to).
+    """
+    return any(column in getattr(rule, 'columns', [column]) for rule in rules)
+
+@instrumented
 def apply_pricing_rules(
     df,
     predicted_col='Predicted_Margin_Per_Unit',
@@ -11,42 +112,49 @@ def apply_pricing_rules(
     calibration_factor=0.5,
     flag_col='Adjusted_Flag',
     original_col='Original_Prediction',
-    min_margin_col='Historical_Min_Margin'
+    min_margin_col='Historical_Min_Margin',
+    min_margin_table=None,
+    rules=None,
+    last_col='Last_Margin_Per_Unit',
+    last_margin_table=None
 ):
     """
     Apply pricing rules:
     1. If predicted margin < historical min for customer-product-plant, adjust upward using calibration_factor.
     2. Add a flag and store the original prediction if modified.
-    3. Add the historical min margin as a column for reference.
+    3. Add the historical min margin (and, when a rule needs it, the last margin) as columns for reference.
+    min_margin_table: precomputed table from compute_min_margin_table; computed from df if not given.
+    last_margin_table: precomputed table from compute_last_margin_table (the last_col reference of max_change_cap);
+    computed from df if not given and df has no last_col column. Only used when a rule reads last_col (rules_need).
+    rules: ordered list of vectorized rules (e.g. min_margin_floor, max_change_cap, product_ceiling), applied
+    one after another to the whole prediction column. Defaults to [min_margin_floor(calibration_factor)].
+    Per-rule hit counts are stored in df.attrs['rule_hits'] for the caller to report (once, when it prices
+    in batches).
     """
-    # Compute historical min margin for each customer-product-plant
-    min_margin = (
-        df.groupby([customer_col, product_col, plant_col])[margin_col]
-        .min()
-        .reset_index()
-        .rename(columns={margin_col: min_margin_col})
-    )
+    # Historical min margin for each customer-product-plant
+    if min_margin_table is None:
+        min_margin_table = compute_min_margin_table(df, customer_col, product_col, plant_col, margin_col, min_margin_col)
     # Merge min margin into df
-    df = pd.merge(df, min_margin, on=[customer_col, product_col, plant_col], how='left')
-    # Apply rules
-    adjusted = []
-    original = []
-    for idx, row in df.iterrows():
-        pred = row[predicted_col]
-        min_hist = row[min_margin_col]
-        if np.isnan(min_hist):
-            # No historical margin, do not adjust
-            adjusted.append(0)
-            original.append(np.nan)
-        elif pred < min_hist:
-            # Adjust upward
-            new_pred = min_hist + calibration_factor * (min_hist - pred)
-            df.at[idx, predicted_col] = new_pred
-            adjusted.append(1)
-            original.append(pred)
-        else:
-            adjusted.append(0)
-            original.append(np.nan)
-    df[flag_col] = adjusted
-    df[original_col] = original
-    return df 
\ No newline at end of file
+    df = pd.merge(df, min_margin_table, on=[customer_col, product_col, plant_col], how='left')
+    if rules is None:
+        rules = [min_margin_floor(calibration_factor, min_margin_col)]
+    # Latest margin for each customer-product-plant, for the rules that compare against it
+    if rules_need(rules, last_col):
+        if last_margin_table is None and last_col not in df.columns:
+            last_margin_table = compute_last_margin_table(df, customer_col, product_col, plant_col, margin_col, last_col)
+        if last_margin_table is not None:
+            df = pd.merge(df, last_margin_table, on=[customer_col, product_col, plant_col], how='left')
+    # Apply rules in order
+    original = df[predicted_col].to_numpy(dtype=float)
+    pred = original.copy()
+    adjusted = np.zeros(len(df), dtype=bool)
+    rule_hits = {}
+    for rule in rules:
+        pred, hit = rule(df, pred)
+        adjusted |= hit
+        rule_hits[rule.__name__] = rule_hits.get(rule.__name__, 0) + int(hit.sum())
+    df[predicted_col] = pred
+    df[flag_col] = adjusted.astype(int)
+    df[original_col] = np.where(adjusted, original, np.nan)
+    df.attrs['rule_hits'] = rule_hits
+    return df
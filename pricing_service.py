@@ -0,0 +1,233 @@
+"""
+Local HTTP service that prices customer-product-plant combinations on demand.
+
+    python pricing_service.py [--port 8080] [--bundle-root model_bundle] [--store-dir feature_store]
+
+POST /quote with {"quotes": [{"Customer_Name": ..., "Product_Level_1": ..., "Product_Level_2": ...,
+"Application": ..., "Plant": ...}, ...]} returns {"results": [...]} in the same order.
+GET /health reports the bundle version and the number of indexed combinations.
+"""
+import argparse
+import json
+import math
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+from binning import get_bin_ranges
+from instrumentation import configure_from_env
+from feature_engineering import fill_missing_features
+from prediction import combination_features, latest_combination_rows
+from pricing_rules import compute_last_margin_table, min_margin_floor, rules_need
+
+COMBO_COLS = ['Customer_Name', 'Product_Level_1', 'Product_Level_2', 'Application', 'Plant']
+
+
+def _feature_matrix(frame, feature_cols):
+    """
+    Feature rows as one numpy array: float when every feature is numeric, object otherwise.
+    """
+    features = frame.reindex(columns=feature_cols)
+    if all(pd.api.types.is_numeric_dtype(features[c]) for c in feature_cols):
+        return features.to_numpy(dtype=float)
+    return features.to_numpy(dtype=object)
+
+
+def _json_value(value):
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+class QuoteService:
+    """
+    In-memory pricer for single quotes. Keeps the classifier, regressor, bin edges and the feature row of
+    every combination (keyed by COMBO_COLS), chosen as generate_pricelist chooses it: the combination's latest
+    transaction in the latest month of df_eng, or -1 features and bin 1 for the combinations of all_combos_df
+    (default: those of df_eng) without one. The stored rows only change with a new bundle or feature store,
+    so every combination is priced once when the service starts (one classifier call, one regressor call and
+    the vectorized pricing rules over all rows) and a quote is a dict lookup.
+    rules: pricing rules applied to each prediction (see pricing_rules). Defaults to min_margin_floor when
+    a min_margin_table is given and to no rules otherwise; a rule whose reference column is missing
+    raises ValueError here rather than failing every request.
+    """
+
+    def __init__(self, classifier, regressor, classifier_features, regressor_features, bin_edges,
+                 df_eng, min_margin_table=None, rules=None, version=None, all_combos_df=None):
+        self.classifier = classifier
+        self.regressor = regressor
+        self.classifier_features = list(classifier_features)
+        self.regressor_features = list(regressor_features)
+        self.bin_edges = bin_edges
+        self.version = version
+        if rules is None:
+            rules = [min_margin_floor()] if min_margin_table is not None else []
+        self.rules = rules
+        # The rows generate_pricelist prices: the latest month, with every combination of the history
+        test_latest = df_eng[df_eng['YearMonth'] == df_eng['YearMonth'].max()]
+        combos, rows = latest_combination_rows(test_latest, df_eng if all_combos_df is None else all_combos_df)
+        feature_cols = [c for c in dict.fromkeys(self.classifier_features + self.regressor_features) if c in df_eng.columns]
+        features = combination_features(test_latest, rows, feature_cols)
+        # Reference columns of the rules, from the whole history
+        reference = combos
+        if min_margin_table is not None:
+            keys = [c for c in min_margin_table.columns if c in COMBO_COLS]
+            reference = pd.merge(reference, min_margin_table, on=keys, how='left')
+        if rules_need(self.rules, 'Last_Margin_Per_Unit'):
+            reference = pd.merge(reference, compute_last_margin_table(df_eng), on=['Customer_Name', 'Product_Level_2', 'Plant'], how='left')
+        for rule in self.rules:
+            try:
+                rule(reference.iloc[:0], np.empty(0))
+            except KeyError as exc:
+                raise ValueError(f"Pricing rule {rule.__name__} needs column {exc} (e.g. a min_margin_table).") from exc
+        self.reference = reference
+        self.index = {key: pos for pos, key in enumerate(combos.itertuples(index=False, name=None))}
+        self.results = self._price_rows(features, reference, rows >= 0)
+
+    def _price_rows(self, features, reference, has_row):
+        """
+        Price every combination from its feature row (NaN where has_row is False) and its reference columns.
+        As in generate_pricelist, combinations without a row are predicted from -1 features and get bin 1.
+        Returns one result dict per combination, without the COMBO_COLS.
+        """
+        if len(reference) == 0:
+            return []
+        bins = np.ones(len(reference), dtype=np.int64)
+        if has_row.any():
+            present = features[has_row]
+            bins[has_row] = np.asarray(self.classifier.predict(_feature_matrix(present, self.classifier_features))).ravel()
+        reg_rows = features.reindex(columns=self.regressor_features)
+        if 'Predicted_Bin' in self.regressor_features:
+            reg_rows['Predicted_Bin'] = np.where(has_row, bins, np.nan)
+        reg_rows = fill_missing_features(reg_rows, self.regressor_features)
+        original = np.asarray(self.regressor.predict(_feature_matrix(reg_rows, self.regressor_features)), dtype=float)
+        pred = original.copy()
+        rule_hits = [[] for _ in range(len(reference))]
+        for rule in self.rules:
+            pred, hit = rule(reference, pred)
+            for i in np.flatnonzero(hit):
+                rule_hits[i].append(rule.__name__)
+        min_range, max_range = get_bin_ranges(reference['Product_Level_2'], bins, self.bin_edges)
+        min_hist = reference['Historical_Min_Margin'].to_numpy(dtype=float) if 'Historical_Min_Margin' in reference.columns else None
+        results = []
+        for i in range(len(reference)):
+            adjusted = len(rule_hits[i]) > 0
+            result = {
+                'Predicted_Margin_Per_Unit': round(float(pred[i]), 2),
+                'Predicted_Bin': int(bins[i]),
+                'Predicted_Min_Range': _json_value(min_range[i]),
+                'Predicted_Max_Range': _json_value(max_range[i]),
+                'Adjusted_Flag': int(adjusted),
+                'Original_Prediction': round(float(original[i]), 2) if adjusted else None,
+                'Rule_Hits': rule_hits[i]
+            }
+            if min_hist is not None:
+                result['Historical_Min_Margin'] = _json_value(min_hist[i])
+            results.append(result)
+        return results
+
+    def quote_batch(self, quotes):
+        """
+        Price a batch of quotes (dicts holding the COMBO_COLS). Returns one result dict per quote,
+        in order; unknown combinations get an 'error' entry.
+        """
+        results = []
+        for quote in quotes:
+            key = tuple(quote.get(c) for c in COMBO_COLS)
+            result = dict(zip(COMBO_COLS, key))
+            pos = self.index.get(key)
+            if pos is None:
+                result['error'] = 'unknown combination'
+            else:
+                result.update(self.results[pos])
+            results.append(result)
+        return results
+
+
+def load_quote_service(bundle_root='model_bundle', store_dir='feature_store', version=None):
+    """
+    Build a QuoteService from the saved model bundle and the engineered rows in the feature store. Like
+    score.py, it quotes every combination of the raw input, including those with outlier rows only.
+    """
+    from model_bundle import load_bundle
+    from feature_store import concat_partitions, iter_partitions, load_features
+    bundle = load_bundle(bundle_root, version)
+    df_eng, _ = load_features(store_dir)
+    all_combos = concat_partitions([part for _, part in iter_partitions(store_dir, 'raw', columns=COMBO_COLS)])
+    return QuoteService(
+        bundle.classifier,
+        bundle.regressor,
+        bundle.classifier_features,
+        bundle.regressor_features,
+        bundle.bin_edges,
+        df_eng,
+        min_margin_table=bundle.min_margin_table,
+        version=bundle.version,
+        all_combos_df=all_combos.drop_duplicates()
+    )
+
+
+def make_server(service, host='127.0.0.1', port=8080):
+    """
+    Create a threaded HTTP server for service (port 0 picks a free port). Call serve_forever() to run it.
+    """
+    class QuoteHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out in separate writes; without TCP_NODELAY, Nagle + delayed ACK adds ~40 ms
+        disable_nagle_algorithm = True
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != '/health':
+                self._send_json(404, {'error': 'not found'})
+                return
+            self._send_json(200, {'status': 'ok', 'version': service.version, 'combinations': len(service.index)})
+
+        def do_POST(self):
+            if self.path != '/quote':
+                self._send_json(404, {'error': 'not found'})
+                return
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                quotes = payload['quotes'] if isinstance(payload, dict) else payload
+                self._send_json(200, {'results': service.quote_batch(quotes)})
+            except (ValueError, KeyError, TypeError) as exc:
+                self._send_json(400, {'error': str(exc)})
+
+        def log_message(self, format, *args):
+            # Keep the hot path quiet; per-request logging costs more than a quote
+            pass
+
+    return ThreadingHTTPServer((host, port), QuoteHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve single-quote pricing over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--bundle-root', default='model_bundle')
+    parser.add_argument('--store-dir', default='feature_store')
+    parser.add_argument('--version', default=None, help='Bundle version (default: latest)')
+    args = parser.parse_args()
+    configure_from_env()
+    service = load_quote_service(args.bundle_root, args.store_dir, args.version)
+    server = make_server(service, args.host, args.port)
+    print(f"Pricing service (bundle {service.version}, {len(service.index)} combinations) on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
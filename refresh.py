@@ -0,0 +1,175 @@
+"""
+Incremental model refresh: instead of retraining on the whole history every month, warm-start the
+previous bundle's classifier and regressor with CatBoost init_model, adding trees fitted on the months
+that arrived (or changed) since the bundle was saved. The previous models are first scored on those months with
+the monthwise_validation metrics (R2, MAE); when they have degraded past a threshold against the bundle's
+validation baseline, or the data drifted in a way a warm start cannot absorb (unseen products, missing
+bins, changed features), both models are retrained from scratch instead.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostClassifier
+from sklearn.metrics import mean_absolute_error, mean_absolute_percentage_error, r2_score
+
+from binning import fit_product_bins, assign_product_bins
+from classifier import train_bin_classifier, predict_bin
+from regressor import train_regressor, predict_margin
+from instrumentation import instrumented, span
+from sharding import ShardedModel
+from training import monthwise_validation
+from tuning import PARAM_GRID, categorical_features
+
+# Trees added per refresh (the learning rate is the previous model's)
+REFRESH_ITERATIONS = 50
+# Retrain when the new months' R2 falls this much below the baseline ...
+MAX_R2_DROP = 0.1
+# ... or their MAE exceeds the baseline by this fraction (not MAPE: margins near zero make it explode) ...
+MAX_MAE_INCREASE = 0.25
+# ... or more than this share of the new rows belong to products the bins were not fitted on
+MAX_UNSEEN_SHARE = 0.05
+# Months of the walk-forward validation that sets the baseline
+VALIDATION_MONTHS = 3
+
+
+def refresh_model(model, X, y, n_trees=REFRESH_ITERATIONS):
+    """
+    Warm-start a trained CatBoost model: fit n_trees more trees on (X, y) starting from model's
+    predictions (init_model), with the same parameters. Returns the new model; model is unchanged.
+    A classifier needs every one of its classes in y.
+    """
+    params = model.get_params()
+    params['iterations'] = n_trees
+    if isinstance(model, CatBoostClassifier):
+        params['class_names'] = model.classes_.tolist()
+    refreshed = type(model)(**params)
+    with span('refresh.fit', rows=len(X), estimator=type(model).__name__, trees=n_trees):
+        refreshed.fit(X, y, cat_features=categorical_features(X) or None, init_model=model)
+    return refreshed
+
+
+def month_metrics(y_true, y_pred):
+    """
+    R2, MAPE and MAE as monthwise_validation reports them.
+    """
+    return {'r2': float(r2_score(y_true, y_pred)), 'mape': float(mean_absolute_percentage_error(y_true, y_pred)),
+            'mae': float(mean_absolute_error(y_true, y_pred))}
+
+
+def validation_baseline(df, regressor, regressor_features, target_col='Margin_Per_Unit', months_back=VALIDATION_MONTHS):
+    """
+    Average R2, MAPE and MAE of monthwise_validation over the last months_back months of df, with the
+    regressor's hyperparameters as a one-point grid (no search). Returns {'r2', 'mape', 'mae', 'months_back'}.
+    """
+    params = regressor.get_params()
+    param_grid = {name: [params[name]] for name in PARAM_GRID if name in params}
+    _, _, scores, results = monthwise_validation(df, regressor_features, target_col, months_back=months_back,
+                                                 param_grid=param_grid, cache_dir=None)
+    r2, mape = scores['CatBoost']
+    mae = np.mean(results['CatBoost']['mae'])
+    return {'r2': float(r2), 'mape': float(mape), 'mae': float(mae), 'months_back': months_back}
+
+
+def degradation_reasons(metrics, baseline, unseen_share, max_r2_drop=MAX_R2_DROP, max_mae_increase=MAX_MAE_INCREASE,
+                        max_unseen_share=MAX_UNSEEN_SHARE):
+    """
+    Reasons to retrain instead of refreshing (an empty list means a refresh is fine).
+    The error test uses MAE: with margins near zero MAPE is huge for any model, so it never moves past the threshold.
+    """
+    reasons = []
+    if unseen_share > max_unseen_share:
+        reasons.append(f"{unseen_share:.1%} of the new rows are products without bins (limit {max_unseen_share:.1%})")
+    if baseline['r2'] - metrics['r2'] > max_r2_drop:
+        reasons.append(f"R2 {metrics['r2']:.4f} is more than {max_r2_drop} below the baseline {baseline['r2']:.4f}")
+    if metrics['mae'] > baseline['mae'] * (1 + max_mae_increase):
+        reasons.append(f"MAE {metrics['mae']:.4f} is more than {max_mae_increase:.0%} above the baseline {baseline['mae']:.4f}")
+    return reasons
+
+
+def months_to_refresh(months, metadata, month_hashes=None):
+    """
+    Boolean mask of the rows of months (a YearMonth column) the bundle with metadata was not trained on:
+    months after its latest_month, and earlier months whose input hash in month_hashes (from
+    feature_store.stored_month_hashes) differs from the one saved in the bundle (late rows of a month stored
+    before it was complete, corrections). A bundle saved without hashes gets its latest month refreshed again.
+    """
+    last_month = pd.Period(metadata['latest_month'], freq='M')
+    is_new = months > last_month
+    if month_hashes is not None:
+        saved = metadata.get('month_hashes')
+        if saved is None:
+            changed = [str(last_month)]
+        else:
+            changed = [m for m, digest in month_hashes.items() if pd.Period(m, freq='M') <= last_month and saved.get(m) != digest]
+        is_new |= months.astype(str).isin(changed)
+    return is_new.to_numpy()
+
+
+@instrumented
+def refresh_models(df_eng, feature_cols, bundle, n_trees=REFRESH_ITERATIONS, n_bins=5, max_r2_drop=MAX_R2_DROP,
+                   max_mae_increase=MAX_MAE_INCREASE, max_unseen_share=MAX_UNSEEN_SHARE,
+                   validation_months=VALIDATION_MONTHS, month_hashes=None, **tuning_kwargs):
+    """
+    Update the bundle's models with the months of df_eng it was not trained on (months_to_refresh with
+    month_hashes, the input hashes of df_eng's months). The previous models are scored on the new months; unless degradation_reasons finds a reason to
+    retrain, both are warm-started on them with refresh_model and the bin edges are kept. Otherwise
+    bins, classifier and regressor are rebuilt on all of df_eng as run_pipeline does (tuning_kwargs
+    go to the tuner). The validation baseline comes from the bundle metadata, or is computed with
+    validation_baseline on the old months the first time (or when it predates the MAE test).
+    Returns (classifier, regressor, bin_edges, classifier_features, regressor_features, report); report
+    holds the mode ('unchanged', 'refresh' or 'retrain'), the reasons, the new months' metrics, the
+    baseline (to store in the next bundle) and the time taken.
+    """
+    start = time.perf_counter()
+    is_new = months_to_refresh(df_eng['YearMonth'], bundle.metadata, month_hashes)
+    new_months = sorted(str(m) for m in df_eng.loc[is_new, 'YearMonth'].unique())
+    report = {'previous_version': bundle.version, 'new_months': new_months, 'new_rows': int(is_new.sum()),
+              'reasons': [], 'validation': bundle.metadata.get('validation')}
+    classifier_features, regressor_features = bundle.classifier_features, bundle.regressor_features
+    if not is_new.any():
+        report.update(mode='unchanged', seconds=time.perf_counter() - start)
+        return bundle.classifier, bundle.regressor, bundle.bin_edges, classifier_features, regressor_features, report
+
+    bin_edges = bundle.bin_edges
+    if isinstance(bundle.classifier, ShardedModel) or isinstance(bundle.regressor, ShardedModel):
+        report['reasons'].append('the bundle has sharded models, which are not warm-started')
+    elif set(regressor_features) != set(feature_cols) | {'Predicted_Bin'}:
+        report['reasons'].append('feature columns changed since the bundle was trained')
+    else:
+        # Score the previous models on the new months, as the next fold of a walk-forward validation
+        new = assign_product_bins(df_eng[is_new].copy(), bin_edges)
+        new['Predicted_Bin'] = np.ravel(predict_bin(bundle.classifier, new, classifier_features))
+        report['metrics'] = month_metrics(new['Margin_Per_Unit'], predict_margin(bundle.regressor, new, regressor_features))
+        if report['validation'] is None or 'mae' not in report['validation']:
+            history = assign_product_bins(df_eng[~is_new].copy(), bin_edges)
+            history['Predicted_Bin'] = np.ravel(predict_bin(bundle.classifier, history, classifier_features))
+            report['validation'] = validation_baseline(history, bundle.regressor, regressor_features,
+                                                       months_back=validation_months)
+        unseen_share = float(new['Margin_Bin'].isna().mean())
+        report['reasons'] = degradation_reasons(report['metrics'], report['validation'], unseen_share,
+                                                max_r2_drop, max_mae_increase, max_unseen_share)
+        new = new[new['Margin_Bin'].notna()]
+        missing_bins = sorted(set(bundle.classifier.classes_.tolist()) - set(new['Margin_Bin'].astype(int)))
+        if missing_bins:
+            report['reasons'].append(f"bins {missing_bins} do not occur in the new rows, so the classifier cannot be warm-started")
+
+    if report['reasons']:
+        print(f"Full retrain: {'; '.join(report['reasons'])}")
+        classifier_features = [col for col in feature_cols if col != 'Margin_Bin']
+        regressor_features = feature_cols + ['Predicted_Bin']
+        bin_edges = fit_product_bins(df_eng, n_bins=n_bins)
+        df_binned = assign_product_bins(df_eng.copy(), bin_edges)
+        clf = train_bin_classifier(df_binned, classifier_features, label_col='Margin_Bin', **tuning_kwargs)
+        df_binned['Predicted_Bin'] = predict_bin(clf, df_binned, classifier_features)
+        reg = train_regressor(df_binned, regressor_features, target_col='Margin_Per_Unit', **tuning_kwargs)
+        # The baseline belonged to the old models; the next refresh recomputes it
+        report.update(mode='retrain', validation=None)
+    else:
+        print(f"Refreshing models with {n_trees} trees on {', '.join(new_months)} ({len(new)} rows)")
+        clf = refresh_model(bundle.classifier, new[classifier_features], new['Margin_Bin'].astype(int), n_trees)
+        new['Predicted_Bin'] = np.ravel(predict_bin(clf, new, classifier_features))
+        reg = refresh_model(bundle.regressor, new[regressor_features], new['Margin_Per_Unit'], n_trees)
+        report['mode'] = 'refresh'
+    report['seconds'] = time.perf_counter() - start
+    return clf, reg, bin_edges, classifier_features, regressor_features, report
@@ -1,61 +1,230 @@
-import pandas as pd
-from feature_engineering import engineer_features
+"""
+Full training and pricing pipeline, declared as stages for pipeline.run_stages.
+
+    python run_pipeline.py [--data commodity_sales_data.csv] [--jobs 2] [--no-cache]
+
+Stage outputs are cached in .pipeline_cache/ keyed by a hash of their inputs, code and parameters,
+so e.g. changing a pricing-rule parameter only reruns the pricelist stage.
+"""
+import argparse
+
+from ingestion import load_sales_data
+from feature_store import store_fingerprint, stored_month_hashes, update_feature_store
 from binning import fit_product_bins, assign_product_bins
 from classifier import train_bin_classifier, predict_bin
-from regressor import train_regressor, predict_margin
-from pricing_rules import apply_pricing_rules
+from regressor import train_regressor
+from pricing_rules import compute_last_margin_table, compute_min_margin_table
 from prediction import generate_pricelist
+from model_bundle import BUNDLE_ROOT, load_bundle, save_bundle
+from refresh import REFRESH_ITERATIONS, refresh_models
+from sharding import SHARD_COLS
+from pipeline import PIPELINE_CACHE_DIR, Stage, run_stages
+from instrumentation import configure_from_env
+
+COMBO_COLS = ['Customer_Name', 'Product_Level_1', 'Product_Level_2', 'Application', 'Plant']
+
+
+# Stage functions take their inputs by name and must not modify them (cached values are shared).
+
+def engineer_stage(df, store_dir, n_workers):
+    # Feature engineering (incremental: only changed and new months are computed, see update_feature_store)
+    print('Running feature engineering...')
+    df_eng, feature_cols = update_feature_store(df, store_dir, n_workers)
+    # Saved in the bundle, so a later refresh can tell which trained months have changed since
+    return df_eng, feature_cols, stored_month_hashes(store_dir)
+
+
+def engineer_key(store_dir, n_workers):
+    # The store's input hashes identify df_eng: its recomputed last month can differ in the last float bits
+    return store_fingerprint(store_dir)
+
+
+def fit_bins_stage(df_eng, n_bins):
+    print('Creating product-level margin bins...')
+    return fit_product_bins(df_eng, n_bins=n_bins)
+
+
+def assign_bins_stage(df_eng, bin_edges):
+    return assign_product_bins(df_eng.copy(), bin_edges, margin_col='Margin_Per_Unit', product_col='Product_Level_2', label_col='Margin_Bin')
+
+
+def _shard_kwargs(shard_col, shard_workers):
+    return {} if shard_col is None else {'shard_col': shard_col, 'max_workers': shard_workers}
+
+
+def train_classifier_stage(df_binned, feature_cols, shard_col=None, shard_workers=None):
+    print('Training CatBoost classifier for margin bins...')
+    classifier_features = [col for col in feature_cols if col != 'Margin_Bin']  # Exclude label
+    clf = train_bin_classifier(df_binned, classifier_features, label_col='Margin_Bin', **_shard_kwargs(shard_col, shard_workers))
+    return clf, classifier_features
+
+
+def refresh_stage(df_eng, feature_cols, month_hashes, bundle_root, n_trees, n_bins):
+    # Warm-start the latest bundle's models on the new or changed months (or retrain them if they degraded)
+    print('Refreshing models from the latest bundle...')
+    return refresh_models(df_eng, feature_cols, load_bundle(bundle_root), n_trees=n_trees, n_bins=n_bins,
+                          month_hashes=month_hashes)
+
+
+def predict_bins_stage(df_binned, clf, classifier_features):
+    # Predicted bins for all data, used as a feature by the regressor
+    print('Predicting bins for all data...')
+    df_pred = df_binned.copy()
+    df_pred['Predicted_Bin'] = predict_bin(clf, df_pred, classifier_features)
+    return df_pred
+
+
+def train_regressor_stage(df_pred, feature_cols, shard_col=None, shard_workers=None):
+    print('Training CatBoost regressor for margin prediction...')
+    regressor_features = feature_cols + ['Predicted_Bin']
+    reg = train_regressor(df_pred, regressor_features, target_col='Margin_Per_Unit', **_shard_kwargs(shard_col, shard_workers))
+    return reg, regressor_features
+
+
+def latest_month_stage(df_pred):
+    latest_month = df_pred['YearMonth'].max()
+    return df_pred[df_pred['YearMonth'] == latest_month].copy(), latest_month
+
+
+def all_combos_stage(df):
+    # All required combos (including outlier-only) must appear in the pricelist
+    return df[COMBO_COLS].drop_duplicates().reset_index(drop=True)
+
+
+def min_margin_stage(df_eng):
+    # Historical minimum over the whole engineered history, not just the month being priced
+    return compute_min_margin_table(df_eng)
+
+
+def last_margin_stage(df_eng):
+    # Latest margin of every combination in the whole history (reference for max_change_cap)
+    return compute_last_margin_table(df_eng)
+
+
+def pricelist_stage(test_latest, reg, regressor_features, bin_edges, all_combos, min_margin_table, last_margin_table,
+                    calibration_factor, output_csv, output_parquet):
+    # Predict the latest month, apply the pricing rules and save the pricelist (with price range)
+    print('Generating latest pricelist...')
+    return generate_pricelist(
+        test_latest,
+        reg,
+        regressor_features,
+        bin_edges,
+        bin_col='Predicted_Bin',
+        output_csv=output_csv,
+        all_combos_df=all_combos,
+        output_parquet=output_parquet,
+        min_margin_table=min_margin_table,
+        last_margin_table=last_margin_table,
+        calibration_factor=calibration_factor
+    )
+
+
+def bundle_stage(clf, reg, bin_edges, classifier_features, regressor_features, min_margin_table, latest_month,
+                 month_hashes, bundle_root=BUNDLE_ROOT, refresh_report=None):
+    # Save the model bundle so score.py can refresh the pricelist without retraining
+    print('Saving model bundle...')
+    metadata = {'latest_month': latest_month, 'month_hashes': month_hashes}
+    if refresh_report is not None:
+        # The validation baseline is carried to the next refresh
+        metadata.update(refresh=refresh_report, validation=refresh_report['validation'])
+    return save_bundle(
+        clf,
+        reg,
+        bin_edges,
+        classifier_features,
+        regressor_features,
+        min_margin_table,
+        bundle_root=bundle_root,
+        metadata=metadata
+    )
+
+
+def build_stages(store_dir='feature_store', n_bins=5, calibration_factor=0.5, output_csv='latest_pricelist.csv',
+                 feature_workers=1, output_parquet=None, refresh=False, bundle_root=BUNDLE_ROOT,
+                 refresh_trees=REFRESH_ITERATIONS, shard_col=None, shard_workers=None):
+    """
+    The pipeline as a list of stages in dependency order.
+    With refresh=True the bins and models come from refresh.refresh_models on the latest bundle in
+    bundle_root instead of being fitted from scratch (that stage always runs: the bundle is not part of its key).
+    With shard_col the classifier and regressor are sharded.ShardedModels with one model per value of
+    shard_col, trained in shard_workers processes.
+    """
+    shard_params = {'shard_col': shard_col, 'shard_workers': shard_workers}
+    stages = [
+        # Not cached: the feature store on disk is its cache (and must be kept current for score.py and the
+        # pricing service); its outputs are keyed by the store's input hashes, so later stages still hit their cache
+        Stage('engineer_features', engineer_stage, ['df'], ['df_eng', 'feature_cols', 'month_hashes'], {'store_dir': store_dir, 'n_workers': feature_workers},
+              cache=False, output_key=engineer_key),
+        Stage('all_combos', all_combos_stage, ['df'], ['all_combos'])
+    ]
+    if refresh:
+        stages += [
+            Stage('refresh_models', refresh_stage, ['df_eng', 'feature_cols', 'month_hashes'],
+                  ['clf', 'reg', 'bin_edges', 'classifier_features', 'regressor_features', 'refresh_report'],
+                  {'bundle_root': bundle_root, 'n_trees': refresh_trees, 'n_bins': n_bins}, cache=False),
+            Stage('assign_product_bins', assign_bins_stage, ['df_eng', 'bin_edges'], ['df_binned']),
+            Stage('predict_bins', predict_bins_stage, ['df_binned', 'clf', 'classifier_features'], ['df_pred'])
+        ]
+    else:
+        stages += [
+            Stage('fit_product_bins', fit_bins_stage, ['df_eng'], ['bin_edges'], {'n_bins': n_bins}),
+            Stage('assign_product_bins', assign_bins_stage, ['df_eng', 'bin_edges'], ['df_binned']),
+            Stage('train_bin_classifier', train_classifier_stage, ['df_binned', 'feature_cols'], ['clf', 'classifier_features'],
+                  shard_params),
+            Stage('predict_bins', predict_bins_stage, ['df_binned', 'clf', 'classifier_features'], ['df_pred']),
+            Stage('train_regressor', train_regressor_stage, ['df_pred', 'feature_cols'], ['reg', 'regressor_features'],
+                  shard_params)
+        ]
+    bundle_inputs = ['clf', 'reg', 'bin_edges', 'classifier_features', 'regressor_features', 'min_margin_table', 'latest_month',
+                     'month_hashes']
+    return stages + [
+        Stage('latest_month', latest_month_stage, ['df_pred'], ['test_latest', 'latest_month']),
+        Stage('min_margin_table', min_margin_stage, ['df_eng'], ['min_margin_table']),
+        Stage('last_margin_table', last_margin_stage, ['df_eng'], ['last_margin_table']),
+        Stage('generate_pricelist', pricelist_stage,
+              ['test_latest', 'reg', 'regressor_features', 'bin_edges', 'all_combos', 'min_margin_table', 'last_margin_table'],
+              ['pricelist'],
+              {'calibration_factor': calibration_factor, 'output_csv': output_csv, 'output_parquet': output_parquet},
+              cache=False),
+        Stage('save_bundle', bundle_stage, bundle_inputs + (['refresh_report'] if refresh else []),
+              ['bundle_path'], {'bundle_root': bundle_root}, cache=False)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the models and generate the latest pricelist.')
+    parser.add_argument('--data', default='commodity_sales_data.csv')
+    parser.add_argument('--store-dir', default='feature_store')
+    parser.add_argument('--output', default='latest_pricelist.csv')
+    parser.add_argument('--parquet', default=None, help='Also write the pricelist to this Parquet file')
+    parser.add_argument('--n-bins', type=int, default=5)
+    parser.add_argument('--calibration-factor', type=float, default=0.5)
+    parser.add_argument('--jobs', type=int, default=2, help='Stages run concurrently')
+    parser.add_argument('--feature-workers', type=int, default=1,
+                        help='Processes for the window features (same result as 1)')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Warm-start the latest bundle on the new months instead of retraining (falls back to a retrain on degradation)')
+    parser.add_argument('--refresh-trees', type=int, default=REFRESH_ITERATIONS, help='Trees added per refresh')
+    parser.add_argument('--bundle-root', default=BUNDLE_ROOT)
+    parser.add_argument('--shard-by', choices=sorted(SHARD_COLS), default=None,
+                        help='Train one classifier/regressor pair per product or product family (sparse ones use a global fallback)')
+    parser.add_argument('--shard-workers', type=int, default=None, help='Processes for the shard models (default: one per core)')
+    parser.add_argument('--cache-dir', default=PIPELINE_CACHE_DIR)
+    parser.add_argument('--no-cache', action='store_true', help='Rerun every stage')
+    args = parser.parse_args()
+    if args.refresh and args.shard_by:
+        parser.error('--refresh warm-starts single models; retrain one shard with sharding.py --retrain instead')
+    configure_from_env()
+
+    stages = build_stages(args.store_dir, args.n_bins, args.calibration_factor, args.output, args.feature_workers,
+                          args.parquet, args.refresh, args.bundle_root, args.refresh_trees,
+                          SHARD_COLS.get(args.shard_by), args.shard_workers)
+    print('Loading data...')
+    # No reference is kept here, so the raw frame is freed once the stages that take it are done
+    run_stages(stages, {'df': load_sales_data(args.data)}, cache_dir=args.cache_dir, max_workers=args.jobs, use_cache=not args.no_cache)
+    print('Pipeline complete.')
+
 
-# 1. Load data
-print('Loading data...')
-df = pd.read_csv('commodity_sales_data.csv', parse_dates=['Transaction_Date'])
-
-# 2. Feature engineering
-print('Running feature engineering...')
-df_eng, feature_cols = engineer_features(df)
-
-# 3. Binning: create product-level margin bins and assign bin labels
-print('Creating product-level margin bins...')
-bin_edges = fit_product_bins(df_eng, n_bins=5)
-df_eng = assign_product_bins(df_eng, bin_edges, margin_col='Margin_Per_Unit', product_col='Product_Level_2', label_col='Margin_Bin')
-
-# 4. Train CatBoost classifier to predict margin bins
-print('Training CatBoost classifier for margin bins...')
-classifier_features = [col for col in feature_cols if col != 'Margin_Bin']  # Exclude label
-clf = train_bin_classifier(df_eng, classifier_features, label_col='Margin_Bin')
-
-# 5. Predict bins for all data (for use as feature in regressor)
-print('Predicting bins for all data...')
-df_eng['Predicted_Bin'] = predict_bin(clf, df_eng, classifier_features)
-
-# 6. Train CatBoost regressor using all features (including predicted bin)
-print('Training CatBoost regressor for margin prediction...')
-regressor_features = feature_cols + ['Predicted_Bin']
-reg = train_regressor(df_eng, regressor_features, target_col='Margin_Per_Unit')
-
-# 7. Prepare latest month test set and all required combinations
-latest_month = df_eng['YearMonth'].max()
-test_latest = df_eng[df_eng['YearMonth'] == latest_month].copy()
-# Ensure all required combos (including outlier-only) are present
-all_combos = df[['Customer_Name', 'Product_Level_1', 'Product_Level_2', 'Application', 'Plant']].drop_duplicates().reset_index(drop=True)
-
-# 8. Predict margin for latest month
-print('Predicting margin for latest month...')
-test_latest['Predicted_Margin_Per_Unit'] = predict_margin(reg, test_latest, regressor_features)
-
-# 9. Apply pricing rules
-print('Applying pricing rules...')
-test_latest = apply_pricing_rules(test_latest, predicted_col='Predicted_Margin_Per_Unit')
-
-# 10. Generate and save latest pricelist (with price range)
-print('Generating latest pricelist...')
-pricelist = generate_pricelist(
-    test_latest,
-    reg,
-    regressor_features,
-    bin_edges,
-    bin_col='Predicted_Bin',
-    output_csv='latest_pricelist.csv',
-    all_combos_df=all_combos
-)
-print('Pipeline complete.') 
\ No newline at end of file
+if __name__ == '__main__':
+    main()
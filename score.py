@@ -0,0 +1,91 @@
+"""
+Score-only entry point: generate the latest pricelist from a saved model bundle, without training.
+
+    python score.py [--data commodity_sales_data.csv] [--bundle-root model_bundle] [--version VERSION]
+
+Run run_pipeline.py once to train and save a bundle. scikit-learn is not imported here.
+"""
+import time
+
+_START = time.perf_counter()
+
+import argparse
+
+from ingestion import load_sales_data
+from model_bundle import BUNDLE_ROOT, load_bundle
+from feature_store import update_feature_store
+from classifier import predict_bin
+from pricing_rules import compute_last_margin_table
+from prediction import generate_pricelist
+from instrumentation import configure_from_env
+
+_IMPORTED = time.perf_counter()
+
+
+def score(data_path='commodity_sales_data.csv', bundle_root=BUNDLE_ROOT, version=None,
+          output_csv='latest_pricelist.csv', store_dir='feature_store', output_parquet=None):
+    """
+    Score the latest month of data_path with a saved bundle and write the pricelist
+    (also to output_parquet, if given).
+    Returns (summary, timings): generate_pricelist's summary (rows and output paths) and the wall time
+    of each step in seconds.
+    """
+    timings = {}
+    step_start = time.perf_counter()
+
+    def lap(step):
+        nonlocal step_start
+        now = time.perf_counter()
+        timings[step] = now - step_start
+        step_start = now
+
+    bundle = load_bundle(bundle_root, version)
+    lap('open_bundle')
+    df = load_sales_data(data_path)
+    lap('load_data')
+    df_eng, _ = update_feature_store(df, store_dir)
+    latest_month = df_eng['YearMonth'].max()
+    test_latest = df_eng[df_eng['YearMonth'] == latest_month].copy()
+    all_combos = df[['Customer_Name', 'Product_Level_1', 'Product_Level_2', 'Application', 'Plant']].drop_duplicates().reset_index(drop=True)
+    lap('features')
+    classifier, regressor = bundle.classifier, bundle.regressor
+    lap('load_models')
+    test_latest['Predicted_Bin'] = predict_bin(classifier, test_latest, bundle.classifier_features)
+    lap('predict_bins')
+    summary = generate_pricelist(
+        test_latest,
+        regressor,
+        bundle.regressor_features,
+        bundle.bin_edges,
+        bin_col='Predicted_Bin',
+        output_csv=output_csv,
+        all_combos_df=all_combos,
+        output_parquet=output_parquet,
+        min_margin_table=bundle.min_margin_table,
+        last_margin_table=compute_last_margin_table(df_eng)
+    )
+    lap('pricelist')
+    return summary, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the latest pricelist from a saved model bundle.')
+    parser.add_argument('--data', default='commodity_sales_data.csv')
+    parser.add_argument('--bundle-root', default=BUNDLE_ROOT)
+    parser.add_argument('--version', default=None, help='Bundle version (default: latest)')
+    parser.add_argument('--output', default='latest_pricelist.csv')
+    parser.add_argument('--store-dir', default='feature_store')
+    parser.add_argument('--parquet', default=None, help='Also write the pricelist to this Parquet file')
+    args = parser.parse_args()
+    configure_from_env()
+    _, timings = score(args.data, args.bundle_root, args.version, args.output, args.store_dir, args.parquet)
+    total = time.perf_counter() - _START
+    print('\nScoring timings:')
+    print(f"  {'startup (imports)':<20} {_IMPORTED - _START:8.3f}s")
+    for step, seconds in timings.items():
+        print(f"  {step:<20} {seconds:8.3f}s")
+    print(f"  {'end-to-end':<20} {total:8.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""
+Per-product sharded models: one CatBoost model per Product_Level_2 (or Product_Level_1 family), each
+trained on its own rows, plus a fallback model trained on the products too sparse to get their own.
+
+ShardedModel.predict routes every row to its shard's model, so it can stand in for a single model
+anywhere one is used (predict_bin, predict_margin, generate_pricelist, the pricing service, bundles).
+The shards are independent, so train_sharded fits them in a process pool and retrain_product
+refits a single product without touching the others.
+
+    python sharding.py --retrain Product_3 [--data commodity_sales_data.csv]
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from instrumentation import configure_from_env, instrumented
+
+# Products with fewer training rows than this are priced by the fallback model
+MIN_SHARD_ROWS = 500
+SHARD_COLS = {'product': 'Product_Level_2', 'family': 'Product_Level_1'}
+SHARDS_FILE = 'shards.json'
+
+
+class ShardedModel:
+    """
+    Shard models keyed by the value of shard_col, with a fallback for every other value.
+    feature_names are the training columns, used to find shard_col when predicting on a numpy array.
+    """
+
+    def __init__(self, shard_col, models, fallback, feature_names, scoring=None):
+        self.shard_col = shard_col
+        self.models = dict(models)
+        self.fallback = fallback
+        self.feature_names = list(feature_names)
+        self.scoring = scoring
+
+    def _shard_values(self, X):
+        if isinstance(X, pd.DataFrame):
+            return X[self.shard_col].astype(object).to_numpy()
+        return np.asarray(X)[:, self.feature_names.index(self.shard_col)]
+
+    def predict(self, X):
+        """
+        Predict each row with its shard's model (rows of other shards go to the fallback), in row order.
+        """
+        shard_values = self._shard_values(X)
+        if len(shard_values) == 0:
+            return np.empty(0)
+        codes, shards = pd.factorize(shard_values)
+        groups = {}
+        for code, rows in pd.Series(np.arange(len(codes))).groupby(codes).indices.items():
+            shard = shards[code] if code >= 0 else None
+            groups.setdefault(shard if shard in self.models else None, []).append(rows)
+        result = None
+        for shard, parts in groups.items():
+            rows = np.sort(np.concatenate(parts))
+            model = self.models[shard] if shard is not None else self.fallback
+            pred = np.asarray(model.predict(X.iloc[rows] if isinstance(X, pd.DataFrame) else np.asarray(X)[rows]))
+            if result is None:
+                result = np.empty((len(codes),) + pred.shape[1:], dtype=pred.dtype)
+            result[rows] = pred
+        return result
+
+    def save(self, path):
+        """
+        Save as path/shard-<n>.cbm, path/fallback.cbm and path/shards.json (shard values and settings).
+        Shard values are stored as strings plus their dtype, so load returns keys of the same type; values
+        that do not survive the string round trip raise ValueError.
+        """
+        shards = pd.Index(list(self.models))
+        names = shards.astype(str)
+        if not _restore_shards(names, str(shards.dtype)).equals(shards):
+            raise ValueError(f"Shard values of dtype {shards.dtype} do not survive a string round trip.")
+        os.makedirs(path, exist_ok=True)
+        files = []
+        for i, (name, model) in enumerate(zip(names, self.models.values())):
+            file_name = f'shard-{i:04d}.cbm'
+            model.save_model(os.path.join(path, file_name))
+            files.append([name, file_name])
+        self.fallback.save_model(os.path.join(path, 'fallback.cbm'))
+        manifest = {'shard_col': self.shard_col, 'shards': files, 'shard_dtype': str(shards.dtype),
+                    'feature_names': self.feature_names, 'scoring': self.scoring}
+        with open(os.path.join(path, SHARDS_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    @classmethod
+    def load(cls, path, estimator_cls):
+        """
+        Load a ShardedModel saved with save; estimator_cls is the CatBoost class of its models.
+        Manifests saved without the shard dtype get string keys.
+        """
+        with open(os.path.join(path, SHARDS_FILE)) as f:
+            manifest = json.load(f)
+
+        def load_model(name):
+            model = estimator_cls()
+            model.load_model(os.path.join(path, name))
+            return model
+
+        shards = _restore_shards([shard for shard, _ in manifest['shards']], manifest.get('shard_dtype', 'object'))
+        models = {shard: load_model(name) for shard, (_, name) in zip(shards.tolist(), manifest['shards'])}
+        return cls(manifest['shard_col'], models, load_model('fallback.cbm'), manifest['feature_names'],
+                   manifest['scoring'])
+
+
+def _restore_shards(names, dtype):
+    return pd.Index(names, dtype=object).astype(dtype)
+
+
+def _fit_shard(shard, estimator_cls, X, y, scoring, tuning_kwargs):
+    """
+    Process-pool task: tune and fit one shard (shard is None for the fallback).
+    """
+    from tuning import fit_tuned
+    model, best_params = fit_tuned(estimator_cls, X, y, scoring=scoring, **tuning_kwargs)
+    return shard, model, best_params
+
+
+def shard_eligible(y, is_classifier, min_rows=MIN_SHARD_ROWS, cv=3):
+    """
+    Whether a shard with labels y gets its own model: at least min_rows rows and, for a classifier,
+    two or more classes with at least cv rows each (so the stratified search folds can be built).
+    """
+    if len(y) < min_rows:
+        return False
+    if is_classifier:
+        counts = pd.Series(y).value_counts()
+        return len(counts) >= 2 and counts.min() >= cv
+    return True
+
+
+@instrumented
+def train_sharded(estimator_cls, df, feature_cols, target_col, scoring, shard_col='Product_Level_2',
+                  min_rows=MIN_SHARD_ROWS, max_workers=None, fallback=None, **tuning_kwargs):
+    """
+    Train one estimator_cls model per value of shard_col with enough rows (see shard_eligible) and a
+    fallback on the rows of the other values, each tuned with tuning.fit_tuned, in a process pool of
+    max_workers processes (default: one per core). When those rows are too few for a model of their own
+    (see shard_eligible), the fallback is trained on all rows so unseen values still get a prediction.
+    fallback: an already fitted model (e.g. a global model on the same features) to reuse instead.
+    Cores are split between shards and CatBoost threads by balance_parallelism, and the largest tasks are
+    submitted first.
+    Returns a ShardedModel.
+    """
+    from catboost import CatBoostClassifier
+    from parallel import process_pool
+    from tuning import balance_parallelism
+    is_classifier = issubclass(estimator_cls, CatBoostClassifier)
+    cv = tuning_kwargs.get('cv', 3)
+    tasks = []
+    # Rows of the values without a model of their own (missing values included) train the fallback
+    fallback_rows = np.ones(len(df), dtype=bool)
+    for shard, rows in df.groupby(shard_col, observed=True, sort=True).indices.items():
+        if shard_eligible(df[target_col].iloc[rows], is_classifier, min_rows, cv):
+            part = df.iloc[rows]
+            tasks.append((shard, part[feature_cols], part[target_col]))
+            fallback_rows[rows] = False
+    if fallback is None:
+        if not shard_eligible(df[target_col][fallback_rows], is_classifier, min_rows, cv):
+            fallback_rows[:] = True
+        tasks.append((None, df.loc[fallback_rows, feature_cols], df.loc[fallback_rows, target_col]))
+    tasks.sort(key=lambda task: -len(task[1]))
+    n_workers, thread_count = balance_parallelism(len(tasks), max_workers)
+    if n_workers > 1:
+        # Each shard search runs in one process with its share of the cores; the pool supplies the parallelism
+        tuning_kwargs.setdefault('n_jobs', 1)
+        tuning_kwargs.setdefault('thread_count', thread_count)
+    models = {}
+    if n_workers == 1:
+        results = [_fit_shard(shard, estimator_cls, X, y, scoring, tuning_kwargs) for shard, X, y in tasks]
+    else:
+        with process_pool(n_workers) as executor:
+            futures = [executor.submit(_fit_shard, shard, estimator_cls, X, y, scoring, tuning_kwargs) for shard, X, y in tasks]
+            results = [future.result() for future in futures]
+    for shard, model, _ in results:
+        if shard is None:
+            fallback = model
+        else:
+            models[shard] = model
+    print(f"Sharded {estimator_cls.__name__}: {len(models)} {shard_col} shards, "
+          f"{df[shard_col].nunique() - len(models)} on the fallback model ({int(fallback_rows.sum())} rows)")
+    return ShardedModel(shard_col, models, fallback, feature_cols, scoring)
+
+
+def retrain_shard(model, df, shard, target_col, min_rows=MIN_SHARD_ROWS, **tuning_kwargs):
+    """
+    Refit the model of one shard on the rows of df where shard_col == shard (other shards and the
+    fallback are reused). A shard that is no longer eligible (see shard_eligible) raises ValueError: the
+    fallback was not trained on its rows, so the whole model must be retrained with train_sharded.
+    Returns a new ShardedModel.
+    """
+    from catboost import CatBoostClassifier
+    estimator_cls = type(model.fallback)
+    part = df[df[model.shard_col] == shard]
+    if not shard_eligible(part[target_col], issubclass(estimator_cls, CatBoostClassifier), min_rows,
+                          tuning_kwargs.get('cv', 3)):
+        raise ValueError(f"{model.shard_col} = {shard!r} has too few rows ({len(part)}) for a model of its own "
+                         f"and the fallback was not trained on them; retrain all shards with train_sharded.")
+    models = dict(model.models)
+    _, models[shard], _ = _fit_shard(shard, estimator_cls, part[model.feature_names], part[target_col],
+                                     model.scoring, tuning_kwargs)
+    return ShardedModel(model.shard_col, models, model.fallback, model.feature_names, model.scoring)
+
+
+def retrain_product(bundle, df_eng, shard, n_bins=5, min_rows=MIN_SHARD_ROWS, **tuning_kwargs):
+    """
+    Retrain one shard of a sharded bundle on its own: refit the bin edges of its products, then its
+    classifier and regressor models. Returns (classifier, regressor, bin_edges).
+    """
+    from binning import fit_product_bins, assign_product_bins
+    classifier, regressor = bundle.classifier, bundle.regressor
+    if not isinstance(classifier, ShardedModel) or not isinstance(regressor, ShardedModel):
+        raise ValueError(f"Bundle {bundle.version} is not sharded; retrain it with run_pipeline.py --shard-by.")
+    part = df_eng[df_eng[classifier.shard_col] == shard].copy()
+    if len(part) == 0:
+        raise ValueError(f"No rows for {classifier.shard_col} = {shard!r}.")
+    bin_edges = dict(bundle.bin_edges)
+    bin_edges.update(fit_product_bins(part, n_bins=n_bins))
+    part = assign_product_bins(part, bin_edges)
+    classifier = retrain_shard(classifier, part, shard, 'Margin_Bin', min_rows, **tuning_kwargs)
+    part['Predicted_Bin'] = np.ravel(classifier.predict(part[bundle.classifier_features]))
+    regressor = retrain_shard(regressor, part, shard, 'Margin_Per_Unit', min_rows, **tuning_kwargs)
+    return classifier, regressor, bin_edges
+
+
+def main():
+    from ingestion import load_sales_data
+    from feature_store import update_feature_store
+    from model_bundle import BUNDLE_ROOT, load_bundle, save_bundle
+    parser = argparse.ArgumentParser(description='Retrain the shard of one product (or family) in the latest sharded bundle.')
+    parser.add_argument('--retrain', required=True, help='Shard value, e.g. a Product_Level_2 name')
+    parser.add_argument('--data', default='commodity_sales_data.csv')
+    parser.add_argument('--store-dir', default='feature_store')
+    parser.add_argument('--bundle-root', default=BUNDLE_ROOT)
+    parser.add_argument('--n-bins', type=int, default=5)
+    args = parser.parse_args()
+    configure_from_env()
+
+    bundle = load_bundle(args.bundle_root)
+    df_eng, _ = update_feature_store(load_sales_data(args.data), args.store_dir)
+    classifier, regressor, bin_edges = retrain_product(bundle, df_eng, args.retrain, n_bins=args.n_bins)
+    metadata = dict(bundle.metadata, retrained_shard=args.retrain, previous_version=bundle.version)
+    save_bundle(classifier, regressor, bin_edges, bundle.classifier_features, bundle.regressor_features,
+                bundle.min_margin_table, bundle_root=args.bundle_root, metadata=metadata)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+Streaming mode for sales histories that do not fit in memory.
+
+    python streaming.py --data big_sales.csv [--chunk-rows 500000] [--months-per-chunk 1]
+
+The CSV is read in chunks and spilled to Parquet by month, so months can be processed in date order
+whatever the order of the file. Months are fed to the feature store a few at a time: its trailing raw
+partitions (CONTEXT_MONTHS) carry the 12-month window state across chunk boundaries, so feature
+engineering only holds the window plus the new months.
+
+Training is not bounded by the window. The engineered partitions are written one month at a time to a
+CatBoost pool file (TSV plus column description) that CatBoost parses and quantizes itself: every row of
+the history is held as floats and categorical hashes while loading (then about one byte per numeric value
+once quantized), but no pandas copy of the full history is built. Hyperparameters are tuned by tuning.fit_tuned on the last TUNE_MONTHS months only,
+and the final model is fitted on the whole pool. Product bins use two columns (product and margin) of the
+full history, because their quantiles are exact.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostClassifier, CatBoostRegressor, Pool
+
+from ingestion import DATE_COLS, SCHEMA
+from feature_engineering import add_recency_weight
+from feature_store import (append_months, build_feature_store, concat_partitions, iter_partitions, month_hashes,
+                           stored_feature_cols, stored_month_hashes, stored_months, truncate_store)
+from binning import fit_product_bins, assign_product_bins
+from classifier import predict_bin
+from pricing_rules import compute_last_margin_table, compute_min_margin_table
+from prediction import COMBO_COLS, generate_pricelist
+from model_bundle import BUNDLE_ROOT, save_bundle
+from instrumentation import configure_from_env, instrumented
+from tuning import categorical_features, fit_tuned
+
+STREAM_CHUNK_ROWS = 500_000
+STREAM_WORK_DIR = '.stream_work'
+TUNE_MONTHS = 12
+
+
+def read_sales_chunks(csv_path, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Yield the sales CSV in chunks of chunk_rows rows, parsed with the ingestion schema.
+    Numerics are not downcast: per-chunk downcasting would give different months different dtypes.
+    """
+    header = pd.read_csv(csv_path, nrows=0).columns
+    dtypes = {col: dtype for col, dtype in SCHEMA.items() if col in header}
+    yield from pd.read_csv(csv_path, dtype=dtypes, parse_dates=[c for c in DATE_COLS if c in header],
+                           chunksize=chunk_rows)
+
+
+@instrumented
+def spill_by_month(csv_path, spill_dir, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Split the CSV into spill_dir/YearMonth=<month>/part-<chunk>.parquet, one chunk in memory at a time.
+    Returns the months found, oldest first.
+    """
+    months = set()
+    for i, chunk in enumerate(read_sales_chunks(csv_path, chunk_rows)):
+        for month, part in chunk.groupby(chunk['Transaction_Date'].dt.to_period('M'), sort=True):
+            month_dir = os.path.join(spill_dir, f'YearMonth={month}')
+            os.makedirs(month_dir, exist_ok=True)
+            part.to_parquet(os.path.join(month_dir, f'part-{i:06d}.parquet'), index=False)
+            months.add(str(month))
+    return sorted(months)
+
+
+def read_spilled_months(spill_dir, months):
+    """
+    Rows of the given spilled months, in file order within each month.
+    """
+    parts = []
+    for month in months:
+        month_dir = os.path.join(spill_dir, f'YearMonth={month}')
+        parts.extend(pd.read_parquet(os.path.join(month_dir, name)) for name in sorted(os.listdir(month_dir)))
+    return concat_partitions(parts)
+
+
+@instrumented
+def stream_feature_store(csv_path, store_dir, chunk_rows=STREAM_CHUNK_ROWS, months_per_chunk=1, n_workers=1,
+                         spill_dir=None):
+    """
+    Build or extend the feature store from csv_path without loading it whole.
+    Each spilled month is hashed (one month in memory at a time) and the store is cut back to the first
+    month that changed, as update_feature_store does (see truncate_store). The months from there on are
+    engineered months_per_chunk at a time with append_months, which takes the outlier and rolling-window
+    context from the stored raw partitions, so the result matches update_feature_store on the full frame.
+    spill_dir is where the temporary month split goes (default: the system temp dir).
+    Returns the feature columns.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='stream_spill_', dir=spill_dir)
+    try:
+        months = spill_by_month(csv_path, tmp_dir, chunk_rows)
+        hashes = {}
+        for month in months:
+            hashes.update(month_hashes(read_spilled_months(tmp_dir, [month])))
+        first = truncate_store(store_dir, hashes)
+        new_months = months if first is None else [m for m in months if pd.Period(m, freq='M') >= first]
+        if len(new_months) < len(months):
+            print(f"Streaming: skipping {len(months) - len(new_months)} unchanged months already in {store_dir}.")
+        for start in range(0, len(new_months), months_per_chunk):
+            chunk = read_spilled_months(tmp_dir, new_months[start:start + months_per_chunk])
+            if first is None and start == 0:
+                build_feature_store(chunk, store_dir, n_workers)
+            else:
+                append_months(chunk, store_dir, n_workers)
+            del chunk
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return stored_feature_cols(store_dir)
+
+
+def _training_blocks(store_dir, feature_cols, label_col, transform=None, months=None):
+    """
+    Yield the label and feature_cols of each stored month (or of months), oldest first, with
+    Recency_Weight recomputed against the latest stored month and transform(part) applied first.
+    """
+    latest_month = pd.Period(stored_months(store_dir)[-1], freq='M')
+    for _, part in iter_partitions(store_dir, months=months):
+        if 'Recency_Weight' in feature_cols:
+            part = add_recency_weight(part, 'Transaction_Date', latest_month=latest_month)
+        if transform is not None:
+            part = transform(part)
+        yield part[[label_col] + feature_cols]
+
+
+@instrumented
+def write_pool_file(store_dir, feature_cols, label_col, path, transform=None):
+    """
+    Write the engineered history as a CatBoost pool file, one stored month at a time: path holds a
+    header, the label and feature_cols (tab separated) and path + '.cd' the column description
+    (label, categorical and numeric columns). Recency_Weight is recomputed against the latest stored month.
+    transform(part), if given, adds derived columns (e.g. the label) to each month before writing.
+    Returns (path, column description path).
+    """
+    cd_path = path + '.cd'
+    first = True
+    for block in _training_blocks(store_dir, feature_cols, label_col, transform):
+        if first:
+            cat_features = set(categorical_features(block[feature_cols]))
+            with open(cd_path, 'w') as f:
+                f.write(f'0\tLabel\t{label_col}\n')
+                for i, col in enumerate(feature_cols, start=1):
+                    f.write(f"{i}\t{'Categ' if col in cat_features else 'Num'}\t{col}\n")
+        block.to_csv(path, sep='\t', index=False, na_rep='nan', mode='w' if first else 'a', header=first)
+        first = False
+    return path, cd_path
+
+
+def recent_training_frame(store_dir, feature_cols, label_col, transform=None, n_months=TUNE_MONTHS):
+    """
+    The last n_months stored months as one frame (same rows and columns as write_pool_file writes), the
+    bounded sample the hyperparameters are tuned on. Returns (X, y).
+    """
+    months = stored_months(store_dir)[-n_months:]
+    frame = concat_partitions(list(_training_blocks(store_dir, feature_cols, label_col, transform, months)))
+    return frame[feature_cols], frame[label_col]
+
+
+def load_pool(path, cd_path):
+    """
+    Load a pool file written by write_pool_file and quantize it (one byte per value for the default
+    border count). CatBoost parses the file itself, so no DataFrame of the full history is built.
+    catboost.utils.quantize would skip the float copy but does not support categorical features.
+    """
+    pool = Pool(path, column_description=cd_path, has_header=True)
+    pool.quantize()
+    return pool
+
+
+def run_streaming(csv_path, store_dir='feature_store', work_dir=STREAM_WORK_DIR, chunk_rows=STREAM_CHUNK_ROWS,
+                  months_per_chunk=1, n_bins=5, calibration_factor=0.5, output_csv='latest_pricelist.csv',
+                  output_parquet=None, n_workers=1, param_grid=None, bundle_root=BUNDLE_ROOT, tune_months=TUNE_MONTHS):
+    """
+    The run_pipeline steps in streaming form: feature store from CSV chunks, bins from the margin and
+    product columns only, classifier and regressor tuned on the last tune_months months and trained from
+    pool files of the whole history, pricelist and model bundle from the latest month. Returns the pricelist
+    summary of generate_pricelist.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    print('Streaming feature engineering...')
+    feature_cols = stream_feature_store(csv_path, store_dir, chunk_rows, months_per_chunk, n_workers)
+
+    print('Creating product-level margin bins...')
+    margins = concat_partitions([part for _, part in iter_partitions(store_dir, columns=['Product_Level_2', 'Margin_Per_Unit'])])
+    bin_edges = fit_product_bins(margins, n_bins=n_bins)
+    del margins
+
+    def with_bins(part):
+        return assign_product_bins(part, bin_edges, margin_col='Margin_Per_Unit', product_col='Product_Level_2', label_col='Margin_Bin')
+
+    print('Training CatBoost classifier for margin bins from a pool file...')
+    classifier_features = [col for col in feature_cols if col != 'Margin_Bin']
+    classes = set()
+
+    def classifier_rows(part):
+        part = with_bins(part)
+        classes.update(part['Margin_Bin'].unique().tolist())
+        return part
+
+    clf_path, clf_cd = write_pool_file(store_dir, classifier_features, 'Margin_Bin',
+                                       os.path.join(work_dir, 'classifier.tsv'), classifier_rows)
+    X, y = recent_training_frame(store_dir, classifier_features, 'Margin_Bin', classifier_rows, tune_months)
+    # Labels read from a file are strings; class_names keeps the model's classes integer bins
+    clf, best_params = fit_tuned(CatBoostClassifier, X, y, scoring='accuracy', param_grid=param_grid,
+                                 final_pool=load_pool(clf_path, clf_cd),
+                                 model_params={'class_names': sorted(int(c) for c in classes)})
+    print(f"Best CatBoostClassifier params: {best_params}")
+    del X, y
+
+    print('Training CatBoost regressor for margin prediction from a pool file...')
+    regressor_features = feature_cols + ['Predicted_Bin']
+
+    def regressor_rows(part):
+        part = with_bins(part)
+        part['Predicted_Bin'] = np.ravel(predict_bin(clf, part, classifier_features))
+        return part
+
+    reg_path, reg_cd = write_pool_file(store_dir, regressor_features, 'Margin_Per_Unit',
+                                       os.path.join(work_dir, 'regressor.tsv'), regressor_rows)
+    X, y = recent_training_frame(store_dir, regressor_features, 'Margin_Per_Unit', regressor_rows, tune_months)
+    reg, best_params = fit_tuned(CatBoostRegressor, X, y, scoring='neg_mean_absolute_error', param_grid=param_grid,
+                                 final_pool=load_pool(reg_path, reg_cd))
+    print(f"Best CatBoostRegressor params: {best_params}")
+    del X, y
+
+    print('Pricing the latest month...')
+    latest_month, test_latest = next(iter_partitions(store_dir, months=stored_months(store_dir)[-1:]))
+    test_latest = with_bins(test_latest)
+    test_latest['Predicted_Bin'] = np.ravel(predict_bin(clf, test_latest, classifier_features))
+    # Historical minimum and latest margin over every stored month, one month at a time (months are stored in order)
+    min_margin_table = last_margin_table = None
+    for _, part in iter_partitions(store_dir, columns=['Customer_Name', 'Product_Level_2', 'Plant', 'Transaction_Date',
+                                                       'Margin_Per_Unit']):
+        table = compute_min_margin_table(part)
+        if min_margin_table is not None:
+            table = compute_min_margin_table(concat_partitions([min_margin_table, table]), margin_col='Historical_Min_Margin')
+        min_margin_table = table
+        table = compute_last_margin_table(part)
+        if last_margin_table is not None:
+            table = concat_partitions([last_margin_table, table]).drop_duplicates(
+                ['Customer_Name', 'Product_Level_2', 'Plant'], keep='last').reset_index(drop=True)
+        last_margin_table = table
+    # All required combos (including outlier-only ones), collected month by month from the raw partitions
+    combos = None
+    for _, raw in iter_partitions(store_dir, 'raw', columns=COMBO_COLS):
+        parts = [raw] if combos is None else [combos, raw]
+        combos = concat_partitions(parts).drop_duplicates().reset_index(drop=True)
+    summary = generate_pricelist(test_latest, reg, regressor_features, bin_edges, bin_col='Predicted_Bin',
+                                 output_csv=output_csv, all_combos_df=combos, output_parquet=output_parquet,
+                                 min_margin_table=min_margin_table, last_margin_table=last_margin_table,
+                                 calibration_factor=calibration_factor)
+    save_bundle(clf, reg, bin_edges, classifier_features, regressor_features, min_margin_table,
+                bundle_root=bundle_root,
+                metadata={'latest_month': latest_month, 'mode': 'streaming', 'month_hashes': stored_month_hashes(store_dir)})
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the models and generate the latest pricelist from a CSV larger than memory.')
+    parser.add_argument('--data', default='commodity_sales_data.csv')
+    parser.add_argument('--store-dir', default='feature_store')
+    parser.add_argument('--work-dir', default=STREAM_WORK_DIR, help='Where the pool files are written')
+    parser.add_argument('--chunk-rows', type=int, default=STREAM_CHUNK_ROWS, help='CSV rows read at a time')
+    parser.add_argument('--months-per-chunk', type=int, default=1, help='Months engineered at a time')
+    parser.add_argument('--output', default='latest_pricelist.csv')
+    parser.add_argument('--parquet', default=None, help='Also write the pricelist to this Parquet file')
+    parser.add_argument('--n-bins', type=int, default=5)
+    parser.add_argument('--calibration-factor', type=float, default=0.5)
+    parser.add_argument('--feature-workers', type=int, default=1,
+                        help='Processes for the window features (same result as 1)')
+    parser.add_argument('--tune-months', type=int, default=TUNE_MONTHS,
+                        help='Latest months the hyperparameters are tuned on (the final fit uses all of them)')
+    args = parser.parse_args()
+    configure_from_env()
+    run_streaming(args.data, args.store_dir, args.work_dir, args.chunk_rows, args.months_per_chunk, args.n_bins,
+                  args.calibration_factor, args.output, args.parquet, args.feature_workers,
+                  tune_months=args.tune_months)
+    print('Streaming pipeline complete.')
+
+
+if __name__ == '__main__':
+    main()
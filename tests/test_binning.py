@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from binning import load_bin_edges, save_bin_edges
+
+
+@pytest.mark.parametrize('products', [['Product_1', 'Product_2'], [3, 12], [1.5, 2.0]])
+def test_bin_edges_round_trip_keeps_key_type(products, tmp_path):
+    bin_edges = {product: np.array([0.0, 1.0 + i, 5.0]) for i, product in enumerate(products)}
+    path = str(tmp_path / 'edges.npz')
+    save_bin_edges(bin_edges, path)
+    loaded = load_bin_edges(path)
+    assert list(loaded) == products
+    assert [type(p) for p in loaded] == [type(p) for p in products]
+    for product in products:
+        np.testing.assert_array_equal(loaded[product], bin_edges[product])
+
+
+def test_keys_without_a_string_round_trip_are_refused(tmp_path):
+    with pytest.raises(ValueError):
+        save_bin_edges({1: np.array([0.0, 1.0]), 'Product_1': np.array([0.0, 1.0])}, str(tmp_path / 'edges.npz'))
@@ -0,0 +1,47 @@
+"""
+Spans recorded by pool workers reach the trace of the process that enabled tracing.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import feature_engineering as fe
+from instrumentation import disable_tracing, enable_tracing
+
+TASK_SPAN = 'feature_engineering._window_family_task'
+
+
+def run_window_features_in_a_pool():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'Transaction_Date': pd.Timestamp('2023-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 400, 300)), unit='D'),
+        'Customer_Name': rng.choice(['C1', 'C2', 'C3', 'C4'], 300),
+        'Margin_Per_Unit': rng.normal(100, 10, 300)
+    })
+    specs = [('Customer_Name', 'Margin_Per_Unit', 12, {'mean': 'mean_12m'})]
+    fe.compute_window_features(df, specs, n_workers=2)
+
+
+@pytest.mark.parametrize('name, load', [
+    ('trace.jsonl', lambda f: [json.loads(line) for line in f]),
+    # Pool workers exit without atexit handlers, so their spans must not wait for one
+    ('trace.json', lambda f: json.load(f)['traceEvents'])
+])
+def test_worker_spans_reach_the_trace(tmp_path, name, load):
+    path = str(tmp_path / name)
+    enable_tracing(path)
+    try:
+        run_window_features_in_a_pool()
+    finally:
+        disable_tracing()
+    with open(path) as f:
+        events = load(f)
+    task_pids = {e['pid'] for e in events if e['name'] == TASK_SPAN}
+    assert task_pids and os.getpid() not in task_pids
+    assert any(e['name'] == 'feature_engineering.compute_window_features' and e['pid'] == os.getpid() for e in events)
+    # The per-worker files of a Chrome trace are merged into it and removed
+    assert os.listdir(tmp_path) == [name]
+
@@ -0,0 +1,53 @@
+"""
+Equivalence of rolling_iqr_outlier_mask, which computes the quartiles once per distinct date, with the
+row-by-row implementation it replaced (kept in benchmarks.bench_outlier_mask).
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.bench_outlier_mask import legacy_rolling_iqr_outlier_mask
+from feature_engineering import rolling_iqr_outlier_mask
+
+
+def masks(df, window_months=12):
+    # A text column as in the sales data: with only a date and a float, iterrows turns a NaN target into NaT
+    df = df.assign(Customer_Name='C1')
+    return (rolling_iqr_outlier_mask(df, 'Transaction_Date', 'Margin_Per_Unit', window_months=window_months),
+            legacy_rolling_iqr_outlier_mask(df, 'Transaction_Date', 'Margin_Per_Unit', window_months=window_months))
+
+
+@pytest.mark.parametrize('window_months', [1, 3, 12])
+def test_matches_row_wise_with_ties_and_missing_targets(window_months):
+    rng = np.random.default_rng(3)
+    n = 600
+    # 600 rows on 90 distinct days over ~2 years, in random order: most dates are shared by several rows
+    days = rng.choice(np.arange(0, 720, 8), n)
+    margins = rng.normal(100, 15, n)
+    margins[rng.random(n) < 0.05] *= rng.choice([0.1, 6.0])
+    margins[rng.choice(n, 30, replace=False)] = np.nan
+    df = pd.DataFrame({
+        'Transaction_Date': pd.Timestamp('2022-01-01') + pd.to_timedelta(days, unit='D'),
+        'Margin_Per_Unit': margins
+    })
+    fast, legacy = masks(df, window_months)
+    np.testing.assert_array_equal(fast, legacy)
+    # Both outcomes occur, including dropped rows with a missing target
+    assert fast.any() and not fast.all()
+    assert not fast[np.isnan(margins)].all()
+
+
+def test_single_observation_and_single_row_windows():
+    day = lambda d: pd.Timestamp('2023-01-01') + pd.Timedelta(days=d)
+    rows = [
+        # Window of one row (under the 10-row minimum): kept whatever its value
+        (day(0), 100.0), (day(40), 1e6),
+        # A year later, eleven rows, one observed, on the same day: the next day's window has one observation (IQR 0)
+        *[(day(500), np.nan)] * 10, (day(500), 50.0),
+        (day(501), 50.0), (day(501), 50.5), (day(501), np.nan)
+    ]
+    df = pd.DataFrame(rows, columns=['Transaction_Date', 'Margin_Per_Unit'])
+    fast, legacy = masks(df)
+    np.testing.assert_array_equal(fast, legacy)
+    assert fast[:13].all()
+    assert list(fast[13:]) == [True, False, False]
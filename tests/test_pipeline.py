@@ -0,0 +1,95 @@
+import numpy as np
+from catboost import CatBoostRegressor
+
+from pipeline import Stage, content_hash, run_stages
+from sharding import ShardedModel
+
+
+def fitted_model(seed=0):
+    X = np.random.default_rng(seed).random((100, 3))
+    return CatBoostRegressor(iterations=5, verbose=0, random_state=seed, allow_writing_files=False).fit(X, X.sum(axis=1))
+
+
+def reloaded(model, path):
+    model.save_model(path)
+    copy = CatBoostRegressor()
+    copy.load_model(path)
+    return copy
+
+
+def test_model_hash_survives_save_and_load(tmp_path):
+    model = fitted_model()
+    first = reloaded(model, str(tmp_path / 'a.cbm'))
+    second = reloaded(first, str(tmp_path / 'b.cbm'))
+    assert content_hash(model) == content_hash(first) == content_hash(second)
+    assert content_hash(model) != content_hash(fitted_model(seed=1))
+
+
+def test_sharded_model_hash_survives_save_and_load(tmp_path):
+    sharded = ShardedModel('shard', {'A': fitted_model(0), 'B': fitted_model(1)}, fitted_model(2), ['shard', 'x', 'y'])
+    sharded.save(str(tmp_path / 'sharded'))
+    first = ShardedModel.load(str(tmp_path / 'sharded'), CatBoostRegressor)
+    second = ShardedModel.load(str(tmp_path / 'sharded'), CatBoostRegressor)
+    assert content_hash(first) == content_hash(second) == content_hash(sharded)
+
+
+def test_uncached_model_stage_keeps_downstream_cache(tmp_path):
+    model_path = str(tmp_path / 'model.cbm')
+    fitted_model().save_model(model_path)
+    calls = []
+
+    def load_stage():
+        model = CatBoostRegressor()
+        model.load_model(model_path)
+        return model
+
+    def predict_stage(model):
+        calls.append(1)
+        return model.predict(np.zeros((1, 3)))
+
+    stages = [Stage('load_model', load_stage, outputs=['model'], cache=False),
+              Stage('predict', predict_stage, ['model'], ['pred'])]
+    for _ in range(2):
+        run = run_stages(stages, {}, cache_dir=str(tmp_path / 'cache'), max_workers=1)
+    assert run.summary().loc['predict', 'status'] == 'cached'
+    assert len(calls) == 1
+
+
+def test_rule_parameter_change_keeps_the_training_stages_cached(tmp_path, monkeypatch):
+    import run_pipeline
+    from benchmarks.synthetic_data import generate_sales_data
+
+    monkeypatch.chdir(tmp_path)
+    small_grid = {'param_grid': {'iterations': [10], 'depth': [2], 'learning_rate': [0.1]}, 'cv': 2}
+    train_bin_classifier, train_regressor = run_pipeline.train_bin_classifier, run_pipeline.train_regressor
+    monkeypatch.setattr(run_pipeline, 'train_bin_classifier', lambda *args, **kwargs: train_bin_classifier(*args, **kwargs, **small_grid))
+    monkeypatch.setattr(run_pipeline, 'train_regressor', lambda *args, **kwargs: train_regressor(*args, **kwargs, **small_grid))
+    # Enough rows for the recomputed last month to differ from the first build in the last float bits
+    df = generate_sales_data(3000, n_products=10, months=18, seed=1)
+    for calibration_factor in (0.5, 0.7):
+        stages = run_pipeline.build_stages(str(tmp_path / 'store'), calibration_factor=calibration_factor,
+                                           output_csv=str(tmp_path / 'pricelist.csv'), bundle_root=str(tmp_path / 'bundles'))
+        run = run_stages(stages, {'df': df}, cache_dir=str(tmp_path / 'cache'), max_workers=1)
+    status = run.summary()['status']
+    assert status['engineer_features'] == 'ran'
+    assert status[['train_bin_classifier', 'train_regressor']].tolist() == ['cached', 'cached']
+    assert status['generate_pricelist'] == 'ran'
+
+
+def test_values_are_released_after_their_last_consumer(tmp_path):
+    released = []
+
+    class Frame:
+        def __init__(self, name):
+            self.name = name
+
+        def __del__(self):
+            released.append(self.name)
+
+    stages = [Stage('engineer', lambda raw: Frame('engineered'), ['raw'], ['engineered'], cache=False),
+              Stage('check_released', lambda engineered: list(released), ['engineered'], ['seen'], cache=False),
+              Stage('summarize', lambda engineered: 1, ['engineered'], ['total'], cache=False)]
+    run = run_stages(stages, {'raw': Frame('raw')}, cache_dir=str(tmp_path), max_workers=1)
+    assert run['seen'] == ['raw']
+    assert released == ['raw', 'engineered']
+    assert run['total'] == 1
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from prediction import COMBO_COLS, generate_pricelist
+from pricing_rules import compute_min_margin_table
+
+
+class ConstantModel:
+    def __init__(self, value):
+        self.value = value
+
+    def predict(self, X):
+        return np.full(len(X), self.value)
+
+
+def latest_rows():
+    return pd.DataFrame({
+        'Customer_Name': ['C1', 'C1', 'C2', 'C3'],
+        'Product_Level_1': ['F1'] * 4,
+        'Product_Level_2': ['P1'] * 4,
+        'Application': ['A1'] * 4,
+        'Plant': ['L1', 'L1', 'L1', 'L2'],
+        'Transaction_Date': pd.to_datetime(['2024-03-01', '2024-03-20', '2024-03-05', '2024-03-07']),
+        'Margin_Per_Unit': [100.0, 110.0, 50.0, 30.0],
+        'Feature': [1.0, 2.0, 3.0, 4.0],
+        'Predicted_Bin': [2, 2, 1, 1]
+    })
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 100])
+def test_pricelist_applies_the_pricing_rules(tmp_path, batch_size):
+    rows = latest_rows()
+    history = pd.concat([rows.assign(Margin_Per_Unit=[90.0, 95.0, 60.0, 20.0]), rows], ignore_index=True)
+    output_csv = tmp_path / 'pricelist.csv'
+    pricelist = generate_pricelist(rows, ConstantModel(40.0), ['Feature'], {'P1': np.array([0.0, 50.0, 200.0])},
+                                   output_csv=output_csv, batch_size=batch_size,
+                                   min_margin_table=compute_min_margin_table(history), calibration_factor=0.5,
+                                   return_frame=True)
+    assert pricelist[COMBO_COLS[0]].tolist() == ['C1', 'C2', 'C3']
+    # C1 (min 90) and C2 (min 50) are floored at min + 0.5 * (min - 40); C3 (min 20) keeps the prediction
+    np.testing.assert_allclose(pricelist['Predicted_Margin_Per_Unit'], [115.0, 55.0, 40.0])
+    assert pricelist['Adjusted_Flag'].tolist() == [1, 1, 0]
+    np.testing.assert_allclose(pricelist['Original_Prediction'], [40.0, 40.0, np.nan])
+    np.testing.assert_allclose(pricelist['Historical_Min_Margin'], [90.0, 50.0, 20.0])
+    np.testing.assert_allclose(pricelist['Predicted_Min_Range'], [50.0, 0.0, 0.0])
+    written = pd.read_csv(output_csv)
+    assert list(written.columns) == list(pricelist.columns)
+    np.testing.assert_allclose(written['Predicted_Margin_Per_Unit'], [115.0, 55.0, 40.0])
+    assert written['Adjusted_Flag'].tolist() == [1, 1, 0]
+
+
+class FeatureModel:
+    def predict(self, X):
+        return X['Feature'].to_numpy() * 10.0
+
+
+@pytest.mark.parametrize('batch_size', [1, 100])
+def test_pricelist_is_written_batch_by_batch(tmp_path, batch_size):
+    rows = latest_rows()
+    missing = rows.iloc[[0]][COMBO_COLS].assign(Customer_Name='C9')
+    output_csv = tmp_path / 'pricelist.csv'
+    summary = generate_pricelist(rows, FeatureModel(), ['Feature'], {'P1': np.array([0.0, 50.0, 200.0])},
+                                 output_csv=output_csv, all_combos_df=pd.concat([rows[COMBO_COLS], missing]),
+                                 batch_size=batch_size, rules=[])
+    assert summary == {'rows': 4, 'output_csv': output_csv, 'output_parquet': None, 'rule_hits': {}}
+    written = pd.read_csv(output_csv)
+    assert written['Customer_Name'].tolist() == ['C1', 'C2', 'C3', 'C9']
+    # C1 is priced from its latest row (2024-03-20); C9 has no row and gets -1 features and bin 1
+    np.testing.assert_allclose(written['Predicted_Margin_Per_Unit'], [20.0, 30.0, 40.0, -10.0])
+    assert written['Predicted_Bin'].dtype == np.int64
+    assert written['Predicted_Bin'].tolist() == [2, 1, 1, 1]
+    assert output_csv.read_text().splitlines()[1].split(',')[6] == '2'
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from pricing_rules import apply_pricing_rules, compute_min_margin_table, max_change_cap, min_margin_floor
+
+
+def scored_rows():
+    return pd.DataFrame({
+        'Customer_Name': ['C1', 'C1', 'C2'],
+        'Product_Level_2': ['P1', 'P1', 'P1'],
+        'Plant': ['L1', 'L1', 'L1'],
+        'Transaction_Date': pd.to_datetime(['2024-03-01', '2024-03-20', '2024-03-05']),
+        'Margin_Per_Unit': [100.0, 110.0, 50.0],
+        'Predicted_Margin_Per_Unit': [150.0, 150.0, 52.0]
+    })
+
+
+def test_max_change_cap_gets_the_last_margin():
+    priced = apply_pricing_rules(scored_rows(), rules=[max_change_cap(0.2)])
+    # C1's last margin is 110 (the 2024-03-20 row), so 150 is capped at 132; C2 stays within 20% of 50
+    np.testing.assert_allclose(priced['Last_Margin_Per_Unit'], [110.0, 110.0, 50.0])
+    np.testing.assert_allclose(priced['Predicted_Margin_Per_Unit'], [132.0, 132.0, 52.0])
+    assert priced['Adjusted_Flag'].tolist() == [1, 1, 0]
+    assert priced.attrs['rule_hits'] == {'max_change_cap': 2}
+
+
+def test_given_tables_are_used():
+    rows = scored_rows().assign(Predicted_Margin_Per_Unit=[80.0, 80.0, 52.0])
+    history = pd.concat([rows.assign(Margin_Per_Unit=[90.0, 95.0, 60.0]), rows], ignore_index=True)
+    min_margin_table = compute_min_margin_table(history)
+    last = pd.DataFrame({'Customer_Name': ['C1', 'C2'], 'Product_Level_2': ['P1', 'P1'], 'Plant': ['L1', 'L1'],
+                         'Last_Margin_Per_Unit': [140.0, 51.0]})
+    # C1's floor comes from the table's minimum 90 (rows alone give 100): 90 + 0.5 * (90 - 80)
+    floored = apply_pricing_rules(rows, min_margin_table=min_margin_table, last_margin_table=last)
+    np.testing.assert_allclose(floored['Historical_Min_Margin'], [90.0, 90.0, 50.0])
+    np.testing.assert_allclose(floored['Predicted_Margin_Per_Unit'], [95.0, 95.0, 52.0])
+    assert floored.attrs['rule_hits'] == {'min_margin_floor': 2}
+    # The default rules do not read the last margin, so it is not attached
+    assert 'Last_Margin_Per_Unit' not in floored.columns
+    # The cap then keeps C1 within 20% of the table's last margin 140 (rows alone give 110)
+    priced = apply_pricing_rules(rows, min_margin_table=min_margin_table, last_margin_table=last,
+                                 rules=[min_margin_floor(0.5), max_change_cap(0.2)])
+    np.testing.assert_allclose(priced['Last_Margin_Per_Unit'], [140.0, 140.0, 51.0])
+    np.testing.assert_allclose(priced['Predicted_Margin_Per_Unit'], [112.0, 112.0, 52.0])
+    np.testing.assert_allclose(priced['Original_Prediction'], [80.0, 80.0, np.nan])
+    assert priced.attrs['rule_hits'] == {'min_margin_floor': 2, 'max_change_cap': 2}
+
+
+def test_missing_predictions_are_not_rule_hits():
+    rows = scored_rows().assign(Predicted_Margin_Per_Unit=[np.nan, 150.0, np.nan])
+    priced = apply_pricing_rules(rows, rules=[min_margin_floor(0.5), max_change_cap(0.2)])
+    assert priced.attrs['rule_hits'] == {'min_margin_floor': 0, 'max_change_cap': 1}
+    assert priced['Adjusted_Flag'].tolist() == [0, 1, 0]
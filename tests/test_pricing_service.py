@@ -0,0 +1,128 @@
+"""
+Request/response contract of the pricing service, through a real HTTP server on a free local port.
+"""
+import http.client
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from catboost import CatBoostClassifier, CatBoostRegressor
+
+from benchmarks.synthetic_data import generate_sales_data
+from binning import assign_product_bins, fit_product_bins
+from feature_engineering import engineer_features
+from prediction import generate_pricelist
+from pricing_rules import compute_last_margin_table, compute_min_margin_table, max_change_cap, min_margin_floor
+from pricing_service import COMBO_COLS, QuoteService, make_server
+from tuning import categorical_features
+
+RESULT_KEYS = {'Predicted_Margin_Per_Unit', 'Predicted_Bin', 'Predicted_Min_Range', 'Predicted_Max_Range',
+               'Adjusted_Flag', 'Original_Prediction', 'Rule_Hits'}
+
+
+@pytest.fixture(scope='module')
+def trained():
+    df_eng, feature_cols = engineer_features(generate_sales_data(1500, months=12, seed=0))
+    bin_edges = fit_product_bins(df_eng)
+    df_eng = assign_product_bins(df_eng, bin_edges)
+    classifier_features = feature_cols
+    regressor_features = feature_cols + ['Predicted_Bin']
+    X = df_eng[classifier_features]
+    classifier = CatBoostClassifier(iterations=20, verbose=0, random_state=0)
+    classifier.fit(X, df_eng['Margin_Bin'].astype(int), cat_features=categorical_features(X))
+    df_eng['Predicted_Bin'] = np.ravel(classifier.predict(X))
+    X = df_eng[regressor_features]
+    regressor = CatBoostRegressor(iterations=20, verbose=0, random_state=0)
+    regressor.fit(X, df_eng['Margin_Per_Unit'], cat_features=categorical_features(X))
+    return classifier, regressor, classifier_features, regressor_features, bin_edges, df_eng.drop(columns='Predicted_Bin')
+
+
+def make_service(trained, **kwargs):
+    classifier, regressor, classifier_features, regressor_features, bin_edges, df_eng = trained
+    return QuoteService(classifier, regressor, classifier_features, regressor_features, bin_edges, df_eng,
+                        version='test', **kwargs)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(service):
+        server = make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=10)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def request(conn, method, path, payload=None):
+    body = None if payload is None else (payload if isinstance(payload, str) else json.dumps(payload))
+    conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_quotes_match_the_pricelist(trained, serve, tmp_path):
+    classifier, regressor, classifier_features, regressor_features, bin_edges, df_eng = trained
+    min_margin_table = compute_min_margin_table(df_eng)
+    # Every combination of the history, plus one without any row (an outlier-only combination)
+    all_combos = df_eng[COMBO_COLS].astype(object).drop_duplicates()
+    extra = dict(all_combos.iloc[0], Customer_Name='Outlier Only')
+    all_combos = pd.concat([all_combos, pd.DataFrame([extra])], ignore_index=True)
+    service = make_service(trained, min_margin_table=min_margin_table, all_combos_df=all_combos)
+    # The pricelist of the latest month, built as run_pipeline builds it
+    test_latest = df_eng[df_eng['YearMonth'] == df_eng['YearMonth'].max()].copy()
+    test_latest['Predicted_Bin'] = np.ravel(classifier.predict(test_latest[classifier_features]))
+    pricelist = generate_pricelist(test_latest, regressor, regressor_features, bin_edges, all_combos_df=all_combos,
+                                   output_csv=str(tmp_path / 'pricelist.csv'), min_margin_table=min_margin_table,
+                                   last_margin_table=compute_last_margin_table(df_eng), return_frame=True)
+    assert len(service.index) == len(pricelist)
+    quotes = pricelist[COMBO_COLS].astype(object).to_dict('records')
+    status, payload = request(serve(service), 'POST', '/quote', {'quotes': quotes + [dict(quotes[0], Plant='Nowhere')]})
+    assert status == 200
+    results = payload['results']
+    assert len(results) == len(quotes) + 1
+    assert results[-1]['error'] == 'unknown combination'
+    assert results[-2]['Customer_Name'] == 'Outlier Only' and results[-2]['Predicted_Bin'] == 1
+    for result, quote, (_, row) in zip(results, quotes, pricelist.iterrows()):
+        assert set(result) == set(COMBO_COLS) | RESULT_KEYS | {'Historical_Min_Margin'}
+        assert {c: result[c] for c in COMBO_COLS} == quote
+        assert result['Predicted_Bin'] == row['Predicted_Bin']
+        assert result['Predicted_Margin_Per_Unit'] == pytest.approx(row['Predicted_Margin_Per_Unit'])
+        assert result['Predicted_Min_Range'] == pytest.approx(row['Predicted_Min_Range'], nan_ok=True)
+        assert result['Predicted_Max_Range'] == pytest.approx(row['Predicted_Max_Range'], nan_ok=True)
+        assert result['Adjusted_Flag'] == row['Adjusted_Flag']
+        assert result['Rule_Hits'] == (['min_margin_floor'] if row['Adjusted_Flag'] else [])
+
+
+def test_health_and_bad_requests(trained, serve):
+    service = make_service(trained)
+    conn = serve(service)
+    assert request(conn, 'GET', '/health') == (200, {'status': 'ok', 'version': 'test', 'combinations': len(service.index)})
+    assert request(conn, 'GET', '/other')[0] == 404
+    assert request(conn, 'POST', '/quote', 'not json')[0] == 400
+    assert request(conn, 'POST', '/quote', {'no_quotes': []})[0] == 400
+
+
+def test_without_min_margin_table_no_floor_is_applied(trained, serve):
+    service = make_service(trained)
+    assert service.rules == []
+    quote = dict(zip(COMBO_COLS, next(iter(service.index))))
+    status, payload = request(serve(service), 'POST', '/quote', {'quotes': [quote]})
+    assert status == 200
+    assert payload['results'][0]['Adjusted_Flag'] == 0
+    assert 'Historical_Min_Margin' not in payload['results'][0]
+
+
+def test_rules_are_checked_at_startup(trained):
+    with pytest.raises(ValueError, match='min_margin_floor'):
+        make_service(trained, rules=[min_margin_floor()])
+    # The last margin reference of max_change_cap comes from the stored rows
+    service = make_service(trained, rules=[max_change_cap(0.01)])
+    assert any(result['Rule_Hits'] == ['max_change_cap'] for result in service.results)
@@ -0,0 +1,31 @@
+import pandas as pd
+
+from refresh import degradation_reasons, months_to_refresh
+
+BASELINE = {'r2': 0.9, 'mape': 2e14, 'mae': 10.0}
+
+
+def test_error_increase_is_measured_with_mae():
+    # MAPE is huge for every model when margins are near zero; a degraded MAE still triggers a retrain
+    assert degradation_reasons({'r2': 0.88, 'mape': 1e14, 'mae': 13.0}, BASELINE, 0.0)[0].startswith('MAE 13.0000')
+    assert degradation_reasons({'r2': 0.88, 'mape': 9e14, 'mae': 12.0}, BASELINE, 0.0) == []
+
+
+def months(*values):
+    return pd.Series(pd.PeriodIndex(values, freq='M'))
+
+
+def test_changed_trained_months_are_refreshed():
+    metadata = {'latest_month': '2024-03', 'month_hashes': {'2024-01': 'a', '2024-02': 'b', '2024-03': 'c'}}
+    rows = months('2024-01', '2024-02', '2024-03', '2024-03', '2024-04')
+    unchanged = {'2024-01': 'a', '2024-02': 'b', '2024-03': 'c', '2024-04': 'd'}
+    assert months_to_refresh(rows, metadata, unchanged).tolist() == [False, False, False, False, True]
+    # Late rows of March change its hash
+    assert months_to_refresh(rows, metadata, {**unchanged, '2024-03': 'c2'}).tolist() == [False, False, True, True, True]
+    assert months_to_refresh(rows[:4], metadata, {**unchanged, '2024-03': 'c2'}).any()
+
+
+def test_bundle_without_hashes_refreshes_its_latest_month():
+    rows = months('2024-02', '2024-03')
+    assert months_to_refresh(rows, {'latest_month': '2024-03'}, {'2024-02': 'b', '2024-03': 'c'}).tolist() == [False, True]
+    assert months_to_refresh(rows, {'latest_month': '2024-03'}).tolist() == [False, False]
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+from catboost import CatBoostRegressor
+
+import sharding
+from sharding import ShardedModel, retrain_shard, train_sharded
+
+
+def fitted_model(n_features=2, seed=0):
+    X = np.random.default_rng(seed).random((60, n_features))
+    return CatBoostRegressor(iterations=5, verbose=0, random_state=seed, allow_writing_files=False).fit(X, X.sum(axis=1))
+
+
+def sales(rows_per_shard):
+    rng = np.random.default_rng(0)
+    parts = [pd.DataFrame({'shard': shard, 'x': rng.random(n), 'y': rng.random(n)}) for shard, n in rows_per_shard.items()]
+    return pd.concat(parts, ignore_index=True)
+
+
+@pytest.fixture
+def fit_calls(monkeypatch):
+    calls = {}
+
+    def fake_fit_shard(shard, estimator_cls, X, y, scoring, tuning_kwargs):
+        calls[shard] = sorted(X['shard'].unique().tolist())
+        return shard, fitted_model(), {}
+
+    monkeypatch.setattr(sharding, '_fit_shard', fake_fit_shard)
+    return calls
+
+
+def test_fallback_trains_on_the_rows_without_a_shard(fit_calls):
+    df = sales({'A': 30, 'B': 30, 'C': 10, 'D': 10})
+    model = train_sharded(CatBoostRegressor, df, ['shard', 'x'], 'y', 'neg_mean_absolute_error', 'shard',
+                          min_rows=20, max_workers=1)
+    assert sorted(model.models) == ['A', 'B']
+    assert fit_calls[None] == ['C', 'D']
+
+
+def test_fallback_uses_all_rows_when_too_few_are_left(fit_calls):
+    df = sales({'A': 30, 'B': 30, 'C': 10})
+    train_sharded(CatBoostRegressor, df, ['shard', 'x'], 'y', 'neg_mean_absolute_error', 'shard', min_rows=20,
+                  max_workers=1)
+    assert fit_calls[None] == ['A', 'B', 'C']
+
+
+def test_given_fallback_is_reused(fit_calls):
+    df = sales({'A': 30, 'C': 10})
+    fallback = fitted_model()
+    model = train_sharded(CatBoostRegressor, df, ['shard', 'x'], 'y', 'neg_mean_absolute_error', 'shard',
+                          min_rows=20, max_workers=1, fallback=fallback)
+    assert model.fallback is fallback
+    assert None not in fit_calls
+
+
+def test_retrain_of_a_shard_below_min_rows_raises(fit_calls):
+    model = ShardedModel('shard', {'A': fitted_model()}, fitted_model(), ['shard', 'x'], 'neg_mean_absolute_error')
+    with pytest.raises(ValueError, match='too few rows'):
+        retrain_shard(model, sales({'A': 10}), 'A', 'y', min_rows=20)
+    assert retrain_shard(model, sales({'A': 30}), 'A', 'y', min_rows=20).models['A'] is not model.models['A']
+
+
+@pytest.mark.parametrize('shards', [['Product_1', 'Product_2'], [np.int64(3), np.int64(7)], [1.5, 2.0]])
+def test_save_and_load_keep_the_shard_keys(tmp_path, shards):
+    model = ShardedModel('shard', {shard: fitted_model(seed=i) for i, shard in enumerate(shards)}, fitted_model(),
+                         ['shard', 'x'], 'neg_mean_absolute_error')
+    model.save(str(tmp_path))
+    loaded = ShardedModel.load(str(tmp_path), CatBoostRegressor)
+    assert list(loaded.models) == shards
+    assert [type(shard) for shard in loaded.models] == [type(shard) for shard in pd.Index(shards).tolist()]
+    guid = lambda m: m.get_metadata()['model_guid']
+    assert [guid(loaded.models[shard]) for shard in shards] == [guid(model.models[shard]) for shard in shards]
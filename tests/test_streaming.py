@@ -0,0 +1,29 @@
+import numpy as np
+from catboost import CatBoostRegressor
+
+from benchmarks.synthetic_data import generate_sales_data
+from feature_store import build_feature_store, iter_partitions, stored_feature_cols, stored_months
+from streaming import load_pool, recent_training_frame, write_pool_file
+from tuning import fit_tuned
+
+
+def test_pool_holds_the_history_and_tuning_the_recent_months(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    build_feature_store(generate_sales_data(1200, months=10, seed=2), store_dir)
+    feature_cols = stored_feature_cols(store_dir)
+    path, cd_path = write_pool_file(store_dir, feature_cols, 'Margin_Per_Unit', str(tmp_path / 'pool.tsv'))
+    pool = load_pool(path, cd_path)
+    rows = {month: len(part) for month, part in iter_partitions(store_dir)}
+    assert pool.num_row() == sum(rows.values())
+    assert pool.is_quantized()
+
+    X, y = recent_training_frame(store_dir, feature_cols, 'Margin_Per_Unit', n_months=3)
+    assert len(X) == sum(rows[month] for month in stored_months(store_dir)[-3:])
+    assert list(X.columns) == feature_cols
+
+    grid = {'iterations': [5], 'depth': [2, 3]}
+    model, best_params = fit_tuned(CatBoostRegressor, X, y, 'neg_mean_absolute_error', param_grid=grid, cv=2,
+                                   cache_dir=None, final_pool=pool, model_params={'allow_writing_files': False})
+    assert set(best_params) == set(grid)
+    assert model.get_params()['depth'] == best_params['depth']
+    assert np.isfinite(model.predict(X)).all()
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from catboost import CatBoostRegressor
+
+from benchmarks.synthetic_data import generate_sales_data
+from feature_engineering import engineer_features
+import training
+from training import monthwise_validation, walk_forward_backtest
+from tuning import categorical_features
+
+GRID = {'iterations': [20, 40], 'depth': [4], 'learning_rate': [0.1]}
+
+
+@pytest.fixture(scope='module')
+def engineered():
+    return engineer_features(generate_sales_data(1500, months=12, seed=0))
+
+
+def test_fold_model_matches_a_fit_on_its_training_months(engineered):
+    df_eng, feature_cols = engineered
+    params = {'iterations': [30], 'depth': [4], 'learning_rate': [0.1]}
+    results, models = walk_forward_backtest(df_eng, feature_cols, months_back=1, param_grid=params, cache_dir=None)
+    month = results['months'][0]
+    train = df_eng[df_eng['YearMonth'] < month]
+    test = df_eng[df_eng['YearMonth'] == month]
+    # Quantization borders come from the training months only, as in a plain fit on them
+    model = CatBoostRegressor(verbose=0, random_state=42, iterations=30, depth=4, learning_rate=0.1)
+    model.fit(train[feature_cols], train['Margin_Per_Unit'], cat_features=categorical_features(train[feature_cols]))
+    np.testing.assert_allclose(models[month].predict(test[feature_cols]), model.predict(test[feature_cols]))
+
+
+def test_tuning_kwargs_reach_the_fold_search(engineered, monkeypatch, capsys):
+    df_eng, feature_cols = engineered
+    calls = []
+
+    def tune_params(*args, **kwargs):
+        calls.append(kwargs)
+        return {'iterations': 25, 'depth': 4, 'learning_rate': 0.1}
+
+    monkeypatch.setattr(training, 'tune_params', tune_params)
+    _, _, _, results = monthwise_validation(df_eng, feature_cols, months_back=2, param_grid=GRID, max_workers=1,
+                                            cache_dir=None, search='halving', early_stopping_rounds=3)
+    assert [(c['search'], c['early_stopping_rounds'], c['param_grid']) for c in calls] == [('halving', 3, GRID)] * 2
+    assert results['CatBoost']['best_params'] == [{'iterations': 25, 'depth': 4, 'learning_rate': 0.1}] * 2
+    assert 'Average Validation Scores (last 2 months)' in capsys.readouterr().out
@@ -0,0 +1,128 @@
+"""
+Equivalence of the sorted-window engine (rolling_window_stats and the add_* helpers built on it) with the
+row-wise implementations it replaced, which re-filtered the whole frame for every row.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import feature_engineering as fe
+from benchmarks.synthetic_data import generate_sales_data
+
+
+def reference_window_stats(df, group_col, target, months):
+    """
+    The replaced row-wise computation: for every row, filter the rows of its group dated within
+    [date - 1 day - months, date - 1 day] and aggregate them.
+    df must be sorted by Transaction_Date; the legacy helpers sorted with an unstable sort, so the
+    order of same-day rows (which lag1 depends on) is pinned here by sorting stably beforehand.
+    """
+    stats = {'mean': [], 'std': [], 'lag1': [], 'count': []}
+    for _, row in df.iterrows():
+        end_date = row['Transaction_Date'] - pd.Timedelta(days=1)
+        start_date = end_date - pd.DateOffset(months=months)
+        in_window = (df[group_col] == row[group_col]) & (df['Transaction_Date'] >= start_date) & (df['Transaction_Date'] <= end_date)
+        stats['count'].append(int(in_window.sum()))
+        if target is None:
+            continue
+        window = df.loc[in_window, target]
+        stats['mean'].append(window.mean() if len(window) > 0 else np.nan)
+        stats['std'].append(window.std() if len(window) > 0 else np.nan)
+        stats['lag1'].append(window.iloc[-1] if len(window) > 0 else np.nan)
+    return {stat: np.asarray(values, dtype=float) for stat, values in stats.items() if values}
+
+
+@pytest.fixture
+def sales():
+    """
+    Small date-sorted history with many same-day rows, missing targets and missing group keys.
+    """
+    rng = np.random.default_rng(7)
+    n = 400
+    df = pd.DataFrame({
+        'Customer_Name': rng.choice(['C1', 'C2', 'C3', 'C4', 'C5'], n),
+        'Product_Level_2': rng.choice(['P1', 'P2', 'P3'], n),
+        'Plant': rng.choice(['L1', 'L2'], n),
+        # 400 rows over ~26 months of 120 distinct days: most dates are shared by several rows
+        'Transaction_Date': pd.Timestamp('2022-01-01') + pd.to_timedelta(rng.choice(np.arange(0, 800, 7)[:120], n), unit='D'),
+        'Margin_Per_Unit': np.round(rng.normal(100, 20, n), 2)
+    })
+    df.loc[rng.choice(n, 15, replace=False), 'Margin_Per_Unit'] = np.nan
+    df.loc[rng.choice(n, 10, replace=False), 'Customer_Name'] = np.nan
+    df['Customer_Product'] = df['Customer_Name'] + '_' + df['Product_Level_2']
+    return df.sort_values('Transaction_Date', kind='mergesort').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('months', [1, 3, 6, 12])
+@pytest.mark.parametrize('group_col', ['Customer_Name', 'Product_Level_2', 'Customer_Product'])
+def test_rolling_window_stats_matches_row_wise(sales, group_col, months):
+    expected = reference_window_stats(sales, group_col, 'Margin_Per_Unit', months)
+    result = fe.rolling_window_stats(sales, group_col, 'Margin_Per_Unit', months=months)
+    for stat in ('mean', 'std', 'lag1', 'count'):
+        np.testing.assert_allclose(result[stat], expected[stat], rtol=1e-12, atol=1e-9, equal_nan=True, err_msg=stat)
+
+
+def test_count_only_needs_no_target(sales):
+    expected = reference_window_stats(sales, 'Plant', None, 12)
+    result = fe.rolling_window_stats(sales, 'Plant', months=12, stats=('count',))
+    np.testing.assert_array_equal(result['count'], expected['count'])
+
+
+@pytest.mark.parametrize('add_func, args, columns, months', [
+    (fe.add_rolling_features_12m, ('Customer_Name', 'Margin_Per_Unit'),
+     {'mean': 'Customer_Name_margin_rollmean_12m', 'std': 'Customer_Name_margin_rollstd_12m',
+      'lag1': 'Customer_Name_margin_lag1_12m'}, 12),
+    (fe.add_count_features_12m, ('Product_Level_2',), {'count': 'Product_Level_2_txn_count_12m'}, 12),
+    (fe.add_target_encoding_12m, ('Customer_Product',), {'mean': 'Customer_Product_target_enc_12m'}, 12),
+    (fe.add_segment_mean_6m, ('Plant', 'Margin_Per_Unit'), {'mean': 'Plant_mean_margin_6m'}, 6),
+])
+def test_add_helpers_match_row_wise(sales, add_func, args, columns, months):
+    target = None if add_func is fe.add_count_features_12m else 'Margin_Per_Unit'
+    expected = reference_window_stats(sales, args[0], target, months)
+    # Shuffled input: the helpers sort by date themselves and keep the index labels
+    shuffled = sales.sample(frac=1, random_state=3)
+    result = add_func(shuffled.copy(), *args).sort_index()
+    assert list(result.columns) == list(sales.columns) + list(columns.values())
+    for stat, column in columns.items():
+        if stat == 'lag1':
+            # Same-day rows keep their shuffled order, so lag1 may pick another row of the last day
+            continue
+        np.testing.assert_allclose(result[column].to_numpy(dtype=float), expected[stat], rtol=1e-12, atol=1e-9,
+                                   equal_nan=True, err_msg=column)
+
+
+def test_lag1_takes_the_last_row_of_the_latest_day(sales):
+    result = fe.add_rolling_features_12m(sales.copy(), 'Customer_Name', 'Margin_Per_Unit')
+    expected = reference_window_stats(sales, 'Customer_Name', 'Margin_Per_Unit', 12)
+    np.testing.assert_allclose(result['Customer_Name_margin_lag1_12m'], expected['lag1'], equal_nan=True)
+
+
+@pytest.mark.parametrize('n_workers', [1, 2, 3])
+def test_compute_window_features_matches_add_helpers(sales, n_workers):
+    specs = [spec for kind in fe.window_feature_specs().values() for spec in kind if spec[0] in sales]
+    result = fe.compute_window_features(sales, specs, n_workers=n_workers)
+    for group_col, target, months, columns in specs:
+        expected = fe.rolling_window_stats(sales, group_col, target, months=months, stats=tuple(columns))
+        for stat, column in columns.items():
+            # Bitwise: partitions must not change the rolling kernels' summation order
+            np.testing.assert_array_equal(result[column], expected[stat], err_msg=column)
+
+
+@pytest.mark.parametrize('with_history', [False, True])
+def test_engineer_features_in_a_pool_matches_serial(with_history):
+    df = generate_sales_data(800, months=18, seed=5)
+    rng = np.random.default_rng(5)
+    # Missing group keys (one partition holds all of them) and missing targets
+    for col in ('Customer_Name', 'Product_Level_2', 'Plant'):
+        df.loc[rng.choice(len(df), 20, replace=False), col] = np.nan
+    df.loc[rng.choice(len(df), 20, replace=False), 'Margin_Per_Unit'] = np.nan
+    history = None
+    if with_history:
+        cutoff = df['Transaction_Date'].min() + pd.DateOffset(months=13)
+        history, df = df[df['Transaction_Date'] < cutoff], df[df['Transaction_Date'] >= cutoff]
+    serial, serial_cols = fe.engineer_features(df, history=history)
+    pooled, pooled_cols = fe.engineer_features(df, history=history, n_workers=2)
+    assert pooled_cols == serial_cols
+    # Missing keys come out filled with '-1'
+    assert (serial['Customer_Name'].astype(object) == '-1').any()
+    pd.testing.assert_frame_equal(pooled, serial, check_exact=True)
@@ -1,59 +1,174 @@
+import time
+
 import numpy as np
-from sklearn.model_selection import GridSearchCV
-from sklearn.metrics import r2_score, mean_absolute_percentage_error
-from catboost import CatBoostRegressor
+import pandas as pd
+from sklearn.metrics import mean_absolute_error, mean_absolute_percentage_error, r2_score
+from sklearn.model_selection import ParameterGrid
+from catboost import CatBoostRegressor, Pool
+from instrumentation import instrumented
+from parallel import process_pool
+from tuning import (PARAM_GRID, TUNING_CACHE_DIR, balance_parallelism, fit_tuned, load_cached_params, save_cached_params,
+                    tune_params, tuning_cache_key)
+
+# Feature frame shared by the folds of a walk-forward backtest (one copy per worker process)
+_BACKTEST_FRAME = None
 
-def monthwise_validation(df, feature_cols, target_col='Margin_Per_Unit', months_back=6):
+def _set_backtest_frame(frame):
     """
-    Perform month-wise validation for the last `months_back` months using CatBoost only.
-    Returns validation metrics and the best model.
+    Process-pool initializer: keep the feature frame once per worker.
+    """
+    global _BACKTEST_FRAME
+    _BACKTEST_FRAME = frame
+
+@instrumented
+def _run_backtest_fold(month, train_idx, test_idx, feature_cols, target_col, cat_features, param_grid, cv, best_params,
+                       thread_count, n_jobs, random_state, tuning_kwargs):
+    """
+    Quantize the fold's training rows once into a CatBoost Pool (borders from those rows only), tune unless
+    best_params is given, fit on the pool and score the month.
+    Without tuning_kwargs the search runs on slices of the pool and mirrors GridSearchCV(cv=cv,
+    scoring='neg_mean_absolute_error'): contiguous folds, first best candidate wins. Otherwise (search=,
+    early_stopping_rounds=, ...) it is delegated to tuning.tune_params on the fold's raw rows.
+    """
+    start = time.perf_counter()
+    base_params = {'verbose': 0, 'random_state': random_state, 'thread_count': thread_count}
+    train = _BACKTEST_FRAME.iloc[train_idx]
+    pool = Pool(train[feature_cols], label=train[target_col], cat_features=cat_features)
+    pool.quantize()
+    if best_params is None and tuning_kwargs:
+        best_params = tune_params(CatBoostRegressor, train[feature_cols], train[target_col], 'neg_mean_absolute_error',
+                                  param_grid=param_grid, cv=cv, n_jobs=n_jobs, cache_dir=None,
+                                  random_state=random_state, thread_count=thread_count, **tuning_kwargs)
+    elif best_params is None:
+        folds = np.array_split(np.arange(len(train_idx)), cv)
+        best_mae = np.inf
+        for params in ParameterGrid(param_grid):
+            fold_mae = []
+            for k in range(cv):
+                fit_idx = np.concatenate([folds[j] for j in range(cv) if j != k])
+                model = CatBoostRegressor(eval_metric='MAE', use_best_model=False, **base_params, **params)
+                model.fit(pool.slice(fit_idx), eval_set=pool.slice(folds[k]))
+                fold_mae.append(model.get_evals_result()['validation']['MAE'][-1])
+            if np.mean(fold_mae) < best_mae:
+                best_mae = np.mean(fold_mae)
+                best_params = params
+    model = CatBoostRegressor(**base_params, **best_params)
+    model.fit(pool)
+    test = _BACKTEST_FRAME.iloc[test_idx]
+    y_pred = model.predict(test[feature_cols])
+    return {
+        'month': month,
+        'model': model,
+        'best_params': best_params,
+        'r2': r2_score(test[target_col], y_pred),
+        'mape': mean_absolute_percentage_error(test[target_col], y_pred),
+        'mae': mean_absolute_error(test[target_col], y_pred),
+        'seconds': time.perf_counter() - start
+    }
+
+@instrumented
+def walk_forward_backtest(df, feature_cols, target_col='Margin_Per_Unit', months_back=6, param_grid=None, cv=3,
+                          max_workers=None, cat_features=None, cache_dir=TUNING_CACHE_DIR, random_state=42,
+                          n_jobs=None, thread_count=None, **tuning_kwargs):
     """
-    model = CatBoostRegressor(verbose=0, random_state=42)
-    param_grid = {'iterations': [100, 200], 'depth': [6, 8], 'learning_rate': [0.05, 0.1]}
+    Expanding-window backtest over the last `months_back` months, with the folds trained concurrently.
+    Each fold quantizes its training months once into a CatBoost Pool, so the borders never see the
+    test month, and its grid search slices that pool by row index instead of rebuilding its dataset for
+    every candidate. The feature frame is sent once to each worker, so memory grows with max_workers
+    rather than with the folds. tuning_kwargs (search=, early_stopping_rounds=, eval_fraction=) switch
+    the fold search to tuning.tune_params; n_jobs and thread_count are as in tune_params.
+    Best params per fold are cached like tuning.tune_params, so unchanged months skip the search.
+    Returns (results, models): results has the same per-month 'r2', 'mape' and 'best_params' lists as
+    monthwise_validation plus 'mae', 'months' and 'fold_seconds'; models maps each month to its fitted model.
+    """
+    param_grid = PARAM_GRID if param_grid is None else param_grid
+    if cat_features is None:
+        cat_features = [c for c in feature_cols if not pd.api.types.is_numeric_dtype(df[c])]
+    year_month = df['YearMonth'].to_numpy()
     last_month = df['YearMonth'].max()
     months = [last_month - i for i in range(months_back, 0, -1)]
-    results = {'CatBoost': {'r2': [], 'mape': [], 'best_params': []}}
-    best_model = None
+    settings = {'scoring': 'neg_mean_absolute_error', 'param_grid': param_grid, 'cv': cv,
+                'search': 'walk_forward_pool', 'random_state': random_state, **tuning_kwargs}
+    folds = []
     for month in months:
-        train = df[df['YearMonth'] < month]
-        test = df[df['YearMonth'] == month]
-        if len(test) == 0 or len(train) == 0:
+        train_idx = np.flatnonzero(year_month < month)
+        test_idx = np.flatnonzero(year_month == month)
+        if len(test_idx) == 0 or len(train_idx) == 0:
             continue
-        X_train = train[feature_cols]
-        y_train = train[target_col]
-        X_test = test[feature_cols]
-        y_test = test[target_col]
-        grid = GridSearchCV(model, param_grid, cv=3, scoring='neg_mean_absolute_error', n_jobs=-1)
-        grid.fit(X_train, y_train)
-        best_model = grid.best_estimator_
-        y_pred = best_model.predict(X_test)
-        r2 = r2_score(y_test, y_pred)
-        mape = mean_absolute_percentage_error(y_test, y_pred)
-        results['CatBoost']['r2'].append(r2)
-        results['CatBoost']['mape'].append(mape)
-        results['CatBoost']['best_params'].append(grid.best_params_)
-        print(f"CatBoost | Month: {month} | R2: {r2:.4f} | MAPE: {mape:.4f} | Best Params: {grid.best_params_}")
+        cache_key = None
+        if cache_dir is not None:
+            cache_key = tuning_cache_key(CatBoostRegressor, df[feature_cols].iloc[train_idx], df[target_col].iloc[train_idx], settings)
+        folds.append((month, train_idx, test_idx, cache_key))
+
+    n_workers, balanced_threads = balance_parallelism(len(folds), max_workers)
+    # With several fold processes, each search keeps to its own process and share of the cores
+    fold_jobs = n_jobs if n_workers == 1 else 1
+    frame = df[list(dict.fromkeys(feature_cols + [target_col]))]
+    tasks = [(month, train_idx, test_idx, feature_cols, target_col, cat_features, param_grid, cv,
+              load_cached_params(cache_key, cache_dir), thread_count or balanced_threads, fold_jobs, random_state,
+              tuning_kwargs)
+             for month, train_idx, test_idx, cache_key in folds]
+    fold_results = {}
+    if n_workers == 1:
+        _set_backtest_frame(frame)
+        try:
+            for task in tasks:
+                fold_results[task[0]] = _run_backtest_fold(*task)
+        finally:
+            _set_backtest_frame(None)
+    else:
+        with process_pool(n_workers, initializer=_set_backtest_frame, initargs=(frame,)) as executor:
+            futures = [executor.submit(_run_backtest_fold, *task) for task in tasks]
+            for future in futures:
+                result = future.result()
+                fold_results[result['month']] = result
+
+    results = {'r2': [], 'mape': [], 'mae': [], 'best_params': [], 'months': [], 'fold_seconds': []}
+    models = {}
+    for month, _, _, cache_key in folds:
+        fold = fold_results[month]
+        save_cached_params(cache_key, fold['best_params'], cache_dir)
+        results['r2'].append(fold['r2'])
+        results['mape'].append(fold['mape'])
+        results['mae'].append(fold['mae'])
+        results['best_params'].append(fold['best_params'])
+        results['months'].append(month)
+        results['fold_seconds'].append(fold['seconds'])
+        models[month] = fold['model']
+    return results, models
+
+def monthwise_validation(df, feature_cols, target_col='Margin_Per_Unit', months_back=6, param_grid=None, max_workers=None, **tuning_kwargs):
+    """
+    Perform month-wise validation for the last `months_back` months using CatBoost only.
+    Months are trained concurrently by walk_forward_backtest, each on a pool quantized from its training months.
+    tuning_kwargs (cv, search, early_stopping_rounds, cache_dir, ...) go to walk_forward_backtest.
+    Returns validation metrics and the best model.
+    """
+    fold_results, models = walk_forward_backtest(df, feature_cols, target_col, months_back=months_back,
+                                                 param_grid=param_grid, max_workers=max_workers, **tuning_kwargs)
+    results = {'CatBoost': fold_results}
+    best_model = models[fold_results['months'][-1]] if models else None
+    for month, r2, mape, params, seconds in zip(fold_results['months'], fold_results['r2'], fold_results['mape'],
+                                                fold_results['best_params'], fold_results['fold_seconds']):
+        print(f"CatBoost | Month: {month} | R2: {r2:.4f} | MAPE: {mape:.4f} | Best Params: {params} | Fold time: {seconds:.1f}s")
     avg_r2 = np.mean(results['CatBoost']['r2'])
     avg_mape = np.mean(results['CatBoost']['mape'])
-    print("\nAverage Validation Scores (last 6 months):")
+    print(f"\nAverage Validation Scores (last {months_back} months):")
     print(f"CatBoost: R2={avg_r2:.4f}, MAPE={avg_mape:.4f}")
     print(f"\nBest algorithm: CatBoost")
     return 'CatBoost', best_model, {'CatBoost': (avg_r2, avg_mape)}, results
 
-def train_final_model(df, feature_cols, best_alg, param_grids, target_col='Margin_Per_Unit'):
+def train_final_model(df, feature_cols, best_alg, param_grids, target_col='Margin_Per_Unit', **tuning_kwargs):
     """
     Retrain CatBoost on all data except the latest month.
     Returns the trained model and the test set for the latest month.
     """
-    model = CatBoostRegressor(verbose=0, random_state=42)
     latest_month = df['YearMonth'].max()
     train = df[df['YearMonth'] < latest_month]
     test = df[df['YearMonth'] == latest_month]
     X_train = train[feature_cols]
     y_train = train[target_col]
-    X_test = test[feature_cols]
-    grid = GridSearchCV(model, param_grids['CatBoost'], cv=3, scoring='neg_mean_absolute_error', n_jobs=-1)
-    grid.fit(X_train, y_train)
-    best_model = grid.best_estimator_
-    print(f"\nBest parameters for final model: {grid.best_params_}")
-    return best_model, test 
\ No newline at end of file
+    best_model, best_params = fit_tuned(CatBoostRegressor, X_train, y_train, scoring='neg_mean_absolute_error',
+                                        param_grid=param_grids['CatBoost'], **tuning_kwargs)
+    print(f"\nBest parameters for final model: {best_params}")
+    return best_model, test
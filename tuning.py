@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import GridSearchCV
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (enables HalvingGridSearchCV)
+from sklearn.model_selection import HalvingGridSearchCV
+from instrumentation import span
+
+# Default hyperparameter grid shared by the classifier and the regressor
+PARAM_GRID = {
+    'iterations': [100, 200],
+    'depth': [6, 8],
+    'learning_rate': [0.05, 0.1]
+}
+TUNING_CACHE_DIR = '.tuning_cache'
+
+
+def balance_parallelism(n_tasks, n_jobs=None):
+    """
+    Split the available cores between search processes and CatBoost threads so that
+    n_jobs * thread_count does not exceed the core count (no oversubscription).
+    Returns (n_jobs, thread_count).
+    """
+    n_cpus = os.cpu_count() or 1
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = min(n_tasks, n_cpus)
+    n_jobs = max(1, min(n_jobs, n_cpus))
+    thread_count = max(1, n_cpus // n_jobs)
+    return n_jobs, thread_count
+
+
+def categorical_features(X):
+    """
+    Columns of X that CatBoost must treat as categorical (anything non-numeric).
+    """
+    return [c for c in X.columns if not pd.api.types.is_numeric_dtype(X[c])]
+
+
+def tuning_cache_key(estimator_cls, X, y, settings):
+    """
+    Hash the training data, the feature list and the search settings into a cache key.
+    """
+    digest = hashlib.sha256()
+    digest.update(estimator_cls.__name__.encode())
+    digest.update(json.dumps(list(X.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+    digest.update(pd.util.hash_pandas_object(pd.Series(np.asarray(y).ravel()), index=False).to_numpy().tobytes())
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def load_cached_params(cache_key, cache_dir=TUNING_CACHE_DIR):
+    """
+    Return the best params cached under cache_key, or None if there are none (or caching is off).
+    """
+    if cache_key is None or cache_dir is None:
+        return None
+    cache_path = os.path.join(cache_dir, f'{cache_key}.json')
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path) as f:
+        return json.load(f)
+
+
+def save_cached_params(cache_key, best_params, cache_dir=TUNING_CACHE_DIR):
+    """
+    Cache best params under cache_key (no-op when caching is off).
+    """
+    if cache_key is None or cache_dir is None:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, f'{cache_key}.json'), 'w') as f:
+        json.dump(best_params, f)
+
+
+def tune_params(
+    estimator_cls,
+    X,
+    y,
+    scoring,
+    param_grid=None,
+    cv=3,
+    search='grid',
+    early_stopping_rounds=None,
+    eval_fraction=0.1,
+    n_jobs=None,
+    cache_dir=TUNING_CACHE_DIR,
+    random_state=42,
+    thread_count=None
+):
+    """
+    Find the best CatBoost hyperparameters for (X, y) with cross-validated search.
+    search: 'grid' (GridSearchCV) or 'halving' (HalvingGridSearchCV, successive halving on samples).
+    early_stopping_rounds: if set, the last eval_fraction of rows (the most recent ones for date-sorted
+    data) is held out as eval_set, every fit stops early on it, and the best iteration count is returned
+    as 'iterations'.
+    Best params are cached in cache_dir keyed by a hash of the data, feature list and settings, so an
+    unchanged month skips the search entirely. Set cache_dir=None to disable the cache.
+    thread_count overrides the CatBoost threads per fit (e.g. when several searches share the cores).
+    Returns a dict of best params.
+    """
+    param_grid = PARAM_GRID if param_grid is None else param_grid
+    settings = {
+        'scoring': scoring, 'param_grid': param_grid, 'cv': cv, 'search': search,
+        'early_stopping_rounds': early_stopping_rounds, 'eval_fraction': eval_fraction,
+        'random_state': random_state
+    }
+    cache_key = tuning_cache_key(estimator_cls, X, y, settings) if cache_dir is not None else None
+    best_params = load_cached_params(cache_key, cache_dir)
+    if best_params is not None:
+        print(f"Using cached {estimator_cls.__name__} params: {best_params}")
+        return best_params
+
+    # Passed at fit time: sklearn cannot clone a CatBoost estimator built with cat_features
+    fit_params = {'cat_features': categorical_features(X) or None}
+    X_fit, y_fit = X, y
+    if early_stopping_rounds:
+        n_fit = int(len(X) * (1 - eval_fraction))
+        X_fit, y_fit = X.iloc[:n_fit], y.iloc[:n_fit]
+        fit_params.update({'eval_set': (X.iloc[n_fit:], y.iloc[n_fit:]), 'early_stopping_rounds': early_stopping_rounds})
+
+    n_candidates = int(np.prod([len(v) for v in param_grid.values()]))
+    n_jobs, balanced_threads = balance_parallelism(n_candidates * cv, n_jobs)
+    thread_count = thread_count or balanced_threads
+    model = estimator_cls(verbose=0, random_state=random_state, thread_count=thread_count)
+    if search == 'grid':
+        grid = GridSearchCV(model, param_grid, cv=cv, scoring=scoring, n_jobs=n_jobs, refit=False)
+    elif search == 'halving':
+        grid = HalvingGridSearchCV(model, param_grid, cv=cv, scoring=scoring, n_jobs=n_jobs, refit=False,
+                                   random_state=random_state)
+    else:
+        raise ValueError(f"Unknown search strategy: {search}")
+    with span('tuning.search', rows=len(X_fit), estimator=estimator_cls.__name__, search=search,
+              candidates=n_candidates, cv=cv, n_jobs=n_jobs):
+        grid.fit(X_fit, y_fit, **fit_params)
+    best_params = dict(grid.best_params_)
+
+    if early_stopping_rounds:
+        # Refit the winning candidate once to read off where early stopping settled
+        best = estimator_cls(verbose=0, random_state=random_state, thread_count=-1, **best_params)
+        best.fit(X_fit, y_fit, **fit_params)
+        best_params['iterations'] = int(best.get_best_iteration()) + 1
+
+    save_cached_params(cache_key, best_params, cache_dir)
+    return best_params
+
+
+def fit_tuned(estimator_cls, X, y, scoring, random_state=42, final_pool=None, model_params=None, **tuning_kwargs):
+    """
+    Tune hyperparameters with tune_params and fit the final model on all of (X, y).
+    final_pool: a catboost.Pool to fit the final model on instead (X, y are then only the tuning sample,
+    e.g. the recent months of a history that is trained from a pool file). model_params are extra
+    estimator parameters for the final model only (e.g. class_names).
+    Returns (model, best_params).
+    """
+    best_params = tune_params(estimator_cls, X, y, scoring, random_state=random_state, **tuning_kwargs)
+    model = estimator_cls(verbose=0, random_state=random_state, thread_count=tuning_kwargs.get('thread_count') or -1,
+                          **(model_params or {}), **best_params)
+    if final_pool is not None:
+        with span('tuning.final_fit', rows=final_pool.num_row(), estimator=estimator_cls.__name__):
+            model.fit(final_pool)
+        return model, best_params
+    with span('tuning.final_fit', rows=len(X), estimator=estimator_cls.__name__):
+        model.fit(X, y, cat_features=categorical_features(X) or None)
+    return model, best_params